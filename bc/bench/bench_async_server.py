@@ -0,0 +1,95 @@
+"""
+Load test of the asyncio server engine.
+
+Every simulated client logs in and then lists the available appointments of a provider over
+fresh connections, all clients running concurrently. Optionally some clients connect and then
+stall without sending anything, which must not slow down the others.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from bc.bench.util import make_server_state, provider_name, raise_file_limit
+from bc.common.comm_util import Message, RequestGenerator
+from bc.server.async_server import AsyncServer
+
+DELIMITER = b'\xff'
+
+async def _request(address, request: Message) -> Message:
+    reader, writer = await asyncio.open_connection(*address)
+    try:
+        writer.write(request.to_bytes() + DELIMITER)
+        await writer.drain()
+        reply = await reader.readuntil(DELIMITER)
+        return Message.from_bytes(reply[:-len(DELIMITER)])
+    finally:
+        writer.close()
+
+async def _client(address, user_index: int, providers: int, requests: int) -> int:
+    login = RequestGenerator.msg_login("User{}".format(user_index), "pwd{}".format(user_index))
+    reply = await _request(address, login)
+    if not reply.data()["OK"]:
+        raise RuntimeError("Login failed: {}".format(reply.data()))
+
+    req_gen = RequestGenerator.from_login_reply(reply)
+    for i in range(requests - 1):
+        request = req_gen.msg_list_available_appointments(provider_name(i % providers))
+        reply = await _request(address, request)
+        if not reply.data()["OK"]:
+            raise RuntimeError("Listing failed: {}".format(reply.data()))
+
+    return requests
+
+async def _stalled_client(address, stop: asyncio.Event) -> None:
+    _, writer = await asyncio.open_connection(*address)
+    await stop.wait()
+    writer.close()
+
+async def run(clients: int, requests: int, stalled: int, providers: int, slots: int) -> None:
+    """
+    Runs the load test and prints the results.
+    """
+
+    server = AsyncServer("127.0.0.1", 0, make_server_state(providers, slots, clients))
+    await server.start()
+    address = server.address()
+
+    stop = asyncio.Event()
+    stalled_tasks = [asyncio.ensure_future(_stalled_client(address, stop))
+                     for _ in range(stalled)]
+    await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    done = await asyncio.gather(*(_client(address, i, providers, requests)
+                                  for i in range(1, clients + 1)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await asyncio.gather(*stalled_tasks)
+    await server.close()
+
+    total = sum(done)
+    print("clients: {}, stalled clients: {}, requests: {}".format(clients, stalled, total),
+          file=sys.stderr)
+    print("elapsed: {:.3f} s, throughput: {:.0f} requests/s".format(elapsed, total / elapsed),
+          file=sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5,
+                        help="Requests per client, including the login.")
+    parser.add_argument("--stalled", type=int, default=100)
+    parser.add_argument("--providers", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=50)
+    args = parser.parse_args()
+
+    # Every connection needs a descriptor both on the client and on the server side.
+    raise_file_limit(4 * (args.clients + args.stalled) + 64)
+
+    asyncio.run(run(args.clients, args.requests, args.stalled, args.providers, args.slots))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares the codecs on typical messages: encode and decode time and encoded size.
+"""
+
+import argparse
+import pickle
+import timeit
+
+from bc.bench.util import make_time_slots
+from bc.common.comm_util import BINARY_CODEC, Message, PICKLE_CODEC, RequestGenerator
+from bc.common.entities import Appointment, ServiceProvider
+
+def _messages():
+    provider = ServiceProvider("Haakon Doctorsen")
+    req_gen = RequestGenerator(1234)
+    appointment = Appointment(provider, make_time_slots(1)[0])
+    listing = "\n".join(str(Appointment(provider, time_slot))
+                        for time_slot in make_time_slots(1000))
+
+    return [
+        ("login", RequestGenerator.msg_login("User1", "pwd1")),
+        ("list available", req_gen.msg_list_available_appointments("Haakon Doctorsen")),
+        ("add to basket", req_gen.msg_add_appointment_to_basket(appointment)),
+        ("reply", Message({"OK": True, "text": "OK.", "request_id": 17})),
+        ("listing reply", Message({"OK": True, "text": listing, "request_id": 17})),
+        ]
+
+def run(number: int) -> None:
+    """
+    Runs the benchmark and prints the results.
+    """
+
+    codecs = [("pickle0", PICKLE_CODEC), ("binary", BINARY_CODEC)]
+
+    print("{:<16} {:<8} {:>8} {:>12} {:>12}".format("message", "codec", "bytes",
+                                                     "encode (us)", "decode (us)"))
+    for name, message in _messages():
+        for codec_name, codec in codecs:
+            data = message.to_bytes(codec)
+            encode = timeit.timeit(lambda: message.to_bytes(codec), number=number)
+            decode = timeit.timeit(lambda: Message.from_bytes(data, codec), number=number)
+
+            print("{:<16} {:<8} {:>8} {:>12.2f} {:>12.2f}".format(
+                name, codec_name, len(data), 1e6 * encode / number, 1e6 * decode / number))
+
+        # The unrestricted unpickler, for reference.
+        data = message.to_bytes(PICKLE_CODEC)
+        decode = timeit.timeit(lambda: pickle.loads(data), number=number)
+        print("{:<16} {:<8} {:>8} {:>12} {:>12.2f}".format(
+            name, "loads", len(data), "", 1e6 * decode / number))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    run(args.number)
+
+if __name__ == '__main__':
+    main()
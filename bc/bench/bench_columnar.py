@@ -0,0 +1,120 @@
+"""
+Compares the memory use and the query latency of the object and the columnar slot stores.
+
+The columnar store is built directly from columns, so it can be measured at 10M slots; the
+object store is measured at a smaller size by default, its memory grows linearly with the slots.
+A tenth of the slots is held by random owners, half of them in baskets, half reserved.
+"""
+
+import argparse
+import random
+import timeit
+import tracemalloc
+
+import numpy
+
+from bc.bench.util import make_time_slots, provider_name
+from bc.common.entities import ServiceProvider
+from bc.server.columnar import ColumnarSlotStore, pack_time_slot
+from bc.server.server_util import ObjectSlotStore, SlotStore, TimeSlotInfo, TimeSlotState
+
+def _random_columns(slots: int, owners: int, seed: int):
+    rng = numpy.random.default_rng(seed)
+    states = numpy.full(slots, TimeSlotState.AVAILABLE.value, dtype=numpy.int8)
+    owner_column = numpy.zeros(slots, dtype=numpy.int64)
+
+    held = rng.choice(slots, slots // 10, replace=False)
+    states[held] = numpy.where(rng.random(len(held)) < 0.5,
+                               TimeSlotState.IN_BASKET.value, TimeSlotState.RESERVED.value)
+    owner_column[held] = rng.integers(1, owners + 1, len(held))
+
+    return states, owner_column
+
+def build_columnar(providers: int, slots_per_provider: int, owners: int) -> ColumnarSlotStore:
+    """
+    Builds a columnar store with synthetic data.
+    """
+
+    packed = numpy.array([pack_time_slot(time_slot)
+                          for time_slot in make_time_slots(slots_per_provider)], dtype=numpy.int32)
+    states, owner_column = _random_columns(providers * slots_per_provider, owners, 0)
+
+    return ColumnarSlotStore.from_columns(
+        [ServiceProvider(provider_name(i)) for i in range(providers)],
+        [slots_per_provider] * providers,
+        numpy.tile(packed, providers),
+        states,
+        owner_column)
+
+def build_object(providers: int, slots_per_provider: int, owners: int) -> ObjectSlotStore:
+    """
+    Builds an object store with the same kind of synthetic data.
+    """
+
+    time_slots = make_time_slots(slots_per_provider)
+    states, owner_column = _random_columns(providers * slots_per_provider, owners, 0)
+    states = states.tolist()
+    owner_column = owner_column.tolist()
+
+    db = dict()
+    for i in range(providers):
+        offset = i * slots_per_provider
+        db[ServiceProvider(provider_name(i))] = [
+            TimeSlotInfo(time_slot, TimeSlotState(states[offset + j]), owner_column[offset + j])
+            for j, time_slot in enumerate(time_slots)]
+
+    return ObjectSlotStore(db)
+
+def measure(name: str, build, providers: int, slots_per_provider: int, owners: int,
+            number: int) -> None:
+    """
+    Builds a store and prints its memory use and query latencies.
+    """
+
+    tracemalloc.start()
+    store: SlotStore = build(providers, slots_per_provider, owners)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    slots = providers * slots_per_provider
+    provider = ServiceProvider(provider_name(providers // 2))
+    time_slot = make_time_slots(slots_per_provider)[-1]
+    rng = random.Random(1)
+
+    def list_available():
+        list(store.appointments_in_state(TimeSlotState.AVAILABLE, provider))
+
+    def list_basket():
+        store.appointments_of_owner(rng.randint(1, owners), TimeSlotState.IN_BASKET)
+
+    def find_and_set():
+        ts_info = store.find_time_slot_info(provider, time_slot)
+        store.set_time_slot_state(provider, ts_info, ts_info.state, ts_info.owner)
+
+    results = [1e3 * timeit.timeit(query, number=number) / number
+               for query in (list_available, list_basket, find_and_set)]
+
+    print("{:<9} {:>11} {:>12.1f} {:>10.1f} {:>16.3f} {:>16.3f} {:>14.4f}".format(
+        name, slots, memory / 2**20, memory / slots, *results))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--providers", type=int, default=1000)
+    parser.add_argument("--slots", type=int, default=10000,
+                        help="Slots per provider in the columnar store.")
+    parser.add_argument("--object-slots", type=int, default=1000,
+                        help="Slots per provider in the object store.")
+    parser.add_argument("--owners", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    print("{:<9} {:>11} {:>12} {:>10} {:>16} {:>16} {:>14}".format(
+        "store", "slots", "memory (MiB)", "bytes/slot", "available (ms)", "basket (ms)",
+        "find+set (ms)"))
+    measure("object", build_object, args.providers, args.object_slots, args.owners, args.number)
+    measure("columnar", build_columnar, args.providers, args.object_slots, args.owners,
+            args.number)
+    measure("columnar", build_columnar, args.providers, args.slots, args.owners, args.number)
+
+if __name__ == '__main__':
+    main()
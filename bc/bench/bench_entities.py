@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of the entities: the memory per time slot and the time of comparing, hashing and
+sorting time slots.
+
+It compares the `__slots__` based `TimeSlot`, which compares its packed ordinal, with a copy of
+the earlier `__dict__` based class, which compared its four fields through method calls.
+"""
+
+import argparse
+import gc
+import random
+import timeit
+import tracemalloc
+
+from typing import Any, Callable, List
+
+from bc.bench.util import make_time_slots
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+
+class _DictTimeSlot:
+    # The earlier `TimeSlot`, without the validation.
+
+    def __init__(self, year: int, month: int, day: int, hour: int) -> None:
+        self._year = year
+        self._month = month
+        self._day = day
+        self._hour = hour
+
+    def year(self) -> int:
+        return self._year
+
+    def month(self) -> int:
+        return self._month
+
+    def day(self) -> int:
+        return self._day
+
+    def hour(self) -> int:
+        return self._hour
+
+    def __eq__(self, other: Any) -> bool:
+        return (self._year == other.year()
+                and self._month == other.month()
+                and self._day == other.day()
+                and self._hour == other.hour())
+
+    def __lt__(self, other: "_DictTimeSlot") -> bool:
+        return ((self._year, self._month, self._day, self._hour)
+                < (other.year(), other.month(), other.day(), other.hour()))
+
+    def __hash__(self) -> int:
+        return hash((self._year, self._month, self._day, self._hour))
+
+def _bytes_per_object(make: Callable[[], List[Any]], count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        objects = make()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # The list itself is not counted.
+    return (size - 8 * len(objects)) / count
+
+def run(count: int, number: int) -> None:
+    """
+    Runs the benchmark and prints the results.
+    """
+
+    fields = [(ts.year(), ts.month(), ts.day(), ts.hour()) for ts in make_time_slots(count)]
+    provider = ServiceProvider("Haakon Doctorsen")
+
+    print("{:<10} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "class", "bytes", "eq (ns)", "lt (ns)", "hash (ns)", "sort (ms)"))
+    for name, cls in (("dict", _DictTimeSlot), ("slots", TimeSlot)):
+        size = _bytes_per_object(lambda cls=cls: [cls(*row) for row in fields], count)
+
+        first, second = cls(*fields[0]), cls(*fields[0])
+        later = cls(*fields[-1])
+        equal = timeit.timeit(lambda: first == second, number=number)
+        less = timeit.timeit(lambda: first < later, number=number)
+        hashed = timeit.timeit(lambda: hash(first), number=number)
+
+        shuffled = [cls(*row) for row in fields]
+        random.Random(0).shuffle(shuffled)
+        sort = timeit.timeit(lambda: sorted(shuffled), number=1)
+
+        print("{:<10} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.2f}".format(
+            name, size, 1e9 * equal / number, 1e9 * less / number, 1e9 * hashed / number,
+            1e3 * sort))
+
+    time_slots = [TimeSlot(*row) for row in fields]
+    size = _bytes_per_object(lambda: [Appointment(provider, ts) for ts in time_slots], count)
+    print("Appointment: {:.1f} bytes, besides its time slot.".format(size))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--number", type=int, default=1000000)
+    args = parser.parse_args()
+
+    run(args.count, args.number)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Measures logins with many users: finding the user by scanning the user list, as logins used to,
+against the username index, the login throughput with the passwords verified on the worker pool,
+and the latency of other requests while logins are being verified.
+
+All the users share one password hash, since hashing a million passwords would take hours; the
+cost of a login does not depend on the hash.
+"""
+
+import argparse
+import random
+import time
+
+from bc.common.comm_util import RequestGenerator
+from bc.server.admission import PendingRequests, RateLimiter
+from bc.server.credentials import hash_password
+from bc.server.server import RequestHandler, ServerBase
+from bc.server.server_util import ServerState, User
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--log2-n", type=int, default=14, help="The scrypt cost of the hash.")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Password verification threads, by default one per CPU.")
+    args = parser.parse_args()
+
+    password_hash = hash_password("pwd", args.log2_n)
+    state = ServerState()
+    start = time.perf_counter()
+    state.users = [User(i, "User{}".format(i), password_hash) for i in range(1, args.users + 1)]
+    print("{} users indexed in {:.2f} s".format(args.users, time.perf_counter() - start))
+
+    rng = random.Random(0)
+    usernames = ["User{}".format(rng.randint(1, args.users)) for _ in range(args.lookups)]
+
+    start = time.perf_counter()
+    for username in usernames:
+        list(filter(lambda user: user.username == username, state.users))
+    scan = (time.perf_counter() - start) / args.lookups
+
+    start = time.perf_counter()
+    for username in usernames:
+        state.find_user(username)
+    index = (time.perf_counter() - start) / args.lookups
+    print("lookup: scan {:.3f} ms, index {:.4f} ms".format(1e3 * scan, 1e3 * index))
+
+    server = ServerBase(state, args.workers or None)
+
+    # The benchmark sends far more requests than the admission control lets a client send.
+    server.rate_limiter = RateLimiter(dict())
+    server.pending = PendingRequests(max_pending=args.logins + 1)
+    handler = RequestHandler(server)
+
+    def handle(request, deferred=False):
+        if deferred:
+            return handler.begin(request.to_bytes(), "127.0.0.1")
+        return handler.handle(request.to_bytes(), "127.0.0.1")
+
+    req_gen = RequestGenerator.from_login_reply(handle(RequestGenerator.msg_login("User1", "pwd")))
+
+    def time_other_requests(count: int) -> float:
+        start = time.perf_counter()
+        replies = [handle(req_gen.msg_list_basket()) for _ in range(count)]
+        elapsed = time.perf_counter() - start
+
+        assert all(reply.data()["OK"] for reply in replies)
+        return elapsed / count
+
+    idle = time_other_requests(1000)
+
+    start = time.perf_counter()
+    pending = [handle(RequestGenerator.msg_login(rng.choice(usernames), "pwd"), deferred=True)
+               for _ in range(args.logins)]
+    busy = time_other_requests(1000)
+    results = [handler.finish(deferred) for deferred in pending]
+    elapsed = time.perf_counter() - start
+
+    assert all(reply.data()["OK"] for reply in results)
+    print("logins: {:.1f} logins/s with scrypt cost 2**{}".format(args.logins / elapsed,
+                                                                   args.log2_n))
+    print("other requests: {:.3f} ms idle, {:.3f} ms while verifying passwords".format(
+        1e3 * idle, 1e3 * busy))
+
+    handler.server.password_verifier.shutdown()
+
+if __name__ == '__main__':
+    main()
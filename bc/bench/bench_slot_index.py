@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the time slot mutations as the number of slots of a provider grows.
+
+It compares looking up a slot by a linear scan of the provider's slot list, which is what the
+handlers used to do, with the `ServerState` slot index, and measures a full add to basket and
+remove from basket round through the request router. It also measures publishing a change to the
+snapshot of the available slots, alone, for the object store and, if NumPy is installed, for the
+columnar store; it should not grow with the slots of the provider.
+"""
+
+import argparse
+import timeit
+
+from bc.bench.util import make_server_state, provider_name
+from bc.common.comm_util import Message, RequestGenerator
+from bc.common.entities import Appointment, ServiceProvider
+from bc.server.server import RequestHandler, ServerBase
+from bc.server.server_util import ChunkedSlotSnapshot
+
+try:
+    import numpy
+    from bc.server.columnar import pack_time_slot, PackedSlotSnapshot
+except ImportError:
+    numpy = None
+
+def _linear_find(ts_infos, time_slot):
+    return list(filter(lambda ts_info: ts_info.time_slot == time_slot, ts_infos))[0]
+
+def run(slot_counts, number: int) -> None:
+    """
+    Runs the benchmark and prints the results.
+    """
+
+    print("{:>8} {:>14} {:>14} {:>18} {:>16} {:>16}".format(
+        "slots", "linear (us)", "index (us)", "add+remove (us)", "publish (us)",
+        "packed pub. (us)"))
+    for slots in slot_counts:
+        state = make_server_state(1, slots, 1)
+        provider = ServiceProvider(provider_name(0))
+        ts_infos = state.service_provider_db[provider]
+
+        # The last slot is the worst case of the linear scan.
+        time_slot = ts_infos[-1].time_slot
+
+        linear = timeit.timeit(lambda: _linear_find(ts_infos, time_slot), number=number)
+        indexed = timeit.timeit(lambda: state.find_time_slot_info(provider, time_slot),
+                                number=number)
+
+        server = ServerBase(state)
+        handler = RequestHandler(server)
+        req_gen = RequestGenerator(1)
+        appointment = Appointment(provider, time_slot)
+        add: Message = req_gen.msg_add_appointment_to_basket(appointment)
+        remove: Message = req_gen.msg_remove_appointment_from_basket(appointment)
+
+        def add_and_remove():
+            RequestHandler.handle_add_appointment_to_basket(handler, add)
+            RequestHandler.handle_remove_appointment_from_basket(handler, remove)
+
+        mutations = timeit.timeit(add_and_remove, number=number)
+
+        time_slots = tuple(ts_info.time_slot for ts_info in ts_infos)
+        snapshots = [ChunkedSlotSnapshot(1, time_slots)]
+        if numpy is not None:
+            snapshots.append(PackedSlotSnapshot(
+                1, numpy.array([pack_time_slot(ts) for ts in time_slots], dtype=numpy.int32)))
+
+        publish = []
+        for snapshot in snapshots:
+            removed = [time_slots[len(time_slots) // 2]]
+            publish.append(1e6 * timeit.timeit(
+                lambda snapshot=snapshot, removed=removed: snapshot.updated([], removed, 2),
+                number=number) / number)
+
+        print(("{:>8} {:>14.2f} {:>14.2f} {:>18.2f}" + " {:>16.2f}" * len(publish)).format(
+            slots, 1e6 * linear / number, 1e6 * indexed / number, 1e6 * mutations / number,
+            *publish))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slots", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    run(args.slots, args.number)
+
+if __name__ == '__main__':
+    main()
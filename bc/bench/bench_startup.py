@@ -0,0 +1,83 @@
+"""
+Measures the startup time of the server with a large service provider database: loading the
+text file with `ServerState.load_service_providers`, with the bulk loader, and from the binary
+format mapped into memory, into the object and the columnar slot stores.
+
+The default database has 2M slots; `--providers 1000 --slots 10000` makes it 10M. The text
+loader is slow and memory hungry at that size, `--skip-text` leaves it out.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from typing import Callable
+
+from bc.bench.util import make_time_slots, provider_name
+from bc.server.bulk_load import convert, load_slot_store
+from bc.server.columnar import ColumnarSlotStore
+from bc.server.server_util import ObjectSlotStore, ServerState
+
+def write_text_file(filename: str, providers: int, slots_per_provider: int) -> None:
+    """
+    Writes a synthetic service provider file in the text format.
+    """
+
+    slots = ";".join("{:04}-{:02}-{:02}-{:02}".format(ts.year(), ts.month(), ts.day(), ts.hour())
+                     for ts in make_time_slots(slots_per_provider))
+    with open(filename, "w") as text_file:
+        for i in range(providers):
+            text_file.write("{};{}\n".format(provider_name(i), slots))
+
+def measure(name: str, function: Callable[[], object], slots: int) -> None:
+    """
+    Runs `function` once and prints how long it took.
+    """
+
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    del result
+
+    print("{:<36} {:>10.2f} {:>14.0f}".format(name, elapsed, slots / elapsed))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", type=int, default=1000)
+    parser.add_argument("--slots", type=int, default=2000, help="Slots per provider.")
+    parser.add_argument("--skip-text", action="store_true",
+                        help="Do not measure the text loader of `ServerState`.")
+    args = parser.parse_args()
+
+    slots = args.providers * args.slots
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_filename = os.path.join(directory, "service_providers.txt")
+        binary_filename = os.path.join(directory, "service_providers.bin")
+        write_text_file(text_filename, args.providers, args.slots)
+
+        def text_loader():
+            state = ServerState()
+            state.load_service_providers(text_filename)
+            return state
+
+        print("{} slots, text file {:.1f} MiB".format(slots,
+                                                      os.path.getsize(text_filename) / 2**20))
+        print("{:<36} {:>10} {:>14}".format("loader", "time (s)", "slots/s"))
+
+        if not args.skip_text:
+            measure("text, object store", text_loader, slots)
+        measure("bulk text, object store",
+                lambda: load_slot_store(text_filename, ObjectSlotStore), slots)
+        measure("bulk text, columnar store",
+                lambda: load_slot_store(text_filename, ColumnarSlotStore), slots)
+        measure("convert text to binary", lambda: convert(text_filename, binary_filename), slots)
+        measure("binary, object store",
+                lambda: load_slot_store(binary_filename, ObjectSlotStore), slots)
+        measure("binary, columnar store",
+                lambda: load_slot_store(binary_filename, ColumnarSlotStore), slots)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+Load generator and latency benchmark for the booking protocol.
+
+It starts a server engine in a separate process on localhost with synthetic data and drives it
+with simulated clients. Every client connects and logs in before the measurement starts, then
+sends a fixed number of requests drawn from a configurable mix over one persistent connection,
+waiting for each reply before sending the next request. It reports the throughput and the
+p50/p99/p999 latency per request type.
+
+The clients draw their requests from RNGs seeded from `--seed`, so two runs with the same
+arguments send the same requests. `--save` writes the results as JSON and `--compare` checks a
+run against saved results, exiting with status 1 if the throughput or a p99 latency regressed by
+more than `--tolerance`.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from bc.bench.util import (make_server_state, make_time_slots, percentile, provider_name,
+                           raise_file_limit)
+from bc.common.comm_util import LengthPrefixedTransceiver, Message, RequestGenerator, RequestType
+from bc.common.entities import Appointment, ServiceProvider
+
+# The operations of the mix and their default weights.
+DEFAULT_MIX = {
+    "login": 1,
+    "list_available": 30,
+    "list_basket": 10,
+    "list_booked": 10,
+    "add": 25,
+    "remove": 5,
+    "confirm": 10,
+    "cancel": 9,
+    }
+
+def _serve(engine: str, providers: int, slots: int, users: int, data_dir: Optional[str],
+           shards: int, address_queue) -> None:
+    """
+    Runs a server in the current process, putting its address into `address_queue`. If
+    `data_dir` is given, the server logs the mutations to a new mutation log in it. The sharded
+    engine runs `shards` shard processes.
+    """
+
+    state = make_server_state(providers, slots, users)
+
+    if engine == "sharded":
+        from bc.server.sharded import serve_sharded
+        serve_sharded(state, "127.0.0.1", 0, shards, data_dir, address_queue)
+        return
+
+    if data_dir is not None:
+        from bc.server.persistence import MutationLog
+        state.mutation_log = MutationLog(data_dir)
+        state.mutation_log.recover(state)
+
+    if engine == "async":
+        from bc.server.async_server import AsyncServer
+
+        async def serve():
+            server = AsyncServer("127.0.0.1", 0, state)
+            await server.start()
+            address_queue.put(server.address())
+            await server.serve_forever()
+
+        asyncio.run(serve())
+    else:
+        from bc.server.server import ConnectionHandler, Server
+
+        with Server(("127.0.0.1", 0), ConnectionHandler, server_state=state) as server:
+            address_queue.put(server.server_address)
+            server.serve_forever()
+
+class _Connection:
+    """
+    A persistent, length prefixed connection that sends a request and waits for its reply.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+
+    async def request(self, request: Message) -> Message:
+        data = request.to_bytes()
+        self._writer.writelines((LengthPrefixedTransceiver.HEADER.pack(len(data)), data))
+
+        header = await self._reader.readexactly(LengthPrefixedTransceiver.HEADER.size)
+        length, = LengthPrefixedTransceiver.HEADER.unpack(header)
+        return Message.from_bytes(await self._reader.readexactly(length))
+
+    def close(self) -> None:
+        self._writer.close()
+
+class _SimulatedClient:
+    """
+    A client that sends a random sequence of requests and records their latencies.
+    """
+
+    def __init__(self,
+                 user_index: int,
+                 rng: random.Random,
+                 mix: Dict[str, int],
+                 appointments: List[Appointment],
+                 latencies: Dict[RequestType, List[float]]) -> None:
+        self._username = "User{}".format(user_index)
+        self._password = "pwd{}".format(user_index)
+        self._rng = rng
+        self._operations = list(mix.keys())
+        self._weights = list(mix.values())
+        self._appointments = appointments
+        self._latencies = latencies
+
+        self._req_gen: Optional[RequestGenerator] = None
+        self._basket: List[Appointment] = []
+        self._booked: List[Appointment] = []
+
+        self._connection: Optional[_Connection] = None
+
+    async def connect(self, address: Tuple[str, int]) -> None:
+        """
+        Connects and logs in. Neither is measured.
+        """
+
+        reader, writer = await asyncio.open_connection(*address)
+        self._connection = _Connection(reader, writer)
+        await self._login(self._connection, measured=False)
+
+    async def run(self, requests: int) -> None:
+        assert self._connection is not None
+
+        for _ in range(requests):
+            operation = self._rng.choices(self._operations, self._weights)[0]
+            await self._run_operation(self._connection, operation)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+
+    async def _timed(self,
+                     connection: _Connection,
+                     request: Message,
+                     measured: bool = True) -> Message:
+        start = time.perf_counter()
+        reply = await connection.request(request)
+        if measured:
+            self._latencies[request.data()["type"]].append(time.perf_counter() - start)
+
+        return reply
+
+    async def _login(self, connection: _Connection, measured: bool = True) -> None:
+        reply = await self._timed(connection,
+                                  RequestGenerator.msg_login(self._username, self._password),
+                                  measured)
+        if not reply.data()["OK"]:
+            raise RuntimeError("Login failed: {}".format(reply.data()))
+
+        self._req_gen = RequestGenerator.from_login_reply(reply)
+
+    async def _run_operation(self, connection: _Connection, operation: str) -> None:
+        req_gen = self._req_gen
+        assert req_gen is not None
+
+        if operation == "login":
+            await self._login(connection)
+        elif operation == "list_available":
+            provider = self._rng.choice(self._appointments).service_provider()
+            await self._timed(connection, req_gen.msg_list_available_appointments(provider.name()))
+        elif operation == "list_basket":
+            await self._timed(connection, req_gen.msg_list_basket())
+        elif operation == "list_booked":
+            await self._timed(connection, req_gen.msg_list_booked_appointments())
+        elif operation == "add":
+            appointment = self._rng.choice(self._appointments)
+            request = req_gen.msg_add_appointment_to_basket(appointment)
+            reply = await self._timed(connection, request)
+            if reply.data()["OK"]:
+                self._basket.append(appointment)
+        elif operation == "remove" and self._basket:
+            appointment = self._basket.pop(self._rng.randrange(len(self._basket)))
+            await self._timed(connection, req_gen.msg_remove_appointment_from_basket(appointment))
+        elif operation == "confirm":
+            reply = await self._timed(connection, req_gen.msg_confirm_booking())
+            if reply.data()["OK"]:
+                self._booked.extend(self._basket)
+                self._basket.clear()
+        elif operation == "cancel" and self._booked:
+            appointment = self._booked.pop(self._rng.randrange(len(self._booked)))
+            await self._timed(connection, req_gen.msg_cancel_appointment(appointment))
+        else:
+            # Nothing to remove or cancel.
+            await self._timed(connection, req_gen.msg_list_basket())
+
+async def _drive(address: Tuple[str, int], args, mix: Dict[str, int]) -> Dict:
+    time_slots = make_time_slots(args.slots)
+    appointments = [Appointment(ServiceProvider(provider_name(i)), time_slot)
+                    for i in range(args.providers) for time_slot in time_slots]
+
+    latencies: Dict[RequestType, List[float]] = defaultdict(list)
+    clients = [_SimulatedClient(i, random.Random(args.seed * 1000003 + i), mix, appointments,
+                                latencies)
+               for i in range(1, args.clients + 1)]
+
+    try:
+        await asyncio.gather(*(client.connect(address) for client in clients))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client.run(args.requests) for client in clients))
+        elapsed = time.perf_counter() - start
+    finally:
+        for client in clients:
+            client.close()
+
+    total = sum(len(values) for values in latencies.values())
+    results: Dict = {"elapsed": elapsed, "requests": total, "throughput": total / elapsed,
+                     "types": dict()}
+    for request_type, values in sorted(latencies.items(), key=lambda item: item[0].value):
+        values.sort()
+        results["types"][request_type.name] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p99": percentile(values, 99),
+            "p999": percentile(values, 99.9),
+            }
+
+    return results
+
+def _print_results(results: Dict) -> None:
+    print("{} requests in {:.2f} s, {:.0f} requests/s".format(
+        results["requests"], results["elapsed"], results["throughput"]))
+    print("{:<32} {:>8} {:>10} {:>10} {:>10}".format("request type", "count", "p50 (ms)",
+                                                     "p99 (ms)", "p999 (ms)"))
+    for name, stats in results["types"].items():
+        print("{:<32} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            name, stats["count"], 1e3 * stats["p50"], 1e3 * stats["p99"], 1e3 * stats["p999"]))
+
+def _compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Returns the regressions of `results` compared to `baseline`.
+    """
+
+    regressions = []
+    if results["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append("throughput: {:.0f} < {:.0f} requests/s".format(
+            results["throughput"], baseline["throughput"]))
+
+    for name, stats in results["types"].items():
+        base = baseline["types"].get(name)
+        if base and stats["p99"] > base["p99"] * (1 + tolerance):
+            regressions.append("{} p99: {:.3f} > {:.3f} ms".format(
+                name, 1e3 * stats["p99"], 1e3 * base["p99"]))
+
+    return regressions
+
+def _parse_mix(text: Optional[str]) -> Dict[str, int]:
+    if not text:
+        return dict(DEFAULT_MIX)
+
+    mix = dict()
+    for item in text.split(","):
+        operation, weight = item.split("=")
+        if operation not in DEFAULT_MIX:
+            raise ValueError("Unknown operation: {}.".format(operation))
+        mix[operation] = int(weight)
+
+    return mix
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=["threaded", "async", "sharded"], default="threaded")
+    parser.add_argument("--shards", type=int, default=os.cpu_count(),
+                        help="Shard processes of the sharded engine.")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client.")
+    parser.add_argument("--providers", type=int, default=50)
+    parser.add_argument("--slots", type=int, default=200, help="Slots per provider.")
+    parser.add_argument("--mix", help="Comma separated operation=weight pairs, operations: "
+                        + ", ".join(DEFAULT_MIX))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Log the mutations to a new mutation log in this "
+                        "empty directory.")
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare the results to this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    mix = _parse_mix(args.mix)
+    raise_file_limit(2 * args.clients + 64)
+
+    address_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve,
+                                     args=(args.engine, args.providers, args.slots, args.clients,
+                                           args.data_dir, args.shards, address_queue),
+                                     # The sharded engine starts the shard processes.
+                                     daemon=args.engine != "sharded")
+    server.start()
+
+    try:
+        address = tuple(address_queue.get(timeout=60))
+        results = asyncio.run(_drive(address, args, mix))
+    finally:
+        server.terminate()
+        server.join()
+
+    _print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = _compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
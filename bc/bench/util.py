@@ -0,0 +1,88 @@
+"""
+Utilities shared by the benchmarks.
+"""
+
+import resource
+
+from typing import List, Sequence
+
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.credentials import hash_password
+from bc.server.server_util import ServerState, TimeSlotInfo, TimeSlotState, User
+
+def provider_name(index: int) -> str:
+    """
+    Returns the name of the `index`th synthetic service provider.
+    """
+
+    return "Provider{}".format(index)
+
+def make_time_slots(count: int, start_year: int = 2019) -> List[TimeSlot]:
+    """
+    Returns `count` distinct, increasing time slots.
+    """
+
+    result = []
+    year = start_year
+    month = 1
+    day = 1
+    hour = 0
+
+    for _ in range(count):
+        result.append(TimeSlot(year, month, day, hour))
+
+        hour += 1
+        if hour == 24:
+            hour = 0
+            day += 1
+            if day > 28:
+                day = 1
+                month += 1
+                if month > 12:
+                    month = 1
+                    year += 1
+
+    return result
+
+def make_server_state(providers: int,
+                      slots_per_provider: int,
+                      users: int,
+                      password_log2_n: int = 4) -> ServerState:
+    """
+    Returns a `ServerState` with synthetic service providers and users. User `i` is called
+    "User<i>" and has the password "pwd<i>". The passwords are hashed with the scrypt cost
+    2 ** `password_log2_n`, far below the default, so that the users are created quickly.
+    """
+
+    state = ServerState()
+
+    time_slots = make_time_slots(slots_per_provider)
+    state.service_provider_db = {
+        ServiceProvider(provider_name(i)): [TimeSlotInfo(ts, TimeSlotState.AVAILABLE, 0)
+                                            for ts in time_slots]
+        for i in range(providers)
+        }
+
+    state.users = [User(i, "User{}".format(i), hash_password("pwd{}".format(i), password_log2_n))
+                   for i in range(1, users + 1)]
+
+    return state
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """
+    Returns the `q`th percentile (nearest rank) of the non-empty, sorted `sorted_values`.
+    """
+
+    rank = int(len(sorted_values) * q / 100)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def raise_file_limit(needed: int) -> None:
+    """
+    Raises the soft limit on open files to at least `needed` if the hard limit allows it.
+    """
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
@@ -0,0 +1,481 @@
+"""
+This module contains a non-interactive client library: the asyncio `AsyncClient`, which shares a
+`ConnectionPool` with any number of other clients, and the blocking `BlockingClient`.
+"""
+
+import asyncio
+import threading
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from bc.common.comm_util import (DEFAULT_MAX_FRAME_SIZE, LengthPrefixedTransceiver, Message,
+                                 RequestGenerator)
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+
+DEFAULT_POOL_SIZE = 8
+
+# The times a request is sent again if its connection is lost.
+DEFAULT_RETRIES = 1
+
+T = TypeVar("T")
+
+# The records of a streamed reply and the data of its last message.
+Reply = Tuple[List[Any], Dict[str, Any]]
+
+# Called with the service provider and the "events" of an event message, see
+# `RequestGenerator.msg_subscribe`.
+EventCallback = Callable[[ServiceProvider, Dict[str, List[TimeSlot]]], None]
+
+class RequestError(Exception):
+    """
+    Raised when the server refuses a request. The data of the reply is in `reply`; e.g. for a
+    batch, its "appointment" is the appointment that could not be changed. If the server rejected
+    the request because of its load or the rate limits of the client, `retry_after` is the
+    number of seconds to wait before retrying it.
+    """
+
+    def __init__(self, reply: Dict[str, Any]) -> None:
+        Exception.__init__(self, reply.get("text"))
+        self.reply = reply
+
+        retry_after_ms = reply.get("retry_after_ms")
+        self.retry_after = None if retry_after_ms is None else retry_after_ms / 1000
+
+class _Connection:
+    """
+    A pipelined, length prefixed connection to the server in the binary codec. The server replies
+    to the requests of a connection in order, so the replies are matched to the requests in a
+    queue. It connects when it is made, and the requests sent meanwhile wait for the connection.
+    The event messages pushed by the server are passed to `on_event`.
+    """
+
+    def __init__(self, host: str, port: int, on_event: Optional[EventCallback] = None) -> None:
+        self.in_flight = 0
+        self.on_event = on_event
+
+        # The futures of the requests waiting for replies and the records received so far.
+        self._pending: Deque[Tuple[asyncio.Future, List[Any]]] = deque()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Future] = None
+        self._connected = asyncio.ensure_future(self._connect(host, port))
+
+    def usable(self) -> bool:
+        """
+        Returns whether the connection is being made or is open.
+        """
+
+        if not self._connected.done():
+            return True
+
+        return (not self._connected.cancelled() and self._connected.exception() is None
+                and self._reader_task is not None and not self._reader_task.done())
+
+    async def request(self, request: Message) -> Reply:
+        """
+        Sends a request and returns the records of the reply, if it is streamed, and the data of
+        its last message. Raises `ConnectionError` if the connection fails.
+        """
+
+        self.in_flight += 1
+        try:
+            try:
+                await asyncio.shield(self._connected)
+            except OSError as error:
+                raise ConnectionError("Cannot connect to the server: {}".format(error))
+
+            if self._writer is None or self._reader_task is None or self._reader_task.done():
+                raise ConnectionError("The connection to the server is closed.")
+
+            msg_bytes = request.to_bytes()
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append((future, []))
+            self._writer.writelines((LengthPrefixedTransceiver.HEADER.pack(len(msg_bytes)),
+                                     msg_bytes))
+            await self._writer.drain()
+
+            return await future
+        finally:
+            self.in_flight -= 1
+
+    async def close(self) -> None:
+        """
+        Closes the connection. Requests still in flight fail with `ConnectionError`.
+        """
+
+        self._connected.cancel()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _connect(self, host: str, port: int) -> None:
+        reader, self._writer = await asyncio.open_connection(host, port)
+        self._reader_task = asyncio.ensure_future(self._read_replies(reader))
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        header_size = LengthPrefixedTransceiver.HEADER.size
+        try:
+            while True:
+                header = await reader.readexactly(header_size)
+                length, = LengthPrefixedTransceiver.HEADER.unpack(header)
+                if length > DEFAULT_MAX_FRAME_SIZE:
+                    break
+
+                reply = Message.from_bytes(await reader.readexactly(length)).data()
+                if "events" in reply:
+                    # Pushed events may come between the messages of a streamed reply.
+                    if self.on_event is not None:
+                        self.on_event(reply["service_provider"], reply["events"])
+                    continue
+
+                future, records = self._pending[0]
+                if "chunk" in reply:
+                    records.extend(reply["chunk"])
+                    continue
+
+                self._pending.popleft()
+                if not future.done():
+                    future.set_result((records, reply))
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError, ValueError):
+            pass
+        finally:
+            for future, _ in self._pending:
+                if not future.done():
+                    future.set_exception(ConnectionError("The connection to the server is lost."))
+            self._pending.clear()
+            if self._writer is not None:
+                self._writer.close()
+
+class ConnectionPool:
+    """
+    Persistent, pipelined connections to a server, shared by any number of `AsyncClient`s. A
+    request goes to an idle connection if there is one; otherwise a new connection is opened,
+    up to `size` of them, and when the pool is full the request goes to the connection with the
+    fewest requests in flight. Lost connections are replaced by the next requests, but the
+    requests in flight on them fail with `ConnectionError`, as they may or may not have been
+    applied.
+
+    The pool belongs to the event loop it is first used on.
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 9998,
+                 size: int = DEFAULT_POOL_SIZE) -> None:
+        if size <= 0:
+            raise ValueError("The pool must have at least one connection.")
+
+        self.host = host
+        self.port = port
+        self.size = size
+        self._connections: List[_Connection] = []
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    async def request(self, request: Message) -> Reply:
+        """
+        Sends a request on one of the connections, see `_Connection.request`.
+        """
+
+        self._connections = [connection for connection in self._connections
+                             if connection.usable()]
+
+        connection = min(self._connections, key=lambda connection: connection.in_flight,
+                         default=None)
+        if connection is None or (connection.in_flight > 0 and len(self._connections) < self.size):
+            connection = _Connection(self.host, self.port)
+            self._connections.append(connection)
+
+        return await connection.request(request)
+
+    async def close(self) -> None:
+        """
+        Closes every connection.
+        """
+
+        connections = self._connections
+        self._connections = []
+        for connection in connections:
+            await connection.close()
+
+    async def __aenter__(self) -> "ConnectionPool":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+class AsyncClient:
+    """
+    A client acting for one user, with an awaitable method for every request type. Any number of
+    clients may share a `ConnectionPool` and have requests in flight at once.
+
+    The methods raise `RequestError` if the server refuses the request and `ConnectionError` if
+    the connection fails. Every method except `login` and `stats` needs a successful `login`
+    first.
+
+    A request whose connection is lost is sent again, with the same request id, up to `retries`
+    times. The server keeps the replies to the requests that change the state for a while, so a
+    retried request gets the reply of the first attempt if that was applied, and is not applied
+    twice.
+    """
+
+    def __init__(self, pool: ConnectionPool, retries: int = DEFAULT_RETRIES) -> None:
+        self.pool = pool
+        self.retries = retries
+
+        # The id of the logged in user, None before logging in.
+        self.client_id: Optional[int] = None
+        self._req_gen: Optional[RequestGenerator] = None
+
+        # The connection of the subscriptions, which are not shared with the pool.
+        self._subscription: Optional[_Connection] = None
+
+    async def login(self, username: str, password: str) -> int:
+        """
+        Logs in and returns the id of the user.
+        """
+
+        _, reply = await self._request(RequestGenerator.msg_login(username, password))
+        self.client_id = reply["client_id"]
+        self._req_gen = RequestGenerator(reply["client_id"], stream_listings=True,
+                                         token=reply.get("token"))
+        return reply["client_id"]
+
+    async def stats(self) -> Dict[str, Any]:
+        """
+        Returns the metrics of the server, see `RequestMetrics.stats`. Only served to clients on
+        the same host as the server.
+        """
+
+        _, reply = await self._request(RequestGenerator.msg_stats())
+        return reply["stats"]
+
+    async def list_basket(self) -> List[Appointment]:
+        """
+        Returns the appointments in the basket.
+        """
+
+        return await self._list(self._session().msg_list_basket())
+
+    async def list_booked_appointments(self) -> List[Appointment]:
+        """
+        Returns the booked appointments.
+        """
+
+        return await self._list(self._session().msg_list_booked_appointments())
+
+    async def list_available_appointments(self,
+                                          service_provider: Optional[str] = None,
+                                          time_from: Optional[TimeSlot] = None,
+                                          time_to: Optional[TimeSlot] = None,
+                                          limit: Optional[int] = None,
+                                          cursor: Optional[Appointment] = None
+                                          ) -> List[Appointment]:
+        """
+        Returns the available appointments, see `RequestGenerator.msg_list_available_appointments`.
+        If `limit` is given, the last appointment of a page is the cursor of the next one.
+        """
+
+        return await self._list(self._session().msg_list_available_appointments(
+            service_provider, time_from, time_to, limit, cursor))
+
+    async def add_appointment_to_basket(self, appointment: Appointment) -> None:
+        """
+        Adds an appointment to the basket.
+        """
+
+        await self._request(self._session().msg_add_appointment_to_basket(appointment))
+
+    async def remove_appointment_from_basket(self, appointment: Appointment) -> None:
+        """
+        Removes an appointment from the basket.
+        """
+
+        await self._request(self._session().msg_remove_appointment_from_basket(appointment))
+
+    async def confirm_booking(self) -> None:
+        """
+        Books the appointments in the basket.
+        """
+
+        await self._request(self._session().msg_confirm_booking())
+
+    async def cancel_appointment(self, appointment: Appointment) -> None:
+        """
+        Cancels a booked appointment.
+        """
+
+        await self._request(self._session().msg_cancel_appointment(appointment))
+
+    async def add_appointments_to_basket(self, appointments: List[Appointment]) -> None:
+        """
+        Adds several appointments to the basket, all or none of them.
+        """
+
+        await self._request(self._session().msg_add_appointments_to_basket(appointments))
+
+    async def remove_appointments_from_basket(self, appointments: List[Appointment]) -> None:
+        """
+        Removes several appointments from the basket, all or none of them.
+        """
+
+        await self._request(self._session().msg_remove_appointments_from_basket(appointments))
+
+    async def cancel_appointments(self, appointments: List[Appointment]) -> None:
+        """
+        Cancels several booked appointments, all or none of them.
+        """
+
+        await self._request(self._session().msg_cancel_appointments(appointments))
+
+    async def subscribe(self, service_providers: List[str], on_event: EventCallback) -> None:
+        """
+        Subscribes to the changes of the time slots of the given service providers, replacing the
+        earlier subscriptions, and passes the events to `on_event` on the event loop. The
+        subscriptions have a connection of their own, and end if it is lost; list the time slots
+        again after subscribing anew, as the events in between are lost.
+        """
+
+        request = self._session().msg_subscribe(service_providers)
+        connection = self._subscription
+        if connection is None or not connection.usable():
+            connection = self._subscription = _Connection(self.pool.host, self.pool.port)
+        # The events may come before the reply.
+        old_on_event = connection.on_event
+        connection.on_event = on_event
+
+        _, reply = await connection.request(request)
+        if not reply.get("OK"):
+            # The earlier subscriptions are kept.
+            connection.on_event = old_on_event
+            raise RequestError(reply)
+
+    async def unsubscribe(self) -> None:
+        """
+        Ends the subscriptions and closes their connection.
+        """
+
+        connection = self._subscription
+        self._subscription = None
+        if connection is not None:
+            await connection.close()
+
+    def _session(self) -> RequestGenerator:
+        if self._req_gen is None:
+            raise RuntimeError("The client is not logged in.")
+
+        return self._req_gen
+
+    async def _list(self, request: Message) -> List[Appointment]:
+        records, _ = await self._request(request)
+        return records
+
+    async def _request(self, request: Message) -> Reply:
+        attempt = 0
+        while True:
+            try:
+                records, reply = await self.pool.request(request)
+                break
+            except ConnectionError:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+
+        if not reply.get("OK"):
+            raise RequestError(reply)
+
+        return records, reply
+
+class BlockingClient:
+    """
+    A blocking wrapper of an `AsyncClient`, with the same methods. The client and its connection
+    pool run on an event loop on a thread of their own, so a blocking client may be used from
+    several threads at once.
+    """
+
+    # pylint: disable=missing-docstring
+
+    def __init__(self, host: str = 'localhost', port: int = 9998,
+                 pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        self.client = AsyncClient(ConnectionPool(host, port, pool_size))
+
+    def login(self, username: str, password: str) -> int:
+        return self._run(self.client.login(username, password))
+
+    def stats(self) -> Dict[str, Any]:
+        return self._run(self.client.stats())
+
+    def list_basket(self) -> List[Appointment]:
+        return self._run(self.client.list_basket())
+
+    def list_booked_appointments(self) -> List[Appointment]:
+        return self._run(self.client.list_booked_appointments())
+
+    def list_available_appointments(self,
+                                    service_provider: Optional[str] = None,
+                                    time_from: Optional[TimeSlot] = None,
+                                    time_to: Optional[TimeSlot] = None,
+                                    limit: Optional[int] = None,
+                                    cursor: Optional[Appointment] = None) -> List[Appointment]:
+        return self._run(self.client.list_available_appointments(service_provider, time_from,
+                                                                 time_to, limit, cursor))
+
+    def add_appointment_to_basket(self, appointment: Appointment) -> None:
+        self._run(self.client.add_appointment_to_basket(appointment))
+
+    def remove_appointment_from_basket(self, appointment: Appointment) -> None:
+        self._run(self.client.remove_appointment_from_basket(appointment))
+
+    def confirm_booking(self) -> None:
+        self._run(self.client.confirm_booking())
+
+    def cancel_appointment(self, appointment: Appointment) -> None:
+        self._run(self.client.cancel_appointment(appointment))
+
+    def add_appointments_to_basket(self, appointments: List[Appointment]) -> None:
+        self._run(self.client.add_appointments_to_basket(appointments))
+
+    def remove_appointments_from_basket(self, appointments: List[Appointment]) -> None:
+        self._run(self.client.remove_appointments_from_basket(appointments))
+
+    def cancel_appointments(self, appointments: List[Appointment]) -> None:
+        self._run(self.client.cancel_appointments(appointments))
+
+    def subscribe(self, service_providers: List[str], on_event: EventCallback) -> None:
+        """
+        See `AsyncClient.subscribe`. The events are passed to `on_event` on the thread of the
+        event loop.
+        """
+
+        self._run(self.client.subscribe(service_providers, on_event))
+
+    def unsubscribe(self) -> None:
+        self._run(self.client.unsubscribe())
+
+    def close(self) -> None:
+        """
+        Closes the connections and stops the event loop.
+        """
+
+        self._run(self.client.unsubscribe())
+        self._run(self.client.pool.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> "BlockingClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _run(self, coroutine: Awaitable[T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
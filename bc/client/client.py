@@ -4,6 +4,7 @@ import sys
 
 from typing import Callable, Dict, Optional, Tuple
 
+from bc.client.session import Session
 from bc.common.comm_util import Message, RequestGenerator, Transceiver
 from bc.common.entities import Appointment, TimeSlot, ServiceProvider
 
@@ -22,10 +23,18 @@ def client_main():
     client.start()
 
 class Client:
-    def __init__(self, server_ip: str = 'localhost', server_port: int = 9998):
+    def __init__(self,
+                 server_ip: str = 'localhost',
+                 server_port: int = 9998,
+                 persistent: bool = True):
         self.server_ip = server_ip
         self.server_port = server_port
 
+        # In persistent mode all requests go through one connection, otherwise every request
+        # opens a new one.
+        self.session: Optional[Session] = (Session(server_ip, server_port)
+                                           if persistent else None)
+
         req_gen: Optional[RequestGenerator] = self.handle_login()
         while not req_gen:
             req_gen = self.handle_login()
@@ -49,6 +58,8 @@ class Client:
 
             if task == 'q':
                 print("Exiting.")
+                if self.session:
+                    self.session.close()
                 return
 
             if task not in self.task_handlers:
@@ -71,7 +82,8 @@ class Client:
                 client_id_int = None
 
             if client_id_int:
-                return RequestGenerator(client_id_int)
+                return RequestGenerator(client_id_int, stream_listings=True,
+                                        token=reply.data().get("token"))
             else:
                 print("Server sent erroneous response.")
 
@@ -87,7 +99,10 @@ class Client:
         if provider_name == "":
             provider_name = None
 
-        request = self.req_gen.msg_list_available_appointments(provider_name)
+        time_from = self.time_slot_prompt_or_empty("from")
+        time_to = self.time_slot_prompt_or_empty("to")
+
+        request = self.req_gen.msg_list_available_appointments(provider_name, time_from, time_to)
         self.send_request_and_print_response(request)
 
     def handle_list_basket(self) -> None:
@@ -125,17 +140,27 @@ class Client:
         request = self.req_gen.msg_cancel_appointment(appointment)
         self.send_request_and_print_response(request)
 
-    def send_request(self, request: Message) -> Message:
+    def send_request(self,
+                     request: Message,
+                     on_chunk: Optional[Callable[[Message], None]] = None) -> Message:
+        if self.session:
+            return self.session.request(request, on_chunk=on_chunk)
+
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.connect((self.server_ip, self.server_port))
             trans = Transceiver(sock)
             trans.send(request.to_bytes())
-            ans = trans.receive()
 
-            return Message.from_bytes(ans)
+            while True:
+                ans = Message.from_bytes(trans.receive())
+                if "chunk" not in ans.data():
+                    return ans
+
+                if on_chunk:
+                    on_chunk(ans)
 
     def send_request_and_print_response(self, request: Message) -> Message:
-        response = self.send_request(request)
+        response = self.send_request(request, on_chunk=self.print_response)
         self.print_response(response)
 
         return response
@@ -144,6 +169,13 @@ class Client:
     def print_response(reply: Message) -> None:
         ans_dictionary = reply.data()
 
+        chunk = ans_dictionary.get("chunk")
+        if chunk is not None:
+            # A part of a streamed listing; the status comes with the end of the stream.
+            for record in chunk:
+                print(record)
+            return
+
         status_ok = ans_dictionary.get("OK")
         text = ans_dictionary.get("text")
         if status_ok is None or text is None:
@@ -197,10 +229,19 @@ class Client:
         return input(prompt)
 
     @staticmethod
-    def prompt_for_appointment() -> Optional[Appointment]:
-        provider_name = Client.provider_prompt()
-        time_slot_str = Client.timeslot_prompt()
+    def time_slot_prompt_or_empty(bound: str) -> Optional[TimeSlot]:
+        while True:
+            prompt = "Please choose the time slot to list {} (yyyy-mm-dd-hh) or leave empty: "
+            time_slot_str = input(prompt.format(bound))
+            if time_slot_str == "":
+                return None
+
+            ts = Client.parse_time_slot(time_slot_str)
+            if ts:
+                return ts
 
+    @staticmethod
+    def parse_time_slot(time_slot_str: str) -> Optional[TimeSlot]:
         time_slot_list = time_slot_str.split('-')
 
         try:
@@ -213,7 +254,23 @@ class Client:
             print("Invalid time slot.")
             return None
 
-        ts = TimeSlot(time_slot_ints[0], time_slot_ints[1], time_slot_ints[2], time_slot_ints[3])
+        try:
+            return TimeSlot(time_slot_ints[0], time_slot_ints[1], time_slot_ints[2],
+                            time_slot_ints[3])
+        except ValueError:
+            # E.g. a day that the month does not have.
+            print("Invalid time slot.")
+            return None
+
+    @staticmethod
+    def prompt_for_appointment() -> Optional[Appointment]:
+        provider_name = Client.provider_prompt()
+        time_slot_str = Client.timeslot_prompt()
+
+        ts = Client.parse_time_slot(time_slot_str)
+        if not ts:
+            return None
+
         appointment = Appointment(ServiceProvider(provider_name), ts)
         return appointment
 
@@ -0,0 +1,147 @@
+"""
+This module contains persistent client sessions.
+"""
+
+import socket
+import threading
+
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from bc.common.comm_util import (BINARY_CODEC, Codec, LengthPrefixedTransceiver, Message,
+                                 Transceiver)
+
+ChunkCallback = Callable[[Message], None]
+
+class Session:
+    """
+    A persistent connection to the server that carries many requests. Requests can be pipelined:
+    several of them may be in flight at once, and the replies are matched to them by the
+    `request_id` of the request, which the server echoes in the reply.
+
+    Replies streamed in chunks (see `StreamMessage`) are passed chunk by chunk to a callback given
+    with the request, and the end-of-stream message completes the request.
+
+    The server uses the codec of the first request for the whole connection, so all requests of
+    a session are encoded with the same codec. Messages are length prefixed unless
+    `length_prefixed` is False, in which case they are delimited.
+    """
+
+    def __init__(self,
+                 server_ip: str = 'localhost',
+                 server_port: int = 9998,
+                 codec: Codec = BINARY_CODEC,
+                 length_prefixed: bool = True) -> None:
+        self._socket = socket.create_connection((server_ip, server_port))
+        self._transceiver: Union[Transceiver, LengthPrefixedTransceiver]
+        if length_prefixed:
+            self._transceiver = LengthPrefixedTransceiver(self._socket)
+        else:
+            self._transceiver = Transceiver(self._socket)
+        self._codec = codec
+
+        # Guards `_pending`, `_closed` and sending, so requests can be sent from several threads.
+        self._lock = threading.Lock()
+
+        # Keys are request ids, values are the futures of the replies and the chunk callbacks.
+        # Dicts keep the insertion order, so the first item is the oldest request in flight.
+        self._pending: Dict[int, Tuple[Future, Optional[ChunkCallback]]] = dict()
+        self._closed = False
+
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def send(self, request: Message, on_chunk: Optional[ChunkCallback] = None) -> Future:
+        """
+        Sends a request without waiting for the reply. Returns a `Future` of the reply `Message`.
+        If the reply is streamed, `on_chunk` is called with every chunk message on the thread
+        reading the replies, and the future gets the end-of-stream message.
+        """
+
+        request_id = request.data()["request_id"]
+        future: Future = Future()
+
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("The session is closed.")
+
+            if request_id in self._pending:
+                raise ValueError("A request with id {} is already in flight.".format(request_id))
+
+            self._pending[request_id] = (future, on_chunk)
+            try:
+                self._transceiver.send(request.to_bytes(self._codec))
+            except:
+                del self._pending[request_id]
+                raise
+
+        return future
+
+    def request(self,
+                request: Message,
+                timeout: Optional[float] = None,
+                on_chunk: Optional[ChunkCallback] = None) -> Message:
+        """
+        Sends a request and waits for the reply, see `send`.
+        """
+
+        return self.send(request, on_chunk).result(timeout)
+
+    def close(self) -> None:
+        """
+        Closes the connection. Requests still in flight fail with `ConnectionError`.
+        """
+
+        with self._lock:
+            self._closed = True
+
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self._reader.join()
+        self._socket.close()
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _read_replies(self) -> None:
+        try:
+            while True:
+                reply = Message.from_bytes(self._transceiver.receive(), self._codec)
+                request_id = reply.data().get("request_id")
+
+                if "chunk" in reply.data():
+                    with self._lock:
+                        pending = self._pending.get(request_id)
+                    if pending is not None and pending[1] is not None:
+                        pending[1](reply)
+                    continue
+
+                with self._lock:
+                    pending = self._pending.pop(request_id, None)
+                    if pending is None and self._pending:
+                        # The server could not read the request id, e.g. because the request was
+                        # invalid. It serves the requests of a connection in order, so the reply
+                        # belongs to the oldest request.
+                        pending = self._pending.pop(next(iter(self._pending)))
+
+                if pending is not None:
+                    pending[0].set_result(reply)
+        except (EOFError, OSError) as error:
+            self._fail_pending(ConnectionError("Connection lost: {}".format(error)))
+        except Exception as error:
+            self._fail_pending(error)
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        for future, _ in pending:
+            future.set_exception(error)
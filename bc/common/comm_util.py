@@ -2,13 +2,47 @@
 Communication utilities.
 """
 
+import copy
+import io
+import itertools
 import socket
 import pickle
+import struct
 
 from enum import auto, Enum, unique
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from bc.common.entities import Appointment
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+
+# The largest frame a `LengthPrefixedTransceiver` accepts by default, in bytes.
+DEFAULT_MAX_FRAME_SIZE = 64 << 20
+
+def _send_buffers(sock: socket.socket, buffers: List[bytes]) -> None:
+    """
+    Sends all the given buffers with scatter/gather I/O, without concatenating them.
+    """
+
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b''.join(buffers))
+        return
+
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            del views[0]
+        if views:
+            views[0] = views[0][sent:]
+
+def is_length_prefixed(first_byte: bytes) -> bool:
+    """
+    Tells whether a connection uses length prefixed framing from the first byte the client sent.
+    The first frame of a length prefixed connection is shorter than 16 MiB, so the stream starts
+    with a zero byte, while the output of every codec starts with a non-zero byte.
+    """
+
+    return first_byte == b'\x00'
 
 class Transceiver:
     """
@@ -23,13 +57,21 @@ class Transceiver:
 
     def receive(self) -> bytes:
         """
-        Receive the next message. Blocks until the delimiter is found.
+        Receive the next message. Blocks until the delimiter is found. Raises `EOFError` if the
+        peer closes the connection before a whole message arrives.
         """
 
-        while self._delimiter not in self._buffer:
-            self._buffer += self._socket.recv(4096)
+        # Only the newly received bytes (and the end of the previous ones, in case the delimiter
+        # is split) are searched for the delimiter.
+        i = self._buffer.find(self._delimiter)
+        while i == -1:
+            scan_from = max(0, len(self._buffer) - len(self._delimiter) + 1)
+            data = self._socket.recv(4096)
+            if not data:
+                raise EOFError("Connection closed by the peer.")
+            self._buffer += data
+            i = self._buffer.find(self._delimiter, scan_from)
 
-        i = self._buffer.index(self._delimiter)
         res = self._buffer[:i]
 
         del self._buffer[:i+len(self._delimiter)]
@@ -39,7 +81,97 @@ class Transceiver:
         """
         Send a message, appending the delimiter to it.
         """
-        self._socket.sendall(message + self._delimiter)
+        _send_buffers(self._socket, [message, self._delimiter])
+
+class LengthPrefixedTransceiver:
+    """
+    A class that wraps a socket. Every message is preceded by its length as a 4 byte big endian
+    unsigned integer, so messages may contain any byte and finding their boundaries costs
+    nothing.
+
+    Received bytes go into a preallocated buffer with `recv_into`; messages larger than the buffer
+    are received directly into their own `bytearray`. Sent messages are not copied: the header and
+    the message are passed to `sendmsg` together.
+    """
+
+    HEADER = struct.Struct("!I")
+
+    def __init__(self,
+                 sock: socket.socket,
+                 max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                 buffer_size: int = 65536) -> None:
+        self._socket = sock
+        self._max_frame_size = max_frame_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+
+        # The received but not yet consumed bytes are self._buffer[self._start:self._end].
+        self._start = 0
+        self._end = 0
+
+    def receive(self) -> bytearray:
+        """
+        Receive the next message. Raises `EOFError` if the peer closes the connection before a
+        whole message arrives and `ValueError` if the message is longer than the maximum frame
+        size.
+        """
+
+        self._fill(LengthPrefixedTransceiver.HEADER.size)
+        length, = LengthPrefixedTransceiver.HEADER.unpack_from(self._buffer, self._start)
+        self._start += LengthPrefixedTransceiver.HEADER.size
+
+        if length > self._max_frame_size:
+            raise ValueError("Frame of {} bytes exceeds the limit of {} bytes."
+                             .format(length, self._max_frame_size))
+
+        if length <= len(self._buffer):
+            self._fill(length)
+            res = self._buffer[self._start:self._start + length]
+            self._start += length
+            return res
+
+        res = bytearray(length)
+        res_view = memoryview(res)
+        buffered = self._end - self._start
+        res_view[:buffered] = self._view[self._start:self._end]
+        self._start = self._end = 0
+
+        while buffered < length:
+            received = self._socket.recv_into(res_view[buffered:])
+            if not received:
+                raise EOFError("Connection closed by the peer.")
+            buffered += received
+
+        return res
+
+    def send(self, message: bytes) -> None:
+        """
+        Send a message, preceded by its length.
+        """
+
+        header = LengthPrefixedTransceiver.HEADER.pack(len(message))
+        _send_buffers(self._socket, [header, message])
+
+    def _fill(self, size: int) -> None:
+        """
+        Receives until at least `size` bytes are buffered. `size` must not exceed the buffer size.
+        """
+
+        if self._end - self._start >= size:
+            return
+
+        if self._start + size > len(self._buffer):
+            # Move the unconsumed bytes to the front to make room.
+            buffered = self._end - self._start
+            self._view[:buffered] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = buffered
+
+        while self._end - self._start < size:
+            received = self._socket.recv_into(self._view[self._end:])
+            if not received:
+                raise EOFError("Connection closed by the peer.")
+            self._end += received
 
 @unique
 class RequestType(Enum):
@@ -55,12 +187,17 @@ class RequestType(Enum):
     REMOVE_APPOINTMENT_FROM_BASKET = auto()
     CONFIRM_BOOKING = auto()
     CANCEL_APPOINTMENT = auto()
+    ADD_APPOINTMENTS_TO_BASKET = auto()
+    REMOVE_APPOINTMENTS_FROM_BASKET = auto()
+    CANCEL_APPOINTMENTS = auto()
+    STATS = auto()
+    SUBSCRIBE = auto()
 
 class Message:
     """
     A class representing messages. This is used to abstract away how the data is handled.
-    This class provides methods to convert the message to bytes and back, but does not handle
-    message boundaries.
+    This class provides methods to convert the message to bytes and back using a `Codec`, but does
+    not handle message boundaries.
     """
 
     def __init__(self, msg_object: Any) -> None:
@@ -73,19 +210,100 @@ class Message:
 
         return self._msg_object
 
-    def to_bytes(self) -> bytes:
+    def to_bytes(self, codec: Optional["Codec"] = None) -> bytes:
         """
-        Returns a `bytes` representation of the message.
+        Returns a `bytes` representation of the message, produced by the given codec or by the
+        binary codec if `codec` is None.
         """
 
-        return pickle.dumps(self._msg_object, protocol=0)
+        if codec is None:
+            codec = BINARY_CODEC
+
+        return codec.encode(self._msg_object)
 
     @staticmethod
-    def from_bytes(data: bytes) -> "Message":
+    def from_bytes(data: bytes, codec: Optional["Codec"] = None) -> "Message":
         """
-        Converts the `bytes` representation of a request into a `Message` object.
+        Converts the `bytes` representation of a request into a `Message` object. If `codec` is
+        None, the codec is detected from the data.
         """
-        return Message(pickle.loads(data))
+
+        if codec is None:
+            codec = detect_codec(data)
+
+        return Message(codec.decode(data))
+
+class StreamMessage(Message):
+    """
+    A reply whose records are produced lazily and sent as a sequence of chunk messages, so
+    neither side holds the whole result at once.
+
+    Every chunk message holds the "request_id" of the request and a "chunk" list of at most
+    `chunk_size` records. The last message is the data of this message with "end_of_stream" set
+    to True. The data may be changed until the records are exhausted.
+    """
+
+    def __init__(self, msg_object: Dict[str, Any], records: Iterator[Any]) -> None:
+        Message.__init__(self, msg_object)
+        self._records = records
+
+    def chunks(self, chunk_size: int = 256) -> Iterator[Message]:
+        """
+        Returns an iterator over the messages to send: the chunk messages and the end-of-stream
+        message.
+        """
+
+        request_id = self._msg_object.get("request_id")
+
+        while True:
+            chunk = list(itertools.islice(self._records, chunk_size))
+            if not chunk:
+                break
+
+            yield Message({"request_id": request_id, "chunk": chunk})
+
+        end = dict(self._msg_object)
+        end["end_of_stream"] = True
+        yield Message(end)
+
+class PreencodedMessage(Message):
+    """
+    A dict message that is sent many times, e.g. a cached reply. Its items are encoded with the
+    binary codec once, when it is made. The copies made by `copy` may get new items, and sending
+    a copy with the binary codec only encodes these; other codecs encode the whole data.
+    """
+
+    def __init__(self, msg_object: Dict[str, Any]) -> None:
+        Message.__init__(self, msg_object)
+        self._items = msg_object
+        self._encoded_items = BINARY_CODEC.encode_items(msg_object)
+
+    def encoded_size(self) -> int:
+        """
+        Returns the size of the encoded items in bytes.
+        """
+
+        return len(self._encoded_items)
+
+    def copy(self) -> "PreencodedMessage":
+        """
+        Returns a copy of the message sharing the encoded items. New items may be added to the
+        data of the copy, but the items of this message must not be changed.
+        """
+
+        message = copy.copy(self)
+        message._msg_object = dict(self._items)
+        return message
+
+    def to_bytes(self, codec: Optional["Codec"] = None) -> bytes:
+        if codec is None:
+            codec = BINARY_CODEC
+
+        if not isinstance(codec, BinaryCodec):
+            return codec.encode(self._msg_object)
+
+        added = {key: value for key, value in self._msg_object.items() if key not in self._items}
+        return codec.encode_spliced(self._encoded_items, len(self._items), added)
 
 class RequestGenerator:
     """
@@ -108,16 +326,54 @@ class RequestGenerator:
 
         return Message(dictionary)
 
-    def __init__(self, client_id: int):
+    @staticmethod
+    def msg_stats() -> Message:
+        """
+        Returns a request for the metrics of the server. It needs no session, but the server only
+        serves it to clients on the same host.
+        """
+
+        dictionary = {
+            "client_id": -1,
+            "request_id": -1,
+            "type": RequestType.STATS
+            }
+
+        return Message(dictionary)
+
+    def __init__(self,
+                 client_id: int,
+                 stream_listings: bool = False,
+                 token: Optional[str] = None):
+        """
+        Args:
+            client_id: The client id received at login.
+            stream_listings: Whether to ask the server to stream the replies of the listing
+                requests, see `StreamMessage`.
+            token: The session token received at login, which the server requires with every
+                request.
+        """
+
         self._client_id = client_id
         self._request_id = 0
+        self._stream_listings = stream_listings
+        self._token = token
+
+    @staticmethod
+    def from_login_reply(reply: Message, stream_listings: bool = False) -> "RequestGenerator":
+        """
+        Returns a generator for the session started by a successful login.
+        """
+
+        return RequestGenerator(reply.data()["client_id"], stream_listings,
+                                reply.data().get("token"))
 
     def msg_list_basket(self) -> Message:
         """
         Returns a request for listing the contents of the basket.
         """
 
-        res = self._base_dict()
+        res = self._listing_dict()
         res["type"] = RequestType.LIST_BASKET
 
         return Message(res)
@@ -127,21 +383,38 @@ class RequestGenerator:
         Returns a request for listing the appointments booked by the client.
         """
 
-        res = self._base_dict()
+        res = self._listing_dict()
         res["type"] = RequestType.LIST_BOOKED_APPOINTMENTS
 
         return Message(res)
 
-    def msg_list_available_appointments(self, service_provider: Optional[str]) -> Message:
+    def msg_list_available_appointments(self,
+                                        service_provider: Optional[str],
+                                        time_from: Optional[TimeSlot] = None,
+                                        time_to: Optional[TimeSlot] = None,
+                                        limit: Optional[int] = None,
+                                        cursor: Optional[Appointment] = None) -> Message:
         """
         Returns a request for listing available appointments of the given service provider or all
         service providers if `service_provider` is None.
+
+        Args:
+            time_from: If not None, only time slots from this one (inclusive) are listed.
+            time_to: If not None, only time slots before this one (exclusive) are listed.
+            limit: If not None, at most this many appointments are listed. If there may be more,
+                the reply contains a "cursor".
+            cursor: The "cursor" of the reply to the request of the previous page; the listing
+                continues after it.
         """
 
-        res = self._base_dict()
+        res = self._listing_dict()
         res["type"] = RequestType.LIST_AVAILABLE_APPOINTMENTS
 
         res["service_provider"] = service_provider
+        res["time_from"] = time_from
+        res["time_to"] = time_to
+        res["limit"] = limit
+        res["cursor"] = cursor
 
         return Message(res)
 
@@ -191,11 +464,68 @@ class RequestGenerator:
 
         return Message(res)
 
+    def msg_subscribe(self, service_providers: List[str]) -> Message:
+        """
+        Returns a request for subscribing the connection to the changes of the time slots of the
+        given service providers, replacing its earlier subscriptions. An empty list ends the
+        subscriptions.
+
+        The server then pushes an event message whenever time slots of these providers change:
+        the "service_provider" and the "events", which map the new states ("available",
+        "in_basket" or "reserved") to the lists of the time slots that got into them.
+        """
+
+        res = self._base_dict()
+        res["type"] = RequestType.SUBSCRIBE
+
+        res["service_providers"] = list(service_providers)
+
+        return Message(res)
+
+    def msg_add_appointments_to_basket(self, appointments: List[Appointment]) -> Message:
+        """
+        Returns a request for adding several appointments to the basket. Either all of them are
+        added or, if any of them cannot be, none.
+        """
+
+        return self._batch_message(RequestType.ADD_APPOINTMENTS_TO_BASKET, appointments)
+
+    def msg_remove_appointments_from_basket(self, appointments: List[Appointment]) -> Message:
+        """
+        Returns a request for removing several appointments from the basket, all or none of them.
+        """
+
+        return self._batch_message(RequestType.REMOVE_APPOINTMENTS_FROM_BASKET, appointments)
+
+    def msg_cancel_appointments(self, appointments: List[Appointment]) -> Message:
+        """
+        Returns a request for cancelling several appointments, all or none of them.
+        """
+
+        return self._batch_message(RequestType.CANCEL_APPOINTMENTS, appointments)
+
+    def _batch_message(self, request_type: RequestType, appointments: List[Appointment]) -> Message:
+        res = self._base_dict()
+        res["type"] = request_type
+
+        res["appointments"] = list(appointments)
+
+        return Message(res)
+
+    def _listing_dict(self) -> Dict[str, Any]:
+        res = self._base_dict()
+        if self._stream_listings:
+            res["stream"] = True
+
+        return res
+
     def _base_dict(self) -> Dict[str, Any]:
         res = {
             "client_id": self._client_id,
             "request_id": self._request_id
             }
+        if self._token is not None:
+            res["token"] = self._token
         self._request_id += 1
 
         return res
@@ -214,3 +544,346 @@ class ReplyType(Enum):
     # The server denied the request.
     DENIED = auto()
 
+
+class Codec:
+    """
+    Converts message objects to `bytes` and back. The first bytes of an encoded message identify
+    the codec that produced it, see `detect_codec`.
+    """
+
+    def encode(self, msg_object: Any) -> bytes:
+        """
+        Returns the `bytes` representation of the message object.
+        """
+
+        raise NotImplementedError()
+
+    def decode(self, data: bytes) -> Any:
+        """
+        Converts the `bytes` representation of a message back to the message object. Raises
+        `ValueError` if the data is malformed or contains objects that are not allowed in messages.
+        """
+
+        raise NotImplementedError()
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    """
+    An unpickler that only loads the classes that may occur in messages, so untrusted input cannot
+    make it call arbitrary functions.
+    """
+
+    _ALLOWED_GLOBALS = {
+        ("copy_reg", "_reconstructor"),
+        ("copyreg", "_reconstructor"),
+        ("__builtin__", "object"),
+        ("builtins", "object"),
+        ("bc.common.entities", "ServiceProvider"),
+        ("bc.common.entities", "TimeSlot"),
+        ("bc.common.entities", "Appointment"),
+        ("bc.common.comm_util", "RequestType"),
+        ("bc.common.comm_util", "ReplyType"),
+        }
+
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) not in _RestrictedUnpickler._ALLOWED_GLOBALS:
+            raise pickle.UnpicklingError("Global '{}.{}' is not allowed.".format(module, name))
+
+        return super().find_class(module, name)
+
+class PickleCodec(Codec):
+    """
+    The legacy codec: pickle protocol 0. Its output is printable ASCII, so it never contains the
+    default message delimiter. Decoding only accepts the classes that may occur in messages.
+    """
+
+    def encode(self, msg_object: Any) -> bytes:
+        return pickle.dumps(msg_object, protocol=0)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return _RestrictedUnpickler(io.BytesIO(data)).load()
+        except (pickle.UnpicklingError, EOFError, AttributeError, TypeError) as error:
+            raise ValueError("Invalid pickle message: {}".format(error))
+
+class BinaryCodec(Codec):
+    """
+    A compact, schema-aware binary codec. It knows the entity classes, the enums and the field
+    names of the messages, so these take one or a few bytes instead of their pickled class paths.
+
+    Every value is a tag byte followed by its payload. Integers are zigzag varints in base 127
+    (see `_write_varint`), and strings are UTF-8, which never contains b'\\xff', so the output never
+    contains the default message delimiter either.
+    """
+
+    MAGIC = b'\xfe\x01'
+
+    # Nesting deeper than this is rejected when decoding.
+    MAX_DEPTH = 32
+
+    _NONE = 0
+    _FALSE = 1
+    _TRUE = 2
+    _INT = 3
+    _STR = 4
+    _LIST = 5
+    _DICT = 6
+    _FIELD = 7
+    _REQUEST_TYPE = 8
+    _REPLY_TYPE = 9
+    _SERVICE_PROVIDER = 10
+    _TIME_SLOT = 11
+    _APPOINTMENT = 12
+
+    # Dict keys that are encoded as their index in this tuple. Only append to it, the indices are
+    # part of the wire format.
+    FIELD_NAMES = (
+        "client_id",
+        "request_id",
+        "type",
+        "username",
+        "password",
+        "service_provider",
+        "appointment",
+        "OK",
+        "text",
+        "time_from",
+        "time_to",
+        "limit",
+        "cursor",
+        "stream",
+        "chunk",
+        "end_of_stream",
+        "token",
+        "appointments",
+        "dry_run",
+        "stats",
+        "service_providers",
+        "events",
+        "available",
+        "in_basket",
+        "reserved",
+        "retry_after_ms",
+        )
+
+    _FIELD_IDS = {name: i for i, name in enumerate(FIELD_NAMES)}
+
+    def encode(self, msg_object: Any) -> bytes:
+        out = bytearray(BinaryCodec.MAGIC)
+        self._write(out, msg_object)
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Any:
+        if data[:len(BinaryCodec.MAGIC)] != BinaryCodec.MAGIC:
+            raise ValueError("Not a binary codec message.")
+
+        try:
+            msg_object, pos = self._read(data, len(BinaryCodec.MAGIC), 0)
+        except IndexError:
+            raise ValueError("Truncated message.")
+        except TypeError as error:
+            # E.g. a list used as a dict key.
+            raise ValueError("Invalid message: {}".format(error))
+
+        if pos != len(data):
+            raise ValueError("Trailing bytes after the message.")
+
+        return msg_object
+
+    def encode_items(self, items: Dict[Any, Any]) -> bytes:
+        """
+        Returns the encoding of the items of a dict, without the tag and the length of the dict.
+        """
+
+        out = bytearray()
+        self._write_items(out, items)
+        return bytes(out)
+
+    def encode_spliced(self, encoded_items: bytes, count: int, msg_object: Dict[Any, Any]) -> bytes:
+        """
+        Returns the encoding of a dict made of the `count` items encoded by `encode_items` and the
+        items of `msg_object`, which must not have the same keys.
+        """
+
+        out = bytearray(BinaryCodec.MAGIC)
+        out.append(BinaryCodec._DICT)
+        self._write_varint(out, count + len(msg_object))
+        self._write_items(out, msg_object)
+        out += encoded_items
+        return bytes(out)
+
+    @staticmethod
+    def _write_varint(out: bytearray, value: int) -> None:
+        # Zigzag encoding maps signed integers to unsigned ones. The digits are in base 127 rather
+        # than 128 so that a byte with the continuation bit set is at most 0xfe.
+        value = (value << 1) if value >= 0 else ((-value << 1) - 1)
+        while value >= 127:
+            out.append(0x80 | (value % 127))
+            value //= 127
+        out.append(value)
+
+    @staticmethod
+    def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+        value = 0
+        factor = 1
+        while True:
+            byte = data[pos]
+            pos += 1
+            if byte < 0x80:
+                value += byte * factor
+                break
+            if byte == 0xff:
+                raise ValueError("Invalid varint.")
+            value += (byte & 0x7f) * factor
+            factor *= 127
+
+        value = (value >> 1) if not value & 1 else -((value + 1) >> 1)
+        return value, pos
+
+    def _write_str(self, out: bytearray, value: str) -> None:
+        encoded = value.encode("utf-8")
+        self._write_varint(out, len(encoded))
+        out += encoded
+
+    def _read_str(self, data: bytes, pos: int) -> Tuple[str, int]:
+        length, pos = self._read_varint(data, pos)
+        end = pos + length
+        if length < 0 or end > len(data):
+            raise ValueError("Invalid string length.")
+
+        return str(data[pos:end], "utf-8"), end
+
+    def _write_time_slot(self, out: bytearray, time_slot: TimeSlot) -> None:
+        self._write_varint(out, time_slot.year())
+        self._write_varint(out, time_slot.month())
+        self._write_varint(out, time_slot.day())
+        self._write_varint(out, time_slot.hour())
+
+    def _read_time_slot(self, data: bytes, pos: int) -> Tuple[TimeSlot, int]:
+        year, pos = self._read_varint(data, pos)
+        month, pos = self._read_varint(data, pos)
+        day, pos = self._read_varint(data, pos)
+        hour, pos = self._read_varint(data, pos)
+
+        return TimeSlot(year, month, day, hour), pos
+
+    def _write(self, out: bytearray, value: Any) -> None:
+        # Exact type checks: bool is a subclass of int and the enums must not be taken for ints.
+        value_type = type(value)
+
+        if value is None:
+            out.append(BinaryCodec._NONE)
+        elif value_type is bool:
+            out.append(BinaryCodec._TRUE if value else BinaryCodec._FALSE)
+        elif value_type is int:
+            out.append(BinaryCodec._INT)
+            self._write_varint(out, value)
+        elif value_type is str:
+            out.append(BinaryCodec._STR)
+            self._write_str(out, value)
+        elif value_type is dict:
+            out.append(BinaryCodec._DICT)
+            self._write_varint(out, len(value))
+            self._write_items(out, value)
+        elif value_type in (list, tuple):
+            out.append(BinaryCodec._LIST)
+            self._write_varint(out, len(value))
+            for item in value:
+                self._write(out, item)
+        elif value_type is RequestType:
+            out.append(BinaryCodec._REQUEST_TYPE)
+            self._write_varint(out, value.value)
+        elif value_type is ReplyType:
+            out.append(BinaryCodec._REPLY_TYPE)
+            self._write_varint(out, value.value)
+        elif value_type is ServiceProvider:
+            out.append(BinaryCodec._SERVICE_PROVIDER)
+            self._write_str(out, value.name())
+        elif value_type is TimeSlot:
+            out.append(BinaryCodec._TIME_SLOT)
+            self._write_time_slot(out, value)
+        elif value_type is Appointment:
+            out.append(BinaryCodec._APPOINTMENT)
+            self._write_str(out, value.service_provider().name())
+            self._write_time_slot(out, value.time_slot())
+        else:
+            raise TypeError("Cannot encode objects of type {}.".format(value_type.__name__))
+
+    def _write_items(self, out: bytearray, items: Dict[Any, Any]) -> None:
+        for key, item in items.items():
+            field_id = BinaryCodec._FIELD_IDS.get(key)
+            if field_id is not None:
+                out.append(BinaryCodec._FIELD)
+                self._write_varint(out, field_id)
+            else:
+                self._write(out, key)
+            self._write(out, item)
+
+    def _read(self, data: bytes, pos: int, depth: int) -> Tuple[Any, int]:
+        if depth > BinaryCodec.MAX_DEPTH:
+            raise ValueError("Message nested too deeply.")
+
+        tag = data[pos]
+        pos += 1
+
+        if tag == BinaryCodec._NONE:
+            return None, pos
+        if tag == BinaryCodec._FALSE:
+            return False, pos
+        if tag == BinaryCodec._TRUE:
+            return True, pos
+        if tag == BinaryCodec._INT:
+            return self._read_varint(data, pos)
+        if tag == BinaryCodec._STR:
+            return self._read_str(data, pos)
+        if tag == BinaryCodec._DICT:
+            count, pos = self._read_varint(data, pos)
+            result: Dict[Any, Any] = dict()
+            for _ in range(count):
+                if data[pos] == BinaryCodec._FIELD:
+                    field_id, pos = self._read_varint(data, pos + 1)
+                    if not 0 <= field_id < len(BinaryCodec.FIELD_NAMES):
+                        raise ValueError("Unknown field id: {}.".format(field_id))
+                    key: Any = BinaryCodec.FIELD_NAMES[field_id]
+                else:
+                    key, pos = self._read(data, pos, depth + 1)
+                result[key], pos = self._read(data, pos, depth + 1)
+            return result, pos
+        if tag == BinaryCodec._LIST:
+            count, pos = self._read_varint(data, pos)
+            if count < 0 or count > len(data) - pos:
+                raise ValueError("Invalid list length.")
+            items = []
+            for _ in range(count):
+                item, pos = self._read(data, pos, depth + 1)
+                items.append(item)
+            return items, pos
+        if tag == BinaryCodec._REQUEST_TYPE:
+            value, pos = self._read_varint(data, pos)
+            return RequestType(value), pos
+        if tag == BinaryCodec._REPLY_TYPE:
+            value, pos = self._read_varint(data, pos)
+            return ReplyType(value), pos
+        if tag == BinaryCodec._SERVICE_PROVIDER:
+            name, pos = self._read_str(data, pos)
+            return ServiceProvider(name), pos
+        if tag == BinaryCodec._TIME_SLOT:
+            return self._read_time_slot(data, pos)
+        if tag == BinaryCodec._APPOINTMENT:
+            name, pos = self._read_str(data, pos)
+            time_slot, pos = self._read_time_slot(data, pos)
+            return Appointment(ServiceProvider(name), time_slot), pos
+
+        raise ValueError("Unknown tag: {}.".format(tag))
+
+PICKLE_CODEC = PickleCodec()
+BINARY_CODEC = BinaryCodec()
+
+def detect_codec(data: bytes) -> Codec:
+    """
+    Returns the codec that produced the given encoded message.
+    """
+
+    if data[:len(BinaryCodec.MAGIC)] == BinaryCodec.MAGIC:
+        return BINARY_CODEC
+
+    return PICKLE_CODEC
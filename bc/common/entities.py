@@ -1,16 +1,25 @@
 """
 Module representing entities.
+
+The entities are immutable and hashable, and keep their fields in `__slots__`. They pickle to the
+same attribute dictionaries as the earlier `__dict__` based classes, so the pickle codec stays
+compatible with older clients.
 """
 
-from typing import Any
+import sys
+
+from typing import Any, Dict
 
 class ServiceProvider:
     """
-    A class representing a service provider.
+    A class representing a service provider. The names are interned, so the providers made of the
+    same name, e.g. by every decoded request, share one string.
     """
 
+    __slots__ = ("_name",)
+
     def __init__(self, name: str) -> None:
-        self._name = name
+        object.__setattr__(self, "_name", sys.intern(name))
 
     def name(self) -> str:
         """
@@ -19,7 +28,9 @@ class ServiceProvider:
         return self._name
 
     def __eq__(self, other: Any) -> bool:
-        return self._name == other.name()
+        if not isinstance(other, ServiceProvider):
+            return NotImplemented
+        return self._name == other._name
 
     def __hash__(self) -> int:
         return hash(self._name)
@@ -27,58 +38,119 @@ class ServiceProvider:
     def __repr__(self) -> str:
         return self._name
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("ServiceProvider is immutable.")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("ServiceProvider is immutable.")
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"_name": self._name}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        ServiceProvider.__init__(self, state["_name"])
+
 class TimeSlot:
     """
     A class representing a time slot.
+
+    The fields are packed into an integer, the `ordinal`, that orders the same way as the time
+    slots do, so comparing and hashing time slots only takes an integer operation.
     """
 
+    __slots__ = ("_ordinal",)
+
     def __init__(self, year: int, month: int, day: int, hour: int) -> None:
         TimeSlot._check_date_and_time(month, day, hour)
 
-        self._year = year
-        self._month = month
-        self._day = day
-        self._hour = hour
+        object.__setattr__(self, "_ordinal", (((year << 4 | month) << 5 | day) << 5) | hour)
+
+    @staticmethod
+    def from_ordinal(ordinal: int) -> "TimeSlot":
+        """
+        Returns the time slot of an ordinal returned by `ordinal`.
+        """
+
+        time_slot = object.__new__(TimeSlot)
+        object.__setattr__(time_slot, "_ordinal", ordinal)
+        return time_slot
+
+    def ordinal(self) -> int:
+        """
+        Returns the packed fields of this `TimeSlot`: the year, then 4 bits of the month, 5 bits
+        of the day and 5 bits of the hour.
+        """
+        return self._ordinal
 
     def year(self) -> int:
         """
         Returns the year of this `TimeSlot`.
         """
-        return self._year
+        return self._ordinal >> 14
 
     def month(self) -> int:
         """
         Returns the month of this `TimeSlot`.
         """
-        return self._month
+        return (self._ordinal >> 10) & 0xf
 
     def day(self) -> int:
         """
         Returns the day of this `TimeSlot`.
         """
-        return self._day
+        return (self._ordinal >> 5) & 0x1f
 
     def hour(self) -> int:
         """
         Returns the hour of this `TimeSlot`.
         """
-        return self._hour
+        return self._ordinal & 0x1f
 
     def __eq__(self, other: Any) -> bool:
-        return (self._year == other.year()
-                and self._month == other.month()
-                and self._day == other.day()
-                and self._hour == other.hour())
+        if not isinstance(other, TimeSlot):
+            return NotImplemented
+        return self._ordinal == other._ordinal
+
+    def __lt__(self, other: "TimeSlot") -> bool:
+        return self._ordinal < other._ordinal
+
+    def __le__(self, other: "TimeSlot") -> bool:
+        return self._ordinal <= other._ordinal
+
+    def __gt__(self, other: "TimeSlot") -> bool:
+        return self._ordinal > other._ordinal
+
+    def __ge__(self, other: "TimeSlot") -> bool:
+        return self._ordinal >= other._ordinal
+
+    def __hash__(self) -> int:
+        return hash(self._ordinal)
 
     def __repr__(self) -> str:
-        data = [self._year, self._month, self._day, self._hour]
+        data = [self.year(), self.month(), self.day(), self.hour()]
         return "-".join(map(str, data))
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("TimeSlot is immutable.")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("TimeSlot is immutable.")
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"_year": self.year(), "_month": self.month(), "_day": self.day(),
+                "_hour": self.hour()}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        TimeSlot.__init__(self, state["_year"], state["_month"], state["_day"], state["_hour"])
+
     @staticmethod
     def _check_date_and_time(month: int, day: int, hour: int) -> None:
         if hour < 0 or hour > 24:
             raise ValueError("Incorrect hour: {}.".format(hour))
 
+        if month < 1 or month > 12:
+            raise ValueError("Incorrect month: {}.".format(month))
+
         if day < 0:
             raise ValueError("Incorrect day: {}.".format(day))
 
@@ -96,9 +168,11 @@ class Appointment:
     A class representing the appointment.
     """
 
+    __slots__ = ("_service_provider", "_time_slot")
+
     def __init__(self, service_provider: ServiceProvider, time_slot: TimeSlot) -> None:
-        self._service_provider = service_provider
-        self._time_slot = time_slot
+        object.__setattr__(self, "_service_provider", service_provider)
+        object.__setattr__(self, "_time_slot", time_slot)
 
     def service_provider(self) -> ServiceProvider:
         """
@@ -114,5 +188,26 @@ class Appointment:
 
         return self._time_slot
 
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Appointment):
+            return NotImplemented
+        return (self._time_slot == other._time_slot
+                and self._service_provider == other._service_provider)
+
+    def __hash__(self) -> int:
+        return hash((self._service_provider, self._time_slot))
+
     def __repr__(self) -> str:
         return "{}:\t{}".format(self._service_provider, self._time_slot)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Appointment is immutable.")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Appointment is immutable.")
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"_service_provider": self._service_provider, "_time_slot": self._time_slot}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        Appointment.__init__(self, state["_service_provider"], state["_time_slot"])
@@ -0,0 +1,161 @@
+"""
+This module contains the admission control of the servers: per-client rate limits and a bound on
+the requests being handled at once.
+"""
+
+import collections
+import threading
+import time
+
+from typing import Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from bc.common.comm_util import RequestType
+
+class RateLimit(NamedTuple):
+    """
+    A token bucket: `rate` requests per second on average, and bursts of up to `burst` requests.
+    """
+
+    rate: float
+    burst: float
+
+# The limits of every client: the limit of all of its requests under the None key, and the limits
+# of the request types. They are far above what an interactive client needs.
+DEFAULT_RATE_LIMITS: Dict[Optional[RequestType], RateLimit] = {
+    None: RateLimit(500.0, 1000.0),
+    RequestType.LIST_AVAILABLE_APPOINTMENTS: RateLimit(100.0, 200.0),
+    RequestType.ADD_APPOINTMENT_TO_BASKET: RateLimit(100.0, 200.0),
+    RequestType.ADD_APPOINTMENTS_TO_BASKET: RateLimit(20.0, 40.0),
+    RequestType.SUBSCRIBE: RateLimit(5.0, 20.0),
+    }
+
+DEFAULT_MAX_BUCKETS = 1 << 16
+
+# A client and a request type, or None for all of its requests.
+_BucketKey = Tuple[Hashable, Optional[RequestType]]
+
+DEFAULT_MAX_PENDING = 1024
+
+# Seconds an overloaded server asks the clients to wait before retrying.
+DEFAULT_OVERLOAD_RETRY_AFTER = 0.1
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, limit: RateLimit, now: float) -> None:
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+
+class RateLimiter:
+    """
+    Token bucket rate limits per client: one bucket for all of the requests of a client and one
+    for each limited request type. A request takes a token from both of its buckets, and is only
+    admitted if both have one.
+
+    The buckets of the least recently seen clients are evicted beyond `max_buckets`; an evicted
+    bucket starts full when its client comes back. The limiter is thread-safe.
+    """
+
+    def __init__(self,
+                 limits: Optional[Dict[Optional[RequestType], RateLimit]] = None,
+                 max_buckets: int = DEFAULT_MAX_BUCKETS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Args:
+            limits: The limits of every client, like `DEFAULT_RATE_LIMITS`, which is the default.
+                An empty dictionary disables the rate limits.
+        """
+
+        self.limits = DEFAULT_RATE_LIMITS if limits is None else limits
+        self.max_buckets = max_buckets
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._buckets: "collections.OrderedDict[_BucketKey, _Bucket]" = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def check(self, client: Hashable, request_type: RequestType) -> float:
+        """
+        Takes a token for a request of the client, and returns 0.0 if the request is admitted.
+        Otherwise it returns the seconds until the request would be admitted, and takes no token.
+        """
+
+        keys = [key for key in ((client, None), (client, request_type))
+                if key[1] in self.limits]
+        if not keys:
+            return 0.0
+
+        with self._lock:
+            now = self._clock()
+            buckets = [(self._bucket(key, now), self.limits[key[1]]) for key in keys]
+
+            retry_after = 0.0
+            for bucket, limit in buckets:
+                bucket.refill(limit, now)
+                if bucket.tokens < 1.0:
+                    retry_after = max(retry_after, (1.0 - bucket.tokens) / limit.rate)
+
+            if retry_after == 0.0:
+                for bucket, _ in buckets:
+                    bucket.tokens -= 1.0
+
+            return retry_after
+
+    def _bucket(self, key: _BucketKey, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+
+        while len(self._buckets) >= self.max_buckets:
+            self._buckets.popitem(last=False)
+
+        bucket = self._buckets[key] = _Bucket(self.limits[key[1]].burst, now)
+        return bucket
+
+class PendingRequests:
+    """
+    The number of requests being handled, bounded by `max_pending`. Requests beyond it are shed
+    at once with the `retry_after` hint, instead of queueing for the lock of the server or for
+    the password verifiers, so the requests admitted are served in bounded time. It is
+    thread-safe.
+    """
+
+    def __init__(self,
+                 max_pending: int = DEFAULT_MAX_PENDING,
+                 retry_after: float = DEFAULT_OVERLOAD_RETRY_AFTER) -> None:
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def enter(self) -> bool:
+        """
+        Admits a request, which must `leave` when it is handled, and returns True, or returns
+        False if `max_pending` requests are being handled.
+        """
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+
+            self._pending += 1
+            return True
+
+    def leave(self) -> None:
+        """
+        Ends a request admitted by `enter`.
+        """
+
+        with self._lock:
+            self._pending -= 1
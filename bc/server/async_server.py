@@ -0,0 +1,336 @@
+"""
+This module contains an asyncio based server engine.
+"""
+
+import asyncio
+from typing import Optional, Tuple, Union
+
+from bc.common.comm_util import (Codec, detect_codec, is_length_prefixed,
+                                 LengthPrefixedTransceiver, Message, StreamMessage)
+from bc.server.server import (DATA_DIR, DeferredReply, load_server_state, MAX_REQUEST_SIZE,
+                              RequestHandler, ServerBase)
+from bc.server.server_util import ServerState, SlotChanges
+from bc.server.subscriptions import Subscriber
+
+# The bytes a connection may have waiting to be sent when an event is pushed to it; beyond this,
+# its subscriber is dropped.
+MAX_PUSH_BUFFER = 1 << 20
+
+class AsyncServer(ServerBase):
+    """
+    A server that serves many connections concurrently on an asyncio event loop, so a slow or
+    stalled client does not hold up the others. Connections are persistent: the requests of a
+    connection are served in order until the client closes it. The framing of a connection,
+    delimited or length prefixed, is detected from its first byte.
+
+    The handlers are synchronous and run on the event loop thread, so every request is applied to
+    the `ServerState` atomically with respect to the other requests. Background tasks release the
+    expired basket holds every `hold_release_interval` seconds and, if the state has a mutation
+    log, snapshot it every `snapshot_interval` seconds.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 server_state: Optional[ServerState] = None,
+                 delimiter: bytes = b'\xff',
+                 backlog: int = 4096) -> None:
+        ServerBase.__init__(self, server_state)
+
+        self.host = host
+        self.port = port
+        self._delimiter = delimiter
+        self._backlog = backlog
+        self._request_handler = RequestHandler(self)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        """
+        Starts listening for connections.
+        """
+
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection,
+                                                  self.host,
+                                                  self.port,
+                                                  backlog=self._backlog,
+                                                  limit=MAX_REQUEST_SIZE)
+
+    def address(self) -> Tuple[str, int]:
+        """
+        Returns the address the server is listening on. Useful if the server was created with
+        port 0.
+        """
+
+        if self._server is None:
+            raise RuntimeError("The server is not started.")
+
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self) -> None:
+        """
+        Serves connections until cancelled.
+        """
+
+        if self._server is None:
+            await self.start()
+
+        assert self._server is not None
+        background_tasks = [asyncio.ensure_future(self._hold_release_loop())]
+        if self.server_state.mutation_log is not None:
+            background_tasks.append(asyncio.ensure_future(self._snapshot_loop()))
+
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+    async def close(self) -> None:
+        """
+        Stops listening for connections.
+        """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        self.password_verifier.shutdown(wait=False)
+
+    async def _hold_release_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.hold_release_interval)
+
+            while (self.server_state.release_expired_holds(self.hold_release_batch)
+                   == self.hold_release_batch):
+                await asyncio.sleep(0)
+
+    async def _snapshot_loop(self) -> None:
+        mutation_log = self.server_state.mutation_log
+        assert mutation_log is not None
+
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if not mutation_log.mutations_since_snapshot():
+                continue
+
+            # Capturing the snapshot runs on the event loop, so no request is handled meanwhile;
+            # writing it does not block the loop.
+            snapshot = mutation_log.capture_snapshot(self.server_state)
+            await loop.run_in_executor(None, mutation_log.write_snapshot, snapshot)
+
+    def deliver_changes(self, changes: SlotChanges) -> None:
+        # The subscribers write to the streams of their connections, which only the event loop
+        # may do, and the changes may come from the thread of the mutation log.
+        if self._loop is None:
+            self.subscriptions.publish(changes)
+        else:
+            self._loop.call_soon_threadsafe(self.subscriptions.publish, changes)
+
+    async def _reply(self,
+                     msg_bytes: bytes,
+                     ip_address: str,
+                     codec: Codec,
+                     subscriber: Optional[Subscriber] = None) -> Union[Message, bytes]:
+        """
+        Returns the reply to a request, as a message or already encoded with `codec`.
+        """
+
+        reply = self._request_handler.begin(msg_bytes, ip_address, codec, subscriber)
+        if isinstance(reply, DeferredReply):
+            # Other requests are served while the deferred work runs.
+            await asyncio.wait([asyncio.wrap_future(reply.future)])
+            reply = self._request_handler.finish(reply)
+
+        # Other requests join the same group commit while this one waits.
+        durable = self.durable_future()
+        if durable is not None:
+            await asyncio.wrap_future(durable)
+
+        return reply
+
+    async def _handle_connection(self,
+                                 reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        ip_address = writer.get_extra_info("peername")[0]
+        codec: Optional[Codec] = None
+        subscriber: Optional[_AsyncSubscriber] = None
+
+        try:
+            first_byte = await reader.readexactly(1)
+            framing: Union[_DelimitedFraming, _LengthPrefixedFraming]
+            if is_length_prefixed(first_byte):
+                framing = _LengthPrefixedFraming(reader, writer, first_byte)
+            else:
+                framing = _DelimitedFraming(reader, writer, self._delimiter, first_byte)
+
+            while True:
+                msg_bytes = await framing.receive()
+
+                if codec is None:
+                    # The first request selects the codec of the connection.
+                    codec = detect_codec(msg_bytes)
+                    subscriber = _AsyncSubscriber(codec, framing, writer, self)
+
+                reply = await self._reply(msg_bytes, ip_address, codec, subscriber)
+
+                if isinstance(reply, StreamMessage):
+                    # Other connections are served while waiting for the client to consume
+                    # the chunks.
+                    for chunk in reply.chunks():
+                        self._send_reply(framing, writer, chunk, codec)
+                        await writer.drain()
+                else:
+                    self._send_reply(framing, writer, reply, codec)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError,
+                ValueError):
+            pass
+        finally:
+            if subscriber is not None:
+                self.subscriptions.unsubscribe(subscriber)
+            writer.close()
+
+    def _send_reply(self,
+                    framing: Union["_DelimitedFraming", "_LengthPrefixedFraming"],
+                    writer: asyncio.StreamWriter,
+                    reply: Union[Message, bytes],
+                    codec: Codec) -> None:
+        # Queues a reply, or a chunk of a streamed one, on the connection.
+        framing.send(reply if isinstance(reply, bytes) else reply.to_bytes(codec))
+
+class _AsyncSubscriber(Subscriber):
+    """
+    The subscriber of a connection of an `AsyncServer`. The events are written to the stream of
+    the connection at once; if more than `MAX_PUSH_BUFFER` bytes are waiting to be sent, the
+    subscriber is dropped and its connection closed, and the client has to reconnect and list the
+    time slots again.
+    """
+
+    def __init__(self,
+                 codec: Codec,
+                 framing: Union["_DelimitedFraming", "_LengthPrefixedFraming"],
+                 writer: asyncio.StreamWriter,
+                 server: AsyncServer) -> None:
+        Subscriber.__init__(self, codec)
+        self._framing = framing
+        self._writer = writer
+        self._server = server
+
+    def push(self, message: bytes) -> None:
+        if self._writer.is_closing():
+            return
+
+        if self._writer.transport.get_write_buffer_size() > MAX_PUSH_BUFFER:
+            self._server.subscriptions.unsubscribe(self)
+            self._writer.transport.abort()
+            return
+
+        self._framing.send(message)
+
+class _DelimitedFraming:
+    """
+    Delimited framing on asyncio streams, see `Transceiver`.
+    """
+
+    def __init__(self,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 delimiter: bytes,
+                 initial: bytes = b'') -> None:
+        """
+        Args:
+            initial: Bytes of the first message that have already been read from `reader`.
+        """
+
+        self._reader = reader
+        self._writer = writer
+        self._delimiter = delimiter
+        self._initial = initial
+
+    async def receive(self) -> bytes:
+        """
+        Receives the next message.
+        """
+
+        msg_bytes = await self._reader.readuntil(self._delimiter)
+        if self._initial:
+            msg_bytes = self._initial + msg_bytes
+            self._initial = b''
+
+        return msg_bytes[:-len(self._delimiter)]
+
+    def send(self, message: bytes) -> None:
+        """
+        Queues a message for sending.
+        """
+
+        self._writer.writelines((message, self._delimiter))
+
+class _LengthPrefixedFraming:
+    """
+    Length prefixed framing on asyncio streams, see `LengthPrefixedTransceiver`.
+    """
+
+    def __init__(self,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 initial: bytes = b'') -> None:
+        """
+        Args:
+            initial: Bytes of the first header that have already been read from `reader`.
+        """
+
+        self._reader = reader
+        self._writer = writer
+        self._initial = initial
+
+    async def receive(self) -> bytes:
+        """
+        Receives the next message. Raises `ValueError` if it is larger than `MAX_REQUEST_SIZE`.
+        """
+
+        header_size = LengthPrefixedTransceiver.HEADER.size
+        header = await self._reader.readexactly(header_size - len(self._initial))
+        if self._initial:
+            header = self._initial + header
+            self._initial = b''
+
+        length, = LengthPrefixedTransceiver.HEADER.unpack(header)
+        if length > MAX_REQUEST_SIZE:
+            raise ValueError("Request of {} bytes exceeds the limit of {} bytes."
+                             .format(length, MAX_REQUEST_SIZE))
+
+        return await self._reader.readexactly(length)
+
+    def send(self, message: bytes) -> None:
+        """
+        Queues a message for sending.
+        """
+
+        self._writer.writelines((LengthPrefixedTransceiver.HEADER.pack(len(message)), message))
+
+
+def server_main(columnar: bool = False, durable: bool = False):
+    """
+    Server main loop.
+    """
+
+    print("Entering asyncio server!")
+    HOST = "0.0.0.0"
+    PORT = 9998
+
+    server_state = load_server_state(columnar, DATA_DIR if durable else None)
+    server = AsyncServer(HOST, PORT, server_state)
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server_state.mutation_log is not None:
+            server_state.mutation_log.close()
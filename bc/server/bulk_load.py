@@ -0,0 +1,282 @@
+"""
+This module contains the bulk loader of the service provider database and its binary format.
+
+The text format has a line per service provider: the name of the provider followed by its time
+slots, separated by semicolons, each time slot in the form yyyy-mm-dd-hh. The bulk loader parses
+many lines at once and validates and packs their time slots in batches with NumPy, instead of
+creating and checking a `TimeSlot` per slot.
+
+The binary format stores the time slots packed with `pack_time_slot`, sorted and without
+duplicates, in a column that is mapped into memory with `mmap` and used by a
+`ColumnarSlotStore` without copying. It is little endian:
+
+    header         magic, number of providers, number of slots, size of the names (8s, 3 x u64)
+    name lengths   u32 per provider
+    names          the UTF-8 names of the providers, padded to 8 bytes
+    counts         u64 per provider, the number of slots of the provider
+    times          i32 per slot, the slots of the first provider, then of the second one and so on
+
+Convert a text file with `python -m bc.server.bulk_load service_providers.txt
+service_providers.bin`. NumPy is required.
+"""
+
+import argparse
+import mmap
+import struct
+
+from array import array
+from typing import Dict, List, NamedTuple, Sequence, Tuple, Type
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.columnar import ColumnarSlotStore
+from bc.server.server_util import SlotStore, TimeSlotInfo, TimeSlotState
+
+MAGIC = b"BCPROV1\n"
+_HEADER = struct.Struct("<8sQQQ")
+
+# The number of time slots validated and packed at once.
+BATCH_SIZE = 1 << 16
+
+# The last valid day of each month value that can be packed, see `TimeSlot`.
+_MAX_DAYS = None if numpy is None else numpy.array(
+    [28 if month == 2 else 30 if month in (4, 6, 9, 11) else 31 for month in range(16)])
+
+class ProviderColumns(NamedTuple):
+    """
+    The service provider database as columns. The time slots are packed with `pack_time_slot`;
+    the slots of the first provider come first, then the slots of the second one and so on.
+    """
+
+    providers: List[ServiceProvider]
+    counts: Sequence[int]
+    times: Sequence[int]
+
+def parse_service_providers(filename: str) -> ProviderColumns:
+    """
+    Parses a text service provider file. Like `ServerState.load_service_providers`, a later line
+    of a provider replaces the earlier ones. The time slots of each provider are sorted and
+    duplicates are dropped. Raises `ValueError` on an invalid time slot.
+    """
+
+    _require_numpy()
+
+    columns: Dict[ServiceProvider, "numpy.ndarray"] = dict()
+
+    # The fields of the time slots not yet validated, and the providers they belong to with the
+    # ranges of their slots.
+    fields = array("q")
+    pending: List[Tuple[ServiceProvider, int, int]] = []
+
+    def flush() -> None:
+        packed = _pack_fields(numpy.frombuffer(fields, dtype=numpy.int64).reshape(-1, 4),
+                              pending)
+        for provider, start, end in pending:
+            columns[provider] = packed[start:end]
+
+    with open(filename) as sp_file:
+        for line in sp_file:
+            name, _, slots = line.strip().partition(";")
+            if not name and not slots:
+                # Empty line.
+                continue
+
+            start = len(fields) // 4
+            for slot in (slots.split(";") if slots else []):
+                # Format: yyyy-mm-dd-hh, like `ServerState._parse_time_slot`.
+                parts = slot.split("-")
+                try:
+                    if len(parts) != 4:
+                        raise ValueError()
+                    fields.extend(map(int, parts))
+                except ValueError:
+                    raise ValueError("Invalid time slot string {} in the record of {}.".format(
+                        slot, name))
+            pending.append((ServiceProvider(name), start, len(fields) // 4))
+
+            if len(fields) >= 4 * BATCH_SIZE:
+                flush()
+                fields = array("q")
+                pending = []
+
+    flush()
+
+    providers = list(columns.keys())
+    sorted_columns = [numpy.unique(columns[provider]) for provider in providers]
+    counts = [len(column) for column in sorted_columns]
+    times = (numpy.concatenate(sorted_columns) if sorted_columns
+             else numpy.zeros(0, dtype=numpy.int32))
+
+    return ProviderColumns(providers, counts, times.astype(numpy.int32, copy=False))
+
+def write_provider_file(filename: str, columns: ProviderColumns) -> None:
+    """
+    Writes the columns in the binary format. The time slots of each provider must be sorted and
+    distinct, as returned by `parse_service_providers`.
+    """
+
+    _require_numpy()
+
+    names = [provider.name().encode("utf-8") for provider in columns.providers]
+    names_blob = b"".join(names)
+
+    with open(filename, "wb") as provider_file:
+        provider_file.write(_HEADER.pack(MAGIC, len(names), len(columns.times), len(names_blob)))
+        provider_file.write(numpy.asarray([len(name) for name in names], dtype="<u4").tobytes())
+        provider_file.write(names_blob)
+        provider_file.write(b"\0" * _padding(provider_file.tell()))
+        provider_file.write(numpy.asarray(columns.counts, dtype="<u8").tobytes())
+        provider_file.write(numpy.asarray(columns.times, dtype="<i4").tobytes())
+
+def read_provider_file(filename: str) -> ProviderColumns:
+    """
+    Maps a binary provider file into memory and returns its columns. The time column is a
+    read-only view of the mapping, so the slots are not copied. Raises `ValueError` if the file is
+    invalid.
+    """
+
+    _require_numpy()
+
+    with open(filename, "rb") as provider_file:
+        mapping = mmap.mmap(provider_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(mapping) < _HEADER.size:
+        raise ValueError("Truncated provider file {}.".format(filename))
+
+    magic, provider_count, slot_count, names_size = _HEADER.unpack_from(mapping)
+    if magic != MAGIC:
+        raise ValueError("{} is not a provider file.".format(filename))
+
+    offset = _HEADER.size
+    name_lengths = numpy.frombuffer(mapping, dtype="<u4", count=provider_count, offset=offset)
+    offset += name_lengths.nbytes
+
+    names_blob = mapping[offset:offset + names_size]
+    offset += names_size
+    offset += _padding(offset)
+
+    counts = numpy.frombuffer(mapping, dtype="<u8", count=provider_count, offset=offset)
+    offset += counts.nbytes
+
+    if len(mapping) != offset + 4 * slot_count or int(counts.sum()) != slot_count:
+        raise ValueError("Invalid provider file {}.".format(filename))
+    times = numpy.frombuffer(mapping, dtype="<i4", count=slot_count, offset=offset)
+
+    if int(name_lengths.sum()) != names_size:
+        raise ValueError("Invalid provider file {}.".format(filename))
+    ends = numpy.cumsum(name_lengths).tolist()
+    providers = [ServiceProvider(names_blob[end - length:end].decode("utf-8"))
+                 for end, length in zip(ends, name_lengths.tolist())]
+
+    # Cheap compared to parsing: the stores rely on the slots being valid, sorted and distinct.
+    _validate_packed(times)
+    increasing = numpy.diff(times) > 0
+    provider_starts = numpy.cumsum(counts)[:-1].astype(numpy.int64)
+    increasing[provider_starts[(provider_starts > 0) & (provider_starts < slot_count)] - 1] = True
+    if not increasing.all():
+        raise ValueError("The time slots in {} are not sorted.".format(filename))
+
+    return ProviderColumns(providers, counts.tolist(), times)
+
+def convert(text_filename: str, binary_filename: str) -> None:
+    """
+    Converts a text service provider file to the binary format.
+    """
+
+    write_provider_file(binary_filename, parse_service_providers(text_filename))
+
+def build_slot_store(columns: ProviderColumns, store_type: Type[SlotStore]) -> SlotStore:
+    """
+    Builds a slot store of the given type with all the time slots available. A
+    `ColumnarSlotStore` uses the time column as it is.
+    """
+
+    _require_numpy()
+
+    slots = len(columns.times)
+    if issubclass(store_type, ColumnarSlotStore):
+        return store_type.from_columns(columns.providers,
+                                       columns.counts,
+                                       columns.times,
+                                       numpy.full(slots, TimeSlotState.AVAILABLE.value,
+                                                  dtype=numpy.int8),
+                                       numpy.zeros(slots, dtype=numpy.int64),
+                                       presorted=True)
+
+    # The packed times are the ordinals of the time slots, and have been validated.
+    times = numpy.asarray(columns.times).tolist()
+
+    db = dict()
+    start = 0
+    for provider, count in zip(columns.providers, columns.counts):
+        end = start + count
+        db[provider] = [TimeSlotInfo(TimeSlot.from_ordinal(time), TimeSlotState.AVAILABLE, 0)
+                        for time in times[start:end]]
+        start = end
+
+    return store_type(db)
+
+def load_slot_store(filename: str, store_type: Type[SlotStore]) -> SlotStore:
+    """
+    Loads a service provider file, binary or text, into a slot store of the given type.
+    """
+
+    with open(filename, "rb") as provider_file:
+        is_binary = provider_file.read(len(MAGIC)) == MAGIC
+
+    if is_binary:
+        columns = read_provider_file(filename)
+    else:
+        columns = parse_service_providers(filename)
+
+    return build_slot_store(columns, store_type)
+
+def _pack_fields(fields: "numpy.ndarray", pending: List[Tuple[ServiceProvider, int, int]]):
+    """
+    Validates the rows of year, month, day and hour like `TimeSlot` does, and packs them like
+    `pack_time_slot`.
+    """
+
+    years, months, days, hours = fields.T
+    valid = ((years >= 0) & (years < (1 << 16)) & (months >= 1) & (months <= 12)
+             & (hours >= 0) & (hours <= 24) & (days >= 0))
+    valid &= days <= _MAX_DAYS[numpy.clip(months, 0, 15)]
+
+    if not valid.all():
+        row = int(numpy.argmin(valid))
+        provider = next(provider for provider, start, end in pending if start <= row < end)
+        raise ValueError("Invalid time slot {} of {}."
+                         .format("-".join(map(str, fields[row].tolist())), provider))
+
+    return (((years << 4 | months) << 5 | days) << 5 | hours).astype(numpy.int32)
+
+def _validate_packed(times: "numpy.ndarray") -> None:
+    days = (times >> 5) & 0x1f
+    months = (times >> 10) & 0xf
+    valid = ((times >= 0) & ((times & 0x1f) <= 24) & (months >= 1) & (months <= 12)
+             & (days <= _MAX_DAYS[months]))
+    if not valid.all():
+        raise ValueError("Invalid time slot in the provider file.")
+
+def _padding(offset: int) -> int:
+    return -offset % 8
+
+def _require_numpy() -> None:
+    if numpy is None:
+        raise ImportError("The bulk loader requires NumPy.")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Converts a text service provider file to the "
+                                     "binary format.")
+    parser.add_argument("input", help="The text file.")
+    parser.add_argument("output", help="The binary file.")
+    args = parser.parse_args()
+
+    convert(args.input, args.output)
+
+if __name__ == '__main__':
+    main()
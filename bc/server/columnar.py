@@ -0,0 +1,308 @@
+"""
+This module contains a columnar slot store that keeps the time slots in NumPy arrays.
+
+NumPy is an optional dependency; it is only needed if this store is used.
+"""
+
+from typing import Dict, Iterator, List, Optional, Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.server_util import ChunkedSlotSnapshot, SlotStore, TimeSlotInfo, TimeSlotState
+
+def pack_time_slot(time_slot: TimeSlot) -> int:
+    """
+    Packs a time slot into an integer that orders the same way as the time slots do: its
+    `TimeSlot.ordinal`, which fits 32 bits for the years below 2 ** 16.
+    """
+
+    ordinal = time_slot.ordinal()
+    if not 0 <= ordinal < (1 << 30):
+        raise ValueError("Time slot out of the supported range: {}.".format(time_slot))
+
+    return ordinal
+
+def _pack_bound(time_slot: TimeSlot) -> int:
+    # Packs a bound of a range query. The bounds out of the range of `pack_time_slot` are clamped
+    # to it, as no stored time slot is out of the range, so the queries work like in the other
+    # stores instead of raising.
+    return min(max(time_slot.ordinal(), 0), 1 << 30)
+
+def unpack_time_slot(packed: int) -> TimeSlot:
+    """
+    The inverse of `pack_time_slot`.
+    """
+
+    return TimeSlot.from_ordinal(packed)
+
+def _read_only(array: "numpy.ndarray") -> "numpy.ndarray":
+    array.setflags(write=False)
+    return array
+
+class PackedSlotSnapshot(ChunkedSlotSnapshot):
+    """
+    A `ChunkedSlotSnapshot` that keeps the time slots packed with `pack_time_slot` in read-only
+    NumPy arrays, 4 bytes per slot.
+    """
+
+    def __init__(self, version: int, times: "numpy.ndarray") -> None:
+        times.setflags(write=False)
+        ChunkedSlotSnapshot.__init__(self, version, times)
+
+    @staticmethod
+    def _pack(time_slot: TimeSlot) -> int:
+        return pack_time_slot(time_slot)
+
+    @staticmethod
+    def _pack_bound(time_slot: TimeSlot) -> int:
+        return _pack_bound(time_slot)
+
+    @staticmethod
+    def _make_chunk(keys: List[int]) -> "numpy.ndarray":
+        return _read_only(numpy.array(keys, dtype=numpy.int32))
+
+    @staticmethod
+    def _last(chunk: "numpy.ndarray") -> int:
+        return int(chunk[-1])
+
+    @staticmethod
+    def _find(chunk: "numpy.ndarray", key: int, right: bool = False) -> int:
+        return int(numpy.searchsorted(chunk, key, side="right" if right else "left"))
+
+    @staticmethod
+    def _insert(chunk: "numpy.ndarray", i: int, key: int) -> "numpy.ndarray":
+        return _read_only(numpy.insert(chunk, i, key))
+
+    @staticmethod
+    def _delete(chunk: "numpy.ndarray", i: int) -> "numpy.ndarray":
+        return _read_only(numpy.delete(chunk, i))
+
+    @staticmethod
+    def _unpack(chunk: "numpy.ndarray", start: int, end: int) -> Iterator[TimeSlot]:
+        return map(unpack_time_slot, chunk[start:end].tolist())
+
+class ColumnarSlotStore(SlotStore):
+    """
+    A slot store that keeps the packed time, the state and the owner of every time slot in three
+    NumPy arrays instead of a `TimeSlotInfo` object per slot, which takes 13 bytes per slot. The
+    owners are 64-bit, like the client ids in the mutation log (see `MAX_USER_ID`). The
+    slots are sorted by provider and then by time, so every provider owns a contiguous range of
+    the arrays.
+
+    Lookups bisect the range of the provider. Listings are vectorized mask operations over the
+    arrays; the per-owner ones scan all the slots, but at memory speed rather than by evaluating a
+    predicate per slot. The `TimeSlotInfo` objects returned by `find_time_slot_info` and
+    `service_provider_db` are copies.
+    """
+
+    def __init__(self, service_provider_db: Dict[ServiceProvider, List[TimeSlotInfo]]) -> None:
+        SlotStore.__init__(self, service_provider_db)
+
+        if numpy is None:
+            raise ImportError("The columnar slot store requires NumPy.")
+
+        providers = list(service_provider_db.keys())
+        counts = [len(service_provider_db[provider]) for provider in providers]
+
+        ts_infos = [ts_info for provider in providers for ts_info in service_provider_db[provider]]
+        times = [pack_time_slot(ts_info.time_slot) for ts_info in ts_infos]
+        states = [ts_info.state.value for ts_info in ts_infos]
+        owners = [ts_info.owner for ts_info in ts_infos]
+
+        self._init_columns(providers, counts, times, states, owners)
+
+    @staticmethod
+    def from_columns(providers: Sequence[ServiceProvider],
+                     counts: Sequence[int],
+                     times: Sequence[int],
+                     states: Sequence[int],
+                     owners: Sequence[int],
+                     presorted: bool = False) -> "ColumnarSlotStore":
+        """
+        Builds the store directly from columns, without creating an object per slot.
+
+        Args:
+            providers: The service providers.
+            counts: The number of slots of each provider. The slots of the first provider come
+                first in the other columns, then the slots of the second one and so on.
+            times: The time slots packed with `pack_time_slot`.
+            states: The values of the `TimeSlotState`s.
+            owners: The owners of the slots.
+            presorted: Whether the slots of each provider are already sorted by time. If so,
+                int32 time, int8 state and int64 owner columns are used without copying, e.g. a
+                time column mapped from a file.
+        """
+
+        store = ColumnarSlotStore.__new__(ColumnarSlotStore)
+        store._init_columns(providers, counts, times, states, owners, presorted)
+        return store
+
+    def _init_columns(self,
+                      providers: Sequence[ServiceProvider],
+                      counts: Sequence[int],
+                      times: Sequence[int],
+                      states: Sequence[int],
+                      owners: Sequence[int],
+                      presorted: bool = False) -> None:
+        if numpy is None:
+            raise ImportError("The columnar slot store requires NumPy.")
+
+        self._providers = list(providers)
+        self._provider_ids = {provider: i for i, provider in enumerate(self._providers)}
+
+        counts_array = numpy.asarray(counts, dtype=numpy.int64)
+        self._ends = numpy.cumsum(counts_array)
+        self._starts = self._ends - counts_array
+
+        times_array = numpy.asarray(times, dtype=numpy.int32)
+        states_array = numpy.asarray(states, dtype=numpy.int8)
+        owners_array = numpy.asarray(owners, dtype=numpy.int64)
+
+        if presorted:
+            # The times are never modified, so they may be read-only.
+            self._times = times_array
+            self._states = states_array
+            self._owners = owners_array
+            return
+
+        provider_ids = numpy.repeat(numpy.arange(len(self._providers)), counts_array)
+        order = numpy.lexsort((times_array, provider_ids))
+
+        self._times = times_array[order]
+        self._states = states_array[order]
+        self._owners = owners_array[order]
+
+    def memory_usage(self) -> int:
+        """
+        Returns the number of bytes taken by the columns.
+        """
+
+        return self._times.nbytes + self._states.nbytes + self._owners.nbytes
+
+    def service_provider_db(self) -> Dict[ServiceProvider, List[TimeSlotInfo]]:
+        result = dict()
+        for provider_id, provider in enumerate(self._providers):
+            rows = range(self._starts[provider_id], self._ends[provider_id])
+            result[provider] = [self._ts_info(row) for row in rows]
+
+        return result
+
+    def providers(self) -> List[ServiceProvider]:
+        return self._providers
+
+    def has_service_provider(self, provider: ServiceProvider) -> bool:
+        return provider in self._provider_ids
+
+    def find_time_slot_info(self,
+                            provider: ServiceProvider,
+                            time_slot: TimeSlot) -> Optional[TimeSlotInfo]:
+        row = self._find_row(provider, time_slot)
+        if row is None:
+            return None
+
+        return self._ts_info(row)
+
+    def set_time_slot_state(self,
+                            provider: ServiceProvider,
+                            ts_info: TimeSlotInfo,
+                            state: TimeSlotState,
+                            owner: int) -> None:
+        row = self._find_row(provider, ts_info.time_slot)
+        if row is None:
+            raise KeyError("No time slot {} for {}.".format(ts_info.time_slot, provider))
+
+        self._states[row] = state.value
+        self._owners[row] = owner
+        ts_info.state = state
+        ts_info.owner = owner
+
+    def appointments_of_owner(self, owner: int, state: TimeSlotState) -> List[Appointment]:
+        # Ordered by provider and then chronologically.
+        mask = (self._owners == owner) & (self._states == state.value)
+        return self._appointments(numpy.flatnonzero(mask))
+
+    def appointments_in_state(self,
+                              state: TimeSlotState,
+                              provider: Optional[ServiceProvider] = None,
+                              time_from: Optional[TimeSlot] = None,
+                              time_to: Optional[TimeSlot] = None,
+                              after: Optional[Appointment] = None,
+                              limit: Optional[int] = None) -> Iterator[Appointment]:
+        after_id = None if after is None else self._provider_ids.get(after.service_provider())
+        packed_after = None if after_id is None else _pack_bound(after.time_slot())
+
+        if provider is not None:
+            provider_id = self._provider_ids.get(provider)
+            provider_ids = [] if provider_id is None else [provider_id]
+        else:
+            provider_ids = range(after_id or 0, len(self._providers))
+
+        packed_from = None if time_from is None else _pack_bound(time_from)
+        packed_to = None if time_to is None else _pack_bound(time_to)
+
+        count = 0
+        for provider_id in provider_ids:
+            start = int(self._starts[provider_id])
+            end = int(self._ends[provider_id])
+            times = self._times[start:end]
+
+            first = 0 if packed_from is None else int(numpy.searchsorted(times, packed_from))
+            last = len(times) if packed_to is None else int(numpy.searchsorted(times, packed_to))
+            if provider_id == after_id:
+                first = max(first, int(numpy.searchsorted(times, packed_after, side="right")))
+
+            # Every provider's rows are found at once, so the iterator reflects the state when
+            # it reached the provider.
+            rows = numpy.flatnonzero(self._states[start + first:start + last] == state.value)
+            if limit is not None:
+                rows = rows[:limit - count]
+            count += len(rows)
+            yield from self._appointments(rows + start + first)
+
+            if limit is not None and count >= limit:
+                return
+
+    def snapshot(self,
+                 provider: ServiceProvider,
+                 state: TimeSlotState,
+                 version: int) -> PackedSlotSnapshot:
+        provider_id = self._provider_ids[provider]
+        start = int(self._starts[provider_id])
+        end = int(self._ends[provider_id])
+        times = self._times[start:end][self._states[start:end] == state.value]
+
+        return PackedSlotSnapshot(version, times)
+
+    def _find_row(self, provider: ServiceProvider, time_slot: TimeSlot) -> Optional[int]:
+        provider_id = self._provider_ids.get(provider)
+        if provider_id is None:
+            return None
+
+        try:
+            packed = pack_time_slot(time_slot)
+        except ValueError:
+            return None
+
+        start = self._starts[provider_id]
+        end = self._ends[provider_id]
+        row = start + int(numpy.searchsorted(self._times[start:end], packed))
+        if row == end or self._times[row] != packed:
+            return None
+
+        return int(row)
+
+    def _ts_info(self, row: int) -> TimeSlotInfo:
+        return TimeSlotInfo(unpack_time_slot(int(self._times[row])),
+                            TimeSlotState(int(self._states[row])),
+                            int(self._owners[row]))
+
+    def _appointments(self, rows) -> List[Appointment]:
+        provider_ids = numpy.searchsorted(self._ends, rows, side="right").tolist()
+        times = self._times[rows].tolist()
+
+        return [Appointment(self._providers[provider_id], unpack_time_slot(packed))
+                for provider_id, packed in zip(provider_ids, times)]
@@ -0,0 +1,120 @@
+"""
+This module contains the salted password hashes of the users.
+
+A hash is stored as "scrypt$<log2 n>$<r>$<p>$<salt>$<key>", the salt and the key in base64.
+Hashing is deliberately slow, so the server verifies passwords on a worker pool (see
+`ServerBase.password_verifier`). `hashlib.scrypt` releases the GIL, so the pool runs the
+verifications in parallel with each other and with the request handling.
+
+Convert a users file with plain text passwords with `python -m bc.server.credentials users.txt
+users_hashed.txt`.
+"""
+
+import argparse
+import base64
+import functools
+import hashlib
+import hmac
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+# The scrypt cost parameter is 2 ** DEFAULT_LOG2_N.
+DEFAULT_LOG2_N = 14
+DEFAULT_R = 8
+DEFAULT_P = 1
+
+# Bounds the work that a hash read from a file can demand.
+MAX_LOG2_N = 20
+
+_SALT_SIZE = 16
+_KEY_SIZE = 32
+_PREFIX = "scrypt$"
+
+def _scrypt(password: str, salt: bytes, log2_n: int, r: int, p: int) -> bytes:
+    # scrypt needs 128 * r * n * p bytes; OpenSSL rejects more than `maxmem`.
+    maxmem = 2 * 128 * r * (1 << log2_n) * p + (1 << 20)
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=1 << log2_n, r=r, p=p,
+                          maxmem=maxmem, dklen=_KEY_SIZE)
+
+def hash_password(password: str,
+                  log2_n: int = DEFAULT_LOG2_N,
+                  r: int = DEFAULT_R,
+                  p: int = DEFAULT_P) -> str:
+    """
+    Returns a salted hash of the password. Lower costs than the defaults are only meant for tests
+    and benchmarks.
+    """
+
+    salt = os.urandom(_SALT_SIZE)
+    key = _scrypt(password, salt, log2_n, r, p)
+
+    return "{}{}${}${}${}${}".format(_PREFIX, log2_n, r, p,
+                                     base64.b64encode(salt).decode("ascii"),
+                                     base64.b64encode(key).decode("ascii"))
+
+def is_password_hash(value: str) -> bool:
+    """
+    Returns whether `value` looks like a hash returned by `hash_password`.
+    """
+
+    return value.startswith(_PREFIX) and value.count("$") == 5
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Returns whether the password matches the hash. Malformed hashes match no password.
+    """
+
+    try:
+        _, log2_n, r, p, salt, key = password_hash.split("$")
+        log2_n_value = int(log2_n)
+        if not 1 <= log2_n_value <= MAX_LOG2_N:
+            return False
+        expected = base64.b64decode(key, validate=True)
+        actual = _scrypt(password, base64.b64decode(salt, validate=True), log2_n_value, int(r),
+                         int(p))
+    except ValueError:
+        return False
+
+    return hmac.compare_digest(expected, actual)
+
+@functools.lru_cache(maxsize=None)
+def dummy_password_hash() -> str:
+    """
+    Returns a hash of the default cost that no password is checked to match. Checking the
+    password of an unknown user against it takes as long as checking that of a known user, so
+    the time of the reply does not reveal whether the user exists. It is hashed on the first
+    call, so the servers call it at start-up.
+    """
+
+    return hash_password("")
+
+def hash_passwords(passwords: List[str], workers: int = 0) -> List[str]:
+    """
+    Hashes the passwords on `workers` threads, by default one per CPU.
+    """
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(hash_password, passwords))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replaces the plain text passwords of a users "
+                                     "file with salted hashes.")
+    parser.add_argument("input", help="The users file.")
+    parser.add_argument("output", help="The users file with hashed passwords.")
+    args = parser.parse_args()
+
+    with open(args.input) as users_file:
+        records = [line.strip().split(";") for line in users_file if line.strip()]
+
+    plain = [i for i, record in enumerate(records) if not is_password_hash(record[2])]
+    for i, password_hash in zip(plain, hash_passwords([records[i][2] for i in plain])):
+        records[i][2] = password_hash
+
+    with open(args.output, "w") as users_file:
+        for record in records:
+            users_file.write(";".join(record) + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+This module contains a priority queue of deadlines for expiring entries.
+"""
+
+import heapq
+import itertools
+
+from typing import Dict, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+# Marks the heap entries of keys that were rescheduled or cancelled.
+_REMOVED = object()
+
+class ExpiryQueue(Generic[K]):
+    """
+    Keys with deadlines, in a min-heap ordered by the deadline. Scheduling, cancelling and popping
+    a key take O(log n) time, so expired entries are found without scanning the live ones.
+
+    Cancelled and rescheduled keys leave their old heap entries behind, marked as removed; the
+    heap is rebuilt when they outnumber the live entries, so its size stays proportional to the
+    number of keys.
+    """
+
+    def __init__(self) -> None:
+        # Entries are [deadline, sequence number, key]; the sequence number keeps keys that are
+        # not comparable out of the comparisons.
+        self._heap: List[list] = []
+        self._entries: Dict[K, list] = dict()
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def schedule(self, key: K, deadline: float) -> None:
+        """
+        Sets the deadline of `key`, replacing its earlier deadline if any.
+        """
+
+        self._remove(key)
+
+        entry = [deadline, next(self._counter), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, key: K) -> bool:
+        """
+        Removes `key` from the queue. Returns whether it was in the queue.
+        """
+
+        return self._remove(key)
+
+    def deadline(self, key: K) -> Optional[float]:
+        """
+        Returns the deadline of `key`, or None if it is not in the queue.
+        """
+
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        Returns the earliest deadline, or None if the queue is empty.
+        """
+
+        self._drop_removed()
+        return self._heap[0][0] if self._heap else None
+
+    def peek(self) -> Optional[K]:
+        """
+        Returns the key with the earliest deadline without removing it, or None if the queue is
+        empty.
+        """
+
+        self._drop_removed()
+        return self._heap[0][2] if self._heap else None
+
+    def pop(self) -> K:
+        """
+        Removes and returns the key with the earliest deadline. Raises `KeyError` if the queue is
+        empty.
+        """
+
+        self._drop_removed()
+        if not self._heap:
+            raise KeyError("pop from an empty expiry queue")
+
+        key = heapq.heappop(self._heap)[2]
+        del self._entries[key]
+        return key
+
+    def pop_expired(self, now: float, limit: Optional[int] = None) -> List[K]:
+        """
+        Removes and returns the keys whose deadline is not later than `now`, earliest first, at
+        most `limit` of them if it is given.
+        """
+
+        result = []
+        while limit is None or len(result) < limit:
+            self._drop_removed()
+            if not self._heap or self._heap[0][0] > now:
+                break
+
+            key = heapq.heappop(self._heap)[2]
+            del self._entries[key]
+            result.append(key)
+
+        return result
+
+    def _remove(self, key: K) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+
+        entry[2] = _REMOVED
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[2] is not _REMOVED]
+            heapq.heapify(self._heap)
+
+        return True
+
+    def _drop_removed(self) -> None:
+        while self._heap and self._heap[0][2] is _REMOVED:
+            heapq.heappop(self._heap)
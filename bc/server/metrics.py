@@ -0,0 +1,184 @@
+"""
+This module contains the request metrics of the servers. Run it to print the metrics of a server
+on the same host in the Prometheus text exposition format.
+"""
+
+import argparse
+import bisect
+import socket
+import threading
+
+from enum import Enum, unique
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bc.common.comm_util import LengthPrefixedTransceiver, Message, RequestGenerator, RequestType
+
+# The upper bounds of the latency buckets, in microseconds.
+LATENCY_BOUNDS_US = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000,
+                     500000, 1000000, 2500000)
+
+@unique
+class Outcome(Enum):
+    """
+    The outcomes of requests: served successfully, refused (e.g. the time slot is taken), denied
+    for the lack of a session, invalid, or rejected by the admission control.
+    """
+
+    OK = "ok"
+    FAILED = "failed"
+    DENIED = "denied"
+    INVALID = "invalid"
+    REJECTED = "rejected"
+
+class Histogram:
+    """
+    Counts of integer values in fixed buckets, like a Prometheus histogram. The bucket `i` counts
+    the values that are at most `bounds[i]` but greater than the previous bound; the last bucket
+    counts the values greater than every bound.
+    """
+
+    def __init__(self, bounds: Sequence[int]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value: int) -> None:
+        """
+        Adds a value to the histogram.
+        """
+
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def cumulative_counts(self) -> List[int]:
+        """
+        Returns the number of values that are at most each bound, and the number of all values.
+        """
+
+        result = []
+        count = 0
+        for bucket in self.counts:
+            count += bucket
+            result.append(count)
+
+        return result
+
+class RequestMetrics:
+    """
+    Counters of the requests per request type and outcome, and histograms of the time spent
+    handling them per request type. Requests that could not be decoded have no type. The metrics
+    are thread-safe.
+    """
+
+    def __init__(self, bounds: Sequence[int] = LATENCY_BOUNDS_US) -> None:
+        self.bounds = bounds
+
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[Optional[RequestType], Outcome], int] = dict()
+        self._latencies: Dict[Optional[RequestType], Histogram] = dict()
+
+    def record(self, request_type: Optional[RequestType], outcome: Outcome,
+               latency_us: int) -> None:
+        """
+        Records a request handled in `latency_us` microseconds.
+        """
+
+        if not isinstance(request_type, RequestType):
+            request_type = None
+
+        with self._lock:
+            key = (request_type, outcome)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+            histogram = self._latencies.get(request_type)
+            if histogram is None:
+                histogram = self._latencies[request_type] = Histogram(self.bounds)
+            histogram.observe(latency_us)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the metrics as a message object: the "requests" counted per request type name and
+        outcome, and the "latency_us" histograms per request type name with their cumulative
+        "buckets", their "count" and their "sum". The "bounds" of the buckets are in
+        microseconds.
+        """
+
+        with self._lock:
+            requests: Dict[str, Dict[str, int]] = dict()
+            for (request_type, outcome), count in self._counts.items():
+                requests.setdefault(_type_label(request_type), dict())[outcome.value] = count
+
+            latencies = {
+                _type_label(request_type): {"buckets": histogram.cumulative_counts(),
+                                            "count": histogram.count,
+                                            "sum": histogram.total}
+                for request_type, histogram in self._latencies.items()
+                }
+
+        return {"requests": requests, "latency_us": latencies, "bounds": list(self.bounds)}
+
+    def prometheus_text(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            counts = sorted(((_type_label(request_type), outcome.value), count)
+                            for (request_type, outcome), count in self._counts.items())
+            latencies = sorted((_type_label(request_type), histogram.cumulative_counts(),
+                                histogram.count, histogram.total)
+                               for request_type, histogram in self._latencies.items())
+
+        lines = ["# HELP bc_requests_total The requests handled, by type and outcome.",
+                 "# TYPE bc_requests_total counter"]
+        for (type_label, outcome_label), count in counts:
+            lines.append('bc_requests_total{{type="{}",outcome="{}"}} {}'
+                         .format(type_label, outcome_label, count))
+
+        lines += ["# HELP bc_request_duration_seconds The time spent handling the requests.",
+                  "# TYPE bc_request_duration_seconds histogram"]
+        for type_label, buckets, count, total in latencies:
+            bounds = ["{:g}".format(bound / 1e6) for bound in self.bounds] + ["+Inf"]
+            for bound, bucket in zip(bounds, buckets):
+                lines.append('bc_request_duration_seconds_bucket{{type="{}",le="{}"}} {}'
+                             .format(type_label, bound, bucket))
+            lines.append('bc_request_duration_seconds_sum{{type="{}"}} {:.6f}'
+                         .format(type_label, total / 1e6))
+            lines.append('bc_request_duration_seconds_count{{type="{}"}} {}'
+                         .format(type_label, count))
+
+        return "\n".join(lines) + "\n"
+
+def prometheus_metrics(metrics: Iterable[Tuple[str, str, str, Any]]) -> str:
+    """
+    Returns metrics without labels, given as (name, type, help, value) tuples, in the Prometheus
+    text exposition format.
+    """
+
+    lines = []
+    for name, metric_type, help_text, value in metrics:
+        lines += ["# HELP {} {}".format(name, help_text),
+                  "# TYPE {} {}".format(name, metric_type),
+                  "{} {}".format(name, value)]
+
+    return "".join(line + "\n" for line in lines)
+
+def _type_label(request_type: Optional[RequestType]) -> str:
+    return "UNKNOWN" if request_type is None else request_type.name
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prints the metrics of a server on this host.")
+    parser.add_argument("--port", type=int, default=9998)
+    args = parser.parse_args()
+
+    with socket.create_connection(("127.0.0.1", args.port)) as sock:
+        transceiver = LengthPrefixedTransceiver(sock)
+        transceiver.send(RequestGenerator.msg_stats().to_bytes())
+        reply = Message.from_bytes(transceiver.receive()).data()
+
+    print(reply["text"], end="")
+
+if __name__ == '__main__':
+    main()
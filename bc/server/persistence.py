@@ -0,0 +1,466 @@
+"""
+This module contains the write-ahead log that makes the state of the time slots durable.
+"""
+
+import heapq
+import itertools
+import os
+import struct
+import threading
+import zlib
+
+from concurrent.futures import Future
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.server_util import ServerState, TimeSlotState
+
+class Mutation(NamedTuple):
+    """
+    A change of the state and the owner of a time slot.
+    """
+
+    lsn: int
+    provider: ServiceProvider
+    time_slot: TimeSlot
+    state: TimeSlotState
+    owner: int
+
+# Length and CRC-32 of the payload.
+_FRAME = struct.Struct("!II")
+
+# LSN, year, month, day, hour, state and owner, followed by the name of the provider.
+_PAYLOAD = struct.Struct("!QHBBBBq")
+
+# Magic, LSN of the last mutation included and number of mutations. The mutations follow, then
+# the CRC-32 of everything before it.
+_SNAPSHOT_HEADER = struct.Struct("!8sQQ")
+_SNAPSHOT_MAGIC = b"BCSNAP1\n"
+_CRC = struct.Struct("!I")
+
+SNAPSHOT_FILENAME = "snapshot"
+
+def encode_mutation(mutation: Mutation) -> bytes:
+    """
+    Returns the mutation framed for the log.
+    """
+
+    time_slot = mutation.time_slot
+    payload = _PAYLOAD.pack(mutation.lsn, time_slot.year(), time_slot.month(), time_slot.day(),
+                            time_slot.hour(), mutation.state.value, mutation.owner)
+    payload += mutation.provider.name().encode("utf-8")
+
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode_mutations(data: bytes) -> Iterator[Tuple[Mutation, int]]:
+    """
+    Decodes the framed mutations of `data`, yielding each one with the offset of its end. It stops
+    at the first incomplete or corrupt frame, e.g. one torn by a crash.
+    """
+
+    offset = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        start = offset + _FRAME.size
+        end = start + length
+        if length < _PAYLOAD.size or end > len(data) or zlib.crc32(data[start:end]) != crc:
+            return
+
+        lsn, year, month, day, hour, state, owner = _PAYLOAD.unpack_from(data, start)
+        name = bytes(data[start + _PAYLOAD.size:end]).decode("utf-8")
+        yield (Mutation(lsn, ServiceProvider(name), TimeSlot(year, month, day, hour),
+                        TimeSlotState(state), owner),
+               end)
+        offset = end
+
+class Snapshot(NamedTuple):
+    """
+    The time slots that are not available at the mutation with the given LSN.
+    """
+
+    lsn: int
+    mutations: List[Mutation]
+
+class _NewSegment(NamedTuple):
+    """
+    Tells the flusher to continue the log in a new segment.
+    """
+
+    first_lsn: int
+
+class MutationLog:
+    """
+    An append-only log of the mutations of the time slots, with periodic snapshots.
+
+    Every mutation gets a log sequence number (LSN). `append` only buffers the mutation; a
+    background thread writes the buffered mutations and syncs them to disk with a single fsync,
+    then resolves the futures returned by `durable`. Mutations appended while a sync is in progress
+    go to the next one, so concurrent requests share the cost of the syncs (group commit). A
+    server replies to a request only when the mutations it has seen are durable.
+
+    The log is a series of segment files in `directory`, each named after the LSN of its first
+    mutation. A snapshot stores the time slots that are not available, and starts a new segment;
+    when the snapshot is on disk the older segments are deleted, so recovery reads the snapshot
+    and replays only the mutations after it.
+    """
+
+    def __init__(self, directory: str, sync: bool = True) -> None:
+        """
+        Args:
+            directory: The directory of the log, created if it does not exist.
+            sync: Whether to fsync the writes. Without it the log survives crashes of the
+                process but not of the machine.
+        """
+
+        self._directory = directory
+        self._sync = sync
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._buffer: List[Union[bytes, _NewSegment]] = []
+        self._last_lsn = 0
+        self._durable_lsn = 0
+        self._snapshot_lsn = 0
+        self._closed = False
+
+        # The error that failed a write or a sync, after which nothing more becomes durable.
+        self._error: Optional[Exception] = None
+
+        # (lsn, sequence number, future) heap of the futures waiting for durability.
+        self._waiters: List[Tuple[int, int, Future]] = []
+        self._waiter_counter = itertools.count()
+
+        # The number of fsyncs of the segments, for measuring group commit.
+        self.syncs = 0
+
+        self._file: Optional[BinaryIO] = None
+        self._flusher: Optional[threading.Thread] = None
+
+    def recover(self, server_state: ServerState) -> int:
+        """
+        Applies the snapshot and the mutations after it to `server_state` and opens the log for
+        appending. A torn mutation at the end of the last segment is cut off. Returns the number
+        of mutations replayed from the segments.
+        """
+
+        if self._flusher is not None:
+            raise RuntimeError("The log is already open.")
+        if server_state.mutation_log is not None:
+            raise ValueError("The state must not have a mutation log while it is recovered.")
+
+        # The replayed state is published once, at the end of the batch.
+        with server_state.batch():
+            snapshot = self._read_snapshot()
+            if snapshot is not None:
+                for mutation in snapshot.mutations:
+                    self._apply(server_state, mutation)
+                self._snapshot_lsn = self._last_lsn = snapshot.lsn
+
+            replayed = 0
+            segments = self._segments()
+            for i, (first_lsn, path) in enumerate(segments):
+                with open(path, "rb") as segment:
+                    data = segment.read()
+
+                end = 0
+                for mutation, end in decode_mutations(data):
+                    if mutation.lsn <= self._last_lsn:
+                        continue
+                    if mutation.lsn != self._last_lsn + 1:
+                        raise ValueError("Missing mutations before LSN {} in {}."
+                                         .format(mutation.lsn, path))
+                    self._apply(server_state, mutation)
+                    self._last_lsn = mutation.lsn
+                    replayed += 1
+
+                if end < len(data):
+                    if i != len(segments) - 1:
+                        raise ValueError("Corrupt log segment {}.".format(path))
+                    with open(path, "r+b") as segment:
+                        segment.truncate(end)
+
+        self._durable_lsn = self._last_lsn
+        self._file = self._open_segment(self._last_lsn + 1)
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+        return replayed
+
+    def last_lsn(self) -> int:
+        """
+        Returns the LSN of the last mutation appended.
+        """
+
+        with self._cond:
+            return self._last_lsn
+
+    def append(self, provider: ServiceProvider, time_slot: TimeSlot, state: TimeSlotState,
+               owner: int) -> int:
+        """
+        Appends a mutation to the log and returns its LSN. The mutation is durable when the future
+        returned by `durable` for the LSN is done. Raises like `check` if the mutation cannot be
+        appended, and then the log is left as it was.
+        """
+
+        with self._cond:
+            self._check_open()
+            MutationLog.check_time_slot(time_slot)
+
+            data = encode_mutation(Mutation(self._last_lsn + 1, provider, time_slot, state, owner))
+            self._last_lsn += 1
+            self._buffer.append(data)
+            self._cond.notify()
+
+            return self._last_lsn
+
+    def check(self, time_slot: TimeSlot) -> None:
+        """
+        Raises `RuntimeError` if the log is not open or has failed, or `ValueError` if the
+        mutations of the time slot cannot be logged, so callers can check every transition of a
+        batch before applying any of them.
+        """
+
+        with self._cond:
+            self._check_open()
+        MutationLog.check_time_slot(time_slot)
+
+    @staticmethod
+    def check_time_slot(time_slot: TimeSlot) -> None:
+        """
+        Raises `ValueError` if the time slot does not fit the format of the log.
+        """
+
+        if not 0 <= time_slot.year() < (1 << 16):
+            raise ValueError("Time slot out of the range of the log: {}.".format(time_slot))
+
+    def durable(self, lsn: int) -> Future:
+        """
+        Returns a future that is done when the mutations up to `lsn` are durable. If the log has
+        failed, the future fails with the error of the log.
+        """
+
+        future: Future = Future()
+        with self._cond:
+            error = self._error
+            if lsn > self._durable_lsn and error is None:
+                heapq.heappush(self._waiters, (lsn, next(self._waiter_counter), future))
+                return future
+
+        if lsn > self._durable_lsn and error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+        return future
+
+    def mutations_since_snapshot(self) -> int:
+        """
+        Returns the number of mutations appended since the last snapshot.
+        """
+
+        with self._cond:
+            return self._last_lsn - self._snapshot_lsn
+
+    def capture_snapshot(self, server_state: ServerState) -> Snapshot:
+        """
+        Captures the time slots that are not available and starts a new segment for the
+        mutations after them. No mutation may be applied while this runs, so servers call it
+        under the lock that serializes their requests. Its cost is proportional to the number of
+        slots that are not available.
+        """
+
+        mutations = []
+        with self._cond:
+            lsn = self._last_lsn
+            self._buffer.append(_NewSegment(lsn + 1))
+            self._cond.notify()
+
+        for state in (TimeSlotState.IN_BASKET, TimeSlotState.RESERVED):
+            for appointment in server_state.appointments_in_state(state):
+                provider = appointment.service_provider()
+                ts_info = server_state.find_time_slot_info(provider, appointment.time_slot())
+                assert ts_info is not None
+                mutations.append(Mutation(lsn, provider, ts_info.time_slot, ts_info.state,
+                                          ts_info.owner))
+
+        return Snapshot(lsn, mutations)
+
+    def write_snapshot(self, snapshot: Snapshot) -> None:
+        """
+        Writes a captured snapshot to disk and deletes the segments it makes unnecessary. It does
+        not need the lock of the server.
+        """
+
+        self.durable(snapshot.lsn).result()
+
+        data = bytearray(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, snapshot.lsn,
+                                               len(snapshot.mutations)))
+        for mutation in snapshot.mutations:
+            data += encode_mutation(mutation)
+        data += _CRC.pack(zlib.crc32(data))
+
+        path = os.path.join(self._directory, SNAPSHOT_FILENAME)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            if self._sync:
+                os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+        self._sync_directory()
+
+        with self._cond:
+            self._snapshot_lsn = max(self._snapshot_lsn, snapshot.lsn)
+
+        for first_lsn, segment_path in self._segments():
+            if first_lsn <= snapshot.lsn:
+                os.remove(segment_path)
+
+    def snapshot(self, server_state: ServerState) -> None:
+        """
+        Captures and writes a snapshot, see `capture_snapshot` and `write_snapshot`.
+        """
+
+        self.write_snapshot(self.capture_snapshot(server_state))
+
+    def close(self) -> None:
+        """
+        Makes the appended mutations durable and closes the log.
+        """
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer:
+                    break
+
+                items = self._buffer
+                self._buffer = []
+                lsn = self._last_lsn
+
+            try:
+                self._write(items)
+            except Exception as error:
+                self._fail_waiters(error)
+                return
+
+            with self._cond:
+                self._durable_lsn = lsn
+                done = []
+                while self._waiters and self._waiters[0][0] <= lsn:
+                    done.append(heapq.heappop(self._waiters)[2])
+
+            for future in done:
+                future.set_result(None)
+
+        assert self._file is not None
+        self._file.close()
+
+    def _write(self, items: List[Union[bytes, _NewSegment]]) -> None:
+        assert self._file is not None
+
+        data = []
+        for item in items:
+            if isinstance(item, _NewSegment):
+                self._file.write(b"".join(data))
+                data = []
+                self._sync_file()
+                self._file.close()
+                self._file = self._open_segment(item.first_lsn)
+            else:
+                data.append(item)
+
+        self._file.write(b"".join(data))
+        self._sync_file()
+
+    def _sync_file(self) -> None:
+        assert self._file is not None
+
+        self._file.flush()
+        if self._sync:
+            os.fsync(self._file.fileno())
+            self.syncs += 1
+
+    def _check_open(self) -> None:
+        # Must be called with the condition held.
+        if self._error is not None:
+            raise RuntimeError("The log has failed.") from self._error
+        if self._closed or self._flusher is None:
+            raise RuntimeError("The log is not open.")
+
+    def _fail_waiters(self, error: Exception) -> None:
+        with self._cond:
+            self._closed = True
+            self._error = error
+            waiters = self._waiters
+            self._waiters = []
+
+        for _, _, future in waiters:
+            future.set_exception(error)
+
+    def _open_segment(self, first_lsn: int) -> BinaryIO:
+        path = os.path.join(self._directory, "wal-{:020d}.log".format(first_lsn))
+        segment = open(path, "ab")
+        self._sync_directory()
+        return segment
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        result = []
+        for filename in os.listdir(self._directory):
+            if filename.startswith("wal-") and filename.endswith(".log"):
+                result.append((int(filename[4:-4]), os.path.join(self._directory, filename)))
+
+        return sorted(result)
+
+    def _read_snapshot(self) -> Optional[Snapshot]:
+        path = os.path.join(self._directory, SNAPSHOT_FILENAME)
+        try:
+            with open(path, "rb") as snapshot_file:
+                data = snapshot_file.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < _SNAPSHOT_HEADER.size + _CRC.size:
+            raise ValueError("Truncated snapshot {}.".format(path))
+
+        crc, = _CRC.unpack_from(data, len(data) - _CRC.size)
+        body = memoryview(data)[:len(data) - _CRC.size]
+        magic, lsn, count = _SNAPSHOT_HEADER.unpack_from(body)
+        if magic != _SNAPSHOT_MAGIC or zlib.crc32(body) != crc:
+            raise ValueError("Corrupt snapshot {}.".format(path))
+
+        mutations = [mutation for mutation, _ in decode_mutations(body[_SNAPSHOT_HEADER.size:])]
+        if len(mutations) != count:
+            raise ValueError("Corrupt snapshot {}.".format(path))
+
+        return Snapshot(lsn, mutations)
+
+    def _sync_directory(self) -> None:
+        if not self._sync:
+            return
+
+        fd = os.open(self._directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _apply(server_state: ServerState, mutation: Mutation) -> None:
+        ts_info = server_state.find_time_slot_info(mutation.provider, mutation.time_slot)
+        if ts_info is None:
+            raise ValueError("The log refers to an unknown time slot {} of {}."
+                             .format(mutation.time_slot, mutation.provider))
+
+        # Through the state, so recovered time slots in baskets are held again.
+        server_state.set_time_slot_state(mutation.provider, ts_info, mutation.state,
+                                         mutation.owner)
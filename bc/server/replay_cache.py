@@ -0,0 +1,96 @@
+"""
+This module contains a cache of the replies to recent requests, so that retried requests are not
+applied twice.
+"""
+
+import collections
+import time
+
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+# Seconds a reply is kept for the retries of its request.
+DEFAULT_REPLAY_TTL = 5 * 60.0
+
+DEFAULT_MAX_REPLAYS = 1 << 16
+
+T = TypeVar("T")
+
+class ReplayCache(Generic[T]):
+    """
+    The replies to recent requests, keyed by an id of the request, e.g. its session and request
+    id. A request whose reply is lost can be sent again with the same id, and gets the cached
+    reply instead of being applied again. A reply is only replayed to a request of the same
+    type, so a client reusing an id for another request does not get a wrong reply.
+
+    The replies are kept for `ttl` seconds, and at most `max_entries` of them; as they all have
+    the same time to live, they expire in the order they were added, so both bounds are kept in
+    O(1) time per reply. The cache is not thread-safe; it is used where the requests are
+    serialized.
+    """
+
+    def __init__(self,
+                 ttl: float = DEFAULT_REPLAY_TTL,
+                 max_entries: int = DEFAULT_MAX_REPLAYS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self._clock = clock
+
+        # The deadline, the request type and the reply of each request, in the order of their
+        # deadlines.
+        self._entries: "collections.OrderedDict[Hashable, Tuple[float, Hashable, T]]" = \
+            collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, request_type: Hashable) -> Optional[T]:
+        """
+        Returns the reply cached for the request `key` of the given type, or None if there is no
+        such reply.
+        """
+
+        self.expire()
+
+        entry = self._entries.get(key)
+        if entry is None or entry[1] != request_type:
+            return None
+
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key: Hashable, request_type: Hashable, reply: T) -> None:
+        """
+        Caches the reply to the request `key` of the given type, evicting the oldest replies if
+        the cache is full.
+        """
+
+        if self.max_entries <= 0:
+            return
+
+        self.expire()
+        self._entries.pop(key, None)
+        self._entries[key] = (self._clock() + self.ttl, request_type, reply)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        """
+        Drops the reply cached for the request `key`, if there is one.
+        """
+
+        self._entries.pop(key, None)
+
+    def expire(self) -> None:
+        """
+        Evicts the replies older than `ttl` seconds.
+        """
+
+        now = self._clock()
+        while self._entries:
+            deadline = next(iter(self._entries.values()))[0]
+            if deadline > now:
+                break
+            self._entries.popitem(last=False)
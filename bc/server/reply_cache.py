@@ -0,0 +1,79 @@
+"""
+This module contains a cache of encoded replies.
+"""
+
+import collections
+import threading
+
+from typing import Hashable, Optional
+
+from bc.common.comm_util import PreencodedMessage
+
+DEFAULT_MAX_ENTRIES = 1024
+
+# The total size of the encoded replies in the cache, in bytes.
+DEFAULT_MAX_BYTES = 64 << 20
+
+class ReplyCache:
+    """
+    A least recently used cache of `PreencodedMessage` replies, bounded by the number of the
+    replies and the total size of their encodings. Replies larger than a quarter of `max_bytes`
+    are not cached, so one of them cannot flush the cache.
+
+    The keys must identify the state the reply was made from, e.g. by a version of the state, as
+    entries are never invalidated; entries of old versions are evicted as they age. The cache is
+    thread-safe.
+    """
+
+    def __init__(self,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[Hashable, PreencodedMessage]" = \
+            collections.OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[PreencodedMessage]:
+        """
+        Returns the reply cached for `key` and marks it as used, or returns None if there is no
+        such reply.
+        """
+
+        with self._lock:
+            reply = self._entries.get(key)
+            if reply is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def put(self, key: Hashable, reply: PreencodedMessage) -> None:
+        """
+        Caches the reply for `key`, evicting the least recently used replies if the cache is full.
+        """
+
+        size = reply.encoded_size()
+        if self.max_entries <= 0 or size > self.max_bytes // 4:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.encoded_size()
+
+            self._entries[key] = reply
+            self._size += size
+
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.encoded_size()
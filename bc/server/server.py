@@ -2,207 +2,571 @@
 This module contains the server.
 """
 
+import contextlib
+import ipaddress
+import itertools
+import logging
+import os
+import socket
 import socketserver
-from typing import Any, Callable, Dict, List, Union
-
-from bc.common.comm_util import Appointment, Message, RequestType, Transceiver
-from bc.server.server_util import ServerState, ServiceProvider, TimeSlotInfo, TimeSlotState, User
-
-class RequestHandler(socketserver.BaseRequestHandler):
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from socket import MSG_PEEK, SHUT_RDWR
+import threading
+import time
+from typing import Any, Callable, ContextManager, Deque, Dict, Iterator, Optional, Tuple, Union
+
+from bc.common.comm_util import (Appointment, Codec, detect_codec, is_length_prefixed,
+                                 LengthPrefixedTransceiver, Message, PreencodedMessage, RequestType,
+                                 StreamMessage, Transceiver)
+from bc.common.entities import TimeSlot
+from bc.server.admission import PendingRequests, RateLimiter
+from bc.server.credentials import dummy_password_hash, verify_password
+from bc.server.metrics import Outcome, prometheus_metrics, RequestMetrics
+from bc.server.persistence import MutationLog
+from bc.server.replay_cache import ReplayCache
+from bc.server.reply_cache import ReplyCache
+from bc.server.server_util import (ServerState, ServiceProvider, SlotChanges, SlotKey,
+                                  TimeSlotInfo, TimeSlotState)
+from bc.server.subscriptions import MAX_SUBSCRIPTIONS, Subscriber, SubscriptionHub
+
+_LOGGER = logging.getLogger(__name__)
+
+# The largest request accepted by the servers, in bytes.
+MAX_REQUEST_SIZE = 1 << 20
+
+# The most appointments a batch request may carry.
+MAX_BATCH_SIZE = 1000
+
+# The requests whose handlers only read the published snapshots of the `ServerState`, so they are
+# handled without the lock of the server.
+SNAPSHOT_REQUESTS = frozenset((RequestType.LIST_BASKET,
+                               RequestType.LIST_BOOKED_APPOINTMENTS,
+                               RequestType.LIST_AVAILABLE_APPOINTMENTS))
+
+# The requests that change the state. Their replies are kept in `ServerBase.replays`, so that
+# retrying them is safe.
+REPLAYED_REQUESTS = frozenset((RequestType.ADD_APPOINTMENT_TO_BASKET,
+                               RequestType.REMOVE_APPOINTMENT_FROM_BASKET,
+                               RequestType.CONFIRM_BOOKING,
+                               RequestType.CANCEL_APPOINTMENT,
+                               RequestType.ADD_APPOINTMENTS_TO_BASKET,
+                               RequestType.REMOVE_APPOINTMENTS_FROM_BASKET,
+                               RequestType.CANCEL_APPOINTMENTS))
+
+# The event messages a subscriber may have waiting to be sent before it is dropped.
+MAX_PENDING_EVENTS = 1024
+
+# The directory of the mutation log of durable servers.
+DATA_DIR = "data"
+
+# The service provider database in the binary format, used instead of the text file if present.
+BINARY_PROVIDER_FILE = "service_providers.bin"
+
+class DeferredReply:
     """
-    Request handler class.
+    A reply that depends on work done off the request path, e.g. verifying a password on
+    `ServerBase.password_verifier`. When `future` is done, `RequestHandler.finish` makes the reply
+    from its result with `complete`.
     """
 
-    def __init__(self, *args, **kwargs) -> None:
-        socketserver.BaseRequestHandler.__init__(self, *args, **kwargs)
+    def __init__(self, future: Future, complete: Callable[[Any], Message]) -> None:
+        self.future = future
+        self.complete = complete
+        self.request_id: Optional[int] = None
 
-        if not isinstance(self.server, Server):
-            raise TypeError("Unsupported server type.")
+        # For the metrics of the request.
+        self.request_type: Optional[RequestType] = None
+        self.started = 0.0
+        self.ip_address = ""
 
-        self.server: Server = self.server
+class RequestHandler:
+    """
+    Request handler class. It processes requests against the state of a server and is independent
+    of the transport, so all server engines share it.
+    """
 
-    def handle(self) -> None:
-        print("Handling request from handler.")
+    def __init__(self, server: "ServerBase") -> None:
+        self.server = server
 
-        socket = self.request
-        transceiver = Transceiver(socket)
+    def handle(self, msg_bytes: bytes, ip_address: str, codec: Optional[Codec] = None) -> Message:
+        """
+        Handles a serialized request coming from `ip_address` and returns the reply. The request
+        is decoded with `codec`, or with the detected codec if it is None. It waits for the
+        deferred work of the request, if any; the server engines use `begin` and `finish`
+        instead, so they do not block other requests meanwhile.
+        """
+
+        reply = self.begin(msg_bytes, ip_address, codec)
+        if isinstance(reply, DeferredReply):
+            return self.finish(reply)
 
-        msg_bytes = transceiver.receive()
+        return reply
 
+    def begin(self,
+              msg_bytes: bytes,
+              ip_address: str,
+              codec: Optional[Codec] = None,
+              subscriber: Optional[Subscriber] = None) -> Union[Message, DeferredReply]:
+        """
+        Like `handle`, but returns a `DeferredReply` for requests that need deferred work. The
+        deferred work does not need the state of the server, so the engines wait for it without
+        serializing the requests, then call `finish`. Engines that can push messages on the
+        connection of the request pass its `subscriber`, which SUBSCRIBE requests subscribe.
+
+        The request is handled under the lock of the server, except for the `SNAPSHOT_REQUESTS`,
+        which only take it to check the session. If `ServerBase.pending` requests are being
+        handled already, or the client exceeds its `ServerBase.rate_limiter` limits, the request
+        is rejected at once with a "retry_after_ms" hint. STATS requests are exempt, so an
+        overloaded server can still be monitored.
+        """
+
+        started = time.perf_counter()
+        request_type = None
+        outcome: Optional[Outcome] = None
+        admitted = False
         try:
-            request = Message.from_bytes(msg_bytes)
+            request = Message.from_bytes(msg_bytes, codec)
             request_data = request.data()
-            print("Client address: {}.".format(socket.getpeername()))
-            print("Request data:\n{}.".format(request_data))
 
-            if request_data["type"] == RequestType.LOGIN:
-                reply = self.handle_login(request, socket.getpeername()[0])
+            request_type = request_data["type"]
+            exempt = request_type == RequestType.STATS
+            admitted = not exempt and self.server.pending.enter()
+
+            if not exempt and not admitted:
+                reply = self.get_rejection_message("Server busy.", self.server.pending.retry_after)
+                outcome = Outcome.REJECTED
+            elif request_type == RequestType.LOGIN:
+                reply = self.handle_login(request, ip_address)
             else:
-                if self.check_client_id(request, socket.getpeername()[0]):
-                    request_type = request_data["type"]
-                    reply = self.server.router[request_type](self, request)
-                else:
+                with self.server.lock:
+                    authorized = self.authorize(request, ip_address)
+                    rejection = (self.throttle(request_data["client_id"], request_type)
+                                 if authorized and not exempt else None)
+                    if authorized and rejection is None:
+                        if request_type == RequestType.SUBSCRIBE:
+                            reply = self.handle_subscribe(request, subscriber)
+                        elif request_type not in SNAPSHOT_REQUESTS:
+                            reply = self.handle_once(request)
+
+                if not authorized:
                     reply = self.__get_reply_message(False, "Access denied.")
+                    outcome = Outcome.DENIED
+                elif rejection is not None:
+                    reply = rejection
+                    outcome = Outcome.REJECTED
+                elif request_type in SNAPSHOT_REQUESTS:
+                    reply = self.server.router[request_type](self, request)
+
+            # Clients may have several requests in flight on a connection; the request id lets
+            # them match the replies to the requests.
+            if isinstance(reply, DeferredReply):
+                reply.request_id = request_data.get("request_id")
+                reply.request_type = request_type
+                reply.started = started
+                reply.ip_address = ip_address
+                if admitted:
+                    # The request is pending until its deferred work is done, even if the
+                    # connection is lost before `finish`.
+                    reply.future.add_done_callback(lambda _: self.server.pending.leave())
+                    admitted = False
+                return reply
+
+            reply.data()["request_id"] = request_data.get("request_id")
         except:
+            _LOGGER.debug("Invalid request from %s.", ip_address, exc_info=True)
             reply = self.__get_reply_message(False, "Invalid request.")
+            outcome = Outcome.INVALID
+        finally:
+            if admitted:
+                self.server.pending.leave()
 
-        transceiver.send(reply.to_bytes())
+        if outcome is None:
+            outcome = Outcome.OK if reply.data()["OK"] else Outcome.FAILED
+        self.record(request_type, outcome, started, ip_address)
 
-    def handle_login(self, request: Message, ip_address: str) -> Message:
+        return reply
+
+    def finish(self, deferred: DeferredReply) -> Message:
+        """
+        Returns the reply of a request that `begin` deferred, waiting for its future if needed.
+        The reply is made under the lock of the server.
+        """
+
+        try:
+            result = deferred.future.result()
+            with self.server.lock:
+                reply = deferred.complete(result)
+            outcome = Outcome.OK if reply.data()["OK"] else Outcome.FAILED
+        except:
+            _LOGGER.debug("Invalid request from %s.", deferred.ip_address, exc_info=True)
+            reply = self.__get_reply_message(False, "Invalid request.")
+            outcome = Outcome.INVALID
+
+        reply.data()["request_id"] = deferred.request_id
+        self.record(deferred.request_type, outcome, deferred.started, deferred.ip_address)
+        return reply
+
+    def record(self,
+               request_type: Optional[RequestType],
+               outcome: Outcome,
+               started: float,
+               ip_address: str) -> None:
+        """
+        Adds a request handled since `started`, a `time.perf_counter` value, to the metrics of the
+        server. Every `ServerBase.request_log_interval`th request is logged at the INFO level, the
+        others at the DEBUG level. The content of the requests is never logged, as it may hold
+        passwords.
+        """
+
+        latency_us = int((time.perf_counter() - started) * 1e6)
+        self.server.metrics.record(request_type, outcome, latency_us)
+
+        sampled = next(self.server.request_sequence) % self.server.request_log_interval == 0
+        if sampled or _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.log(logging.INFO if sampled else logging.DEBUG,
+                        "%s request from %s: %s in %d us.",
+                        request_type.name if isinstance(request_type, RequestType) else "Unknown",
+                        ip_address, outcome.value, latency_us)
+
+    def handle_login(self, request: Message, ip_address: str) -> DeferredReply:
         request_data = request.data()
         username = request_data["username"]
         password = request_data["password"]
+        if not isinstance(username, str) or not isinstance(password, str):
+            raise TypeError("Invalid username or password.")
 
-        user_list = list(filter(lambda user: user.username == username,
-                                self.server.server_state.users))
+        user = self.server.server_state.find_user(username)
+
+        # Unknown users are checked against a dummy hash, so that the time of the reply does not
+        # reveal whether the user exists.
+        password_hash = self.server.dummy_password_hash if user is None else user.password_hash
+        future = self.server.password_verifier.submit(verify_password, password, password_hash)
+
+        def complete(verified: bool) -> Message:
+            if user is None or not verified:
+                return self.__get_reply_message(False, "Invalid username or password.")
 
-        if user_list and user_list[0].password == password:
-            user = user_list[0]
-            self.server.server_state.connected_users[user.user_id] = ip_address
             reply = self.__get_reply_message(True, "Login successful.")
             reply.data()["client_id"] = user.user_id
-        else:
-            reply = self.__get_reply_message(False, "Invalid username or password.")
+            reply.data()["token"] = self.server.server_state.sessions.create(user.user_id)
+            return reply
 
-        return reply
+        return DeferredReply(future, complete)
 
-    def check_client_id(self, request: Message, ip_address: str) -> bool:
-        client_id = request.data()["client_id"]
-        stored_ip = self.server.server_state.connected_users.get(client_id)
+    def authorize(self, request: Message, ip_address: str) -> bool:
+        """
+        Returns whether the request may be served: STATS requests must come from the same host,
+        the others must carry the token of a live session of their client.
+        """
 
-        return stored_ip == ip_address
+        if request.data()["type"] == RequestType.STATS:
+            return _is_local_address(ip_address)
 
-    def handle_list_basket(self, request: Message) -> Message:
-        client_id = request.data()["client_id"]
+        return self.check_session(request)
 
-        provider_filter = lambda a: True
-        ts_filter = lambda slot_info: (slot_info.owner == client_id
-                and slot_info.state == TimeSlotState.IN_BASKET)
+    def handle_once(self, request: Message) -> Message:
+        """
+        Handles a request with the router of the server. A request in `REPLAYED_REQUESTS` that
+        was handled already, i.e. a retry with the same session and request id, gets the cached
+        reply instead of being applied again.
+        """
 
-        return self._filter_appointments(provider_filter, ts_filter)
+        request_type = request.data()["type"]
+        key = self.replay_key(request)
+        if key is None:
+            return self.server.router[request_type](self, request)
 
-    def handle_list_booked_appointments(self, request: Message) -> Message:
-        client_id = request.data()["client_id"]
+        reply = self.server.replays.get(key, request_type)
+        if reply is None:
+            reply = self.server.router[request_type](self, request)
+            self.server.replays.put(key, request_type, reply)
 
-        provider_filter = lambda a: True
-        ts_filter = lambda slot_info: (slot_info.owner == client_id
-                and slot_info.state == TimeSlotState.RESERVED)
+        return reply
 
-        return self._filter_appointments(provider_filter, ts_filter)
+    @staticmethod
+    def replay_key(request: Message) -> Optional[Tuple[Any, Any, int]]:
+        """
+        Returns the key of the reply to the request in `ServerBase.replays`: the client id, the
+        session token and the request id. The request ids restart at every login, so the token
+        tells the sessions of a client apart. Returns None if the reply is not to be cached.
+        """
 
-    def handle_list_available_appointments(self, request: Message):
-        provider = request.data()["service_provider"]
-        if provider:
-            provider_filter = lambda p: p.name() == provider
-        else:
-            provider_filter = lambda a: True
+        request_data = request.data()
+        request_id = request_data.get("request_id")
+        if request_data["type"] not in REPLAYED_REQUESTS or not isinstance(request_id, int):
+            return None
 
-        ts_filter = lambda slot_info: slot_info.state == TimeSlotState.AVAILABLE
+        return request_data["client_id"], request_data.get("token"), request_id
 
-        return self._filter_appointments(provider_filter, ts_filter)
+    def throttle(self, client_id: int, request_type: RequestType) -> Optional[Message]:
+        """
+        Returns the reply rejecting a request of the client if it exceeds its rate limits, or
+        None if the request is admitted.
+        """
+
+        retry_after = self.server.rate_limiter.check(client_id, request_type)
+        if retry_after == 0.0:
+            return None
+
+        return self.get_rejection_message("Too many requests.", retry_after)
+
+    def get_rejection_message(self, text: str, retry_after: float) -> Message:
+        """
+        Returns the reply rejecting a request, with a hint to retry it after `retry_after`
+        seconds in its "retry_after_ms".
+        """
+
+        reply = self.__get_reply_message(False, text)
+        reply.data()["retry_after_ms"] = max(1, int(retry_after * 1000 + 0.5))
+        return reply
+
+    def check_session(self, request: Message) -> bool:
+        """
+        Returns whether the request carries the token of a live session of its client.
+        """
 
-    def handle_add_appointment_to_basket(self, request: Message) -> Message:
         request_data = request.data()
-        client_id = request_data["client_id"]
+        token = request_data.get("token")
+        if not isinstance(token, str):
+            return False
 
-        appointment = request_data["appointment"]
+        client_id = self.server.server_state.sessions.lookup(token)
+        return client_id is not None and client_id == request_data["client_id"]
 
-        ts_info = self._find_ts_info_for_appointment(appointment)
+    def handle_stats(self, _request: Message) -> Message:
+        reply = self.__get_reply_message(True, self.server.prometheus_text())
+        reply.data()["stats"] = self.server.metrics.stats()
+        return reply
 
-        if isinstance(ts_info, Message):
-            return ts_info
+    def handle_subscribe(self, request: Message, subscriber: Optional[Subscriber]) -> Message:
+        if subscriber is None:
+            return self.__get_reply_message(False, "Subscriptions need a persistent connection.")
 
-        if ts_info.state == TimeSlotState.AVAILABLE:
-            ts_info.state = TimeSlotState.IN_BASKET
-            ts_info.owner = client_id
-            return self.__get_reply_message(True, "OK.")
+        names = request.data()["service_providers"]
+        if not isinstance(names, list) or len(names) > MAX_SUBSCRIPTIONS:
+            raise ValueError("Invalid service providers.")
+        if not all(isinstance(name, str) for name in names):
+            raise TypeError("Invalid service provider.")
 
-        return self.__get_reply_message(False, "Time slot not available.")
+        providers = [ServiceProvider(name) for name in names]
+        for provider in providers:
+            if self.server.server_state.provider_snapshot(provider) is None:
+                reply = self.__get_reply_message(False, "Unknown service provider.")
+                reply.data()["service_provider"] = provider
+                return reply
+
+        self.server.subscriptions.subscribe(subscriber, providers)
+        return self.__get_reply_message(True, "Subscribed.")
+
+    def handle_list_basket(self, request: Message) -> Message:
+        client_id = request.data()["client_id"]
+
+        appointments = self.server.server_state.owned_appointments(client_id,
+                                                                   TimeSlotState.IN_BASKET)
+        return self._list_appointments(request, iter(appointments))
+
+    def handle_list_booked_appointments(self, request: Message) -> Message:
+        client_id = request.data()["client_id"]
+
+        appointments = self.server.server_state.owned_appointments(client_id,
+                                                                   TimeSlotState.RESERVED)
+        return self._list_appointments(request, iter(appointments))
+
+    def handle_list_available_appointments(self, request: Message):
+        request_data = request.data()
+        provider = request_data["service_provider"]
+        provider_filter = ServiceProvider(provider) if provider else None
+
+        # Older clients do not send these fields.
+        time_from = request_data.get("time_from")
+        time_to = request_data.get("time_to")
+        limit = request_data.get("limit")
+        cursor = request_data.get("cursor")
+
+        if time_from is not None and not isinstance(time_from, TimeSlot):
+            raise TypeError("Invalid time_from.")
+        if time_to is not None and not isinstance(time_to, TimeSlot):
+            raise TypeError("Invalid time_to.")
+        if limit is not None and (not isinstance(limit, int) or limit <= 0):
+            raise ValueError("Invalid limit.")
+        if cursor is not None and not isinstance(cursor, Appointment):
+            raise TypeError("Invalid cursor.")
+
+        server_state = self.server.server_state
+        if request_data.get("stream"):
+            appointments = server_state.available_appointments(provider_filter, time_from,
+                                                               time_to, cursor, limit)
+            return self._list_appointments(request, appointments, limit)
+
+        # The version is taken before the listing, so a cached listing is never older than the
+        # version in its key.
+        version = server_state.available_version(provider_filter)
+        cursor_key = None if cursor is None else (cursor.service_provider(), cursor.time_slot())
+        key = (provider_filter, time_from, time_to, cursor_key, limit, version)
+
+        reply = self.server.listing_cache.get(key)
+        if reply is None:
+            appointments = server_state.available_appointments(provider_filter, time_from,
+                                                               time_to, cursor, limit)
+            listing = self._list_appointments(request, appointments, limit)
+            reply = PreencodedMessage(listing.data())
+            self.server.listing_cache.put(key, reply)
+
+        return reply.copy()
+
+    def handle_add_appointment_to_basket(self, request: Message) -> Message:
+        request_data = request.data()
+        return self._apply_all(request_data["client_id"], [request_data["appointment"]],
+                               TimeSlotState.AVAILABLE, TimeSlotState.IN_BASKET)
+
+    def handle_add_appointments_to_basket(self, request: Message) -> Message:
+        request_data = request.data()
+        return self._apply_all(request_data["client_id"], request_data["appointments"],
+                               TimeSlotState.AVAILABLE, TimeSlotState.IN_BASKET,
+                               dry_run=request_data.get("dry_run") is True)
 
     def handle_remove_appointment_from_basket(self, request: Message) -> Message:
-        return self._handle_remove_or_cancel_appointment(request, TimeSlotState.IN_BASKET)
+        request_data = request.data()
+        return self._apply_all(request_data["client_id"], [request_data["appointment"]],
+                               TimeSlotState.IN_BASKET, TimeSlotState.AVAILABLE)
 
-    def handle_confirm_booking(self, request: Message):
+    def handle_remove_appointments_from_basket(self, request: Message) -> Message:
         request_data = request.data()
-        client_id = request_data["client_id"]
+        return self._apply_all(request_data["client_id"], request_data["appointments"],
+                               TimeSlotState.IN_BASKET, TimeSlotState.AVAILABLE,
+                               dry_run=request_data.get("dry_run") is True)
 
-        provider_predicate = lambda a: True
-        ts_predicate = lambda ts_info: ts_info.owner == client_id and ts_info.state == TimeSlotState.IN_BASKET
-        appointments = self._filter_appointments_list(provider_predicate, ts_predicate)
+    def handle_confirm_booking(self, request: Message):
+        client_id = request.data()["client_id"]
 
+        appointments = self.server.server_state.appointments_of_owner(client_id,
+                                                                      TimeSlotState.IN_BASKET)
         if not appointments:
             return self.__get_reply_message(False, "No appointments in basket.")
 
-        for appointment in appointments:
-            ts_info = self._find_ts_info_for_appointment(appointment)
-            if isinstance(ts_info, Message):
-                return ts_info
-
-            ts_info.state = TimeSlotState.RESERVED
-
-        return self.__get_reply_message(True, "OK.")
+        # The basket may hold more appointments than a batch request.
+        return self._apply_all(client_id, appointments, TimeSlotState.IN_BASKET,
+                               TimeSlotState.RESERVED, max_size=None)
 
     def handle_cancel_appointment(self, request: Message):
-        return self._handle_remove_or_cancel_appointment(request, TimeSlotState.RESERVED)
+        request_data = request.data()
+        return self._apply_all(request_data["client_id"], [request_data["appointment"]],
+                               TimeSlotState.RESERVED, TimeSlotState.AVAILABLE)
 
-    def _handle_remove_or_cancel_appointment(self, request: Message, expected_state: TimeSlotState) -> Message:
+    def handle_cancel_appointments(self, request: Message) -> Message:
         request_data = request.data()
-        client_id = request_data["client_id"]
+        return self._apply_all(request_data["client_id"], request_data["appointments"],
+                               TimeSlotState.RESERVED, TimeSlotState.AVAILABLE,
+                               dry_run=request_data.get("dry_run") is True)
+
+    def _apply_all(self,
+                   client_id: int,
+                   appointments: Any,
+                   expected_state: TimeSlotState,
+                   new_state: TimeSlotState,
+                   max_size: Optional[int] = MAX_BATCH_SIZE,
+                   dry_run: bool = False) -> Message:
+        """
+        Moves the time slots of the appointments from `expected_state` to `new_state`, all of
+        them or, if any of them is not in `expected_state` (held by the client, unless the state
+        is AVAILABLE), none of them. The first pass only looks the slots up and checks them, also
+        against the mutation log, so the state is not changed if it fails. If it fails, the reply
+        contains the offending "appointment". If `dry_run` is True, only the first pass is done;
+        the sharded router uses it to check a batch on every shard before applying it (see
+        `bc.server.sharded`).
+        """
+
+        if not isinstance(appointments, list) or not appointments:
+            raise ValueError("Invalid appointments.")
+        if max_size is not None and len(appointments) > max_size:
+            return self.__get_reply_message(
+                False, "At most {} appointments are allowed at once.".format(max_size))
+
+        held = expected_state != TimeSlotState.AVAILABLE
+        slots: Dict[SlotKey, TimeSlotInfo] = dict()
+        for appointment in appointments:
+            if not isinstance(appointment, Appointment):
+                raise TypeError("Invalid appointment.")
 
-        appointment = request_data["appointment"]
+            ts_info = self._find_ts_info_for_appointment(appointment)
+            if not isinstance(ts_info, Message):
+                key = (appointment.service_provider(), ts_info.time_slot)
+                if key in slots:
+                    ts_info = self.__get_reply_message(False, "Duplicate appointment.")
+                elif ts_info.state != expected_state or (held and ts_info.owner != client_id):
+                    ts_info = self.__get_reply_message(False, self.__state_error(expected_state))
 
-        ts_info = self._find_ts_info_for_appointment(appointment)
+            if isinstance(ts_info, Message):
+                ts_info.data()["appointment"] = appointment
+                return ts_info
 
-        if isinstance(ts_info, Message):
-            return ts_info
+            # Raises if the transition could not be logged, before any slot is changed.
+            self.server.server_state.check_transition(ts_info.time_slot)
+            slots[key] = ts_info
 
-        if ts_info.state != expected_state or ts_info.owner != client_id:
-            error_msg = ("Appointment not reserved by you"
-                         if expected_state == TimeSlotState.RESERVED
-                         else "Appointment not in your basket.")
-            return self.__get_reply_message(False, error_msg)
+        if dry_run:
+            return self.__get_reply_message(True, "OK.")
 
-        ts_info.state = TimeSlotState.AVAILABLE
+        new_owner = client_id if new_state != TimeSlotState.AVAILABLE else 0
+        server_state = self.server.server_state
+        with server_state.batch():
+            for (provider, _), ts_info in slots.items():
+                server_state.set_time_slot_state(provider, ts_info, new_state, new_owner)
 
         return self.__get_reply_message(True, "OK.")
 
+    @staticmethod
+    def __state_error(expected_state: TimeSlotState) -> str:
+        if expected_state == TimeSlotState.AVAILABLE:
+            return "Time slot not available."
+        if expected_state == TimeSlotState.RESERVED:
+            return "Appointment not reserved by you"
+
+        return "Appointment not in your basket."
 
     def _find_ts_info_for_appointment(self, appointment: Appointment) -> Union[Message, TimeSlotInfo]:
-        if appointment.service_provider() not in self.server.server_state.service_provider_db:
+        server_state = self.server.server_state
+        if not server_state.has_service_provider(appointment.service_provider()):
             return self.__get_reply_message(False, "No such provider")
 
-        ts_infos = self.server.server_state.service_provider_db[appointment.service_provider()]
-
-        ts_info_filtered = list(filter(lambda ts_info: ts_info.time_slot == appointment.time_slot(), ts_infos))
+        ts_info = server_state.find_time_slot_info(appointment.service_provider(),
+                                                   appointment.time_slot())
 
-        if not ts_info_filtered:
+        if ts_info is None:
             return self.__get_reply_message(False, "No such time slot for the provider")
 
-        ts_info = ts_info_filtered[0]
-
         return ts_info
 
-    def _filter_appointments_list(self,
-                             provider_predicate: Callable[[ServiceProvider], bool],
-                             ts_predicate: Callable[[TimeSlotInfo], bool]) -> List[Appointment]:
-        appointments: List[Appointment] = []
-
-        providers = filter(provider_predicate, self.server.server_state.service_provider_db.keys())
-
-        for provider in providers:
-            info = self.server.server_state.service_provider_db[provider]
-            ts_infos = filter(ts_predicate, info)
-            aps = map(lambda ts_info: Appointment(provider, ts_info.time_slot), ts_infos)
-            appointments.extend(aps)
-
-        return appointments
-
-    def _filter_appointments(self,
-                             provider_predicate: Callable[[ServiceProvider], bool],
-                             ts_predicate: Callable[[TimeSlotInfo], bool]) -> Message:
-        appointments: List[Appointment] = self._filter_appointments_list(provider_predicate, ts_predicate)
-        text = "\n".join(map(str, appointments))
-        return self.__get_reply_message(True, text)
+    def _list_appointments(self,
+                           request: Message,
+                           appointments: Iterator[Appointment],
+                           limit: Optional[int] = None) -> Message:
+        """
+        Returns the reply listing the appointments: a `StreamMessage` of them if the request asks
+        for streaming, otherwise a message with them joined into the text. If the listing is
+        limited and reaches the limit, the reply gets the last appointment as the "cursor" of the
+        next page.
+        """
+
+        reply = self.__get_reply_message(True, "")
+
+        def records() -> Iterator[Appointment]:
+            count = 0
+            last = None
+            for appointment in appointments:
+                count += 1
+                last = appointment
+                yield appointment
+
+            if limit is not None and count == limit:
+                reply.data()["cursor"] = last
+
+        if request.data().get("stream"):
+            return StreamMessage(reply.data(), records())
+
+        reply.data()["text"] = "\n".join(map(str, records()))
+        return reply
 
     @staticmethod
     def __get_reply_message(ok: bool, text: str) -> Message:
@@ -212,12 +576,102 @@ class RequestHandler(socketserver.BaseRequestHandler):
             }
         return Message(msg_dict)
 
-class Server(socketserver.TCPServer):
-    def __init__(self, *args, **kwargs):
-        socketserver.TCPServer.__init__(self, *args, **kwargs)
-        self.server_state = ServerState()
-        self.server_state.load_service_providers("service_providers.txt")
-        self.server_state.load_users("users.txt")
+def _is_local_address(ip_address: str) -> bool:
+    try:
+        return ipaddress.ip_address(ip_address).is_loopback
+    except ValueError:
+        return False
+
+def load_server_state(columnar: bool = False, data_dir: Optional[str] = None) -> ServerState:
+    """
+    Loads the server state from the files in the working directory. The service providers are
+    loaded from the binary `BINARY_PROVIDER_FILE` if it exists (see `bc.server.bulk_load`), which
+    requires NumPy. If `columnar` is True, the time slots are kept in a `ColumnarSlotStore`, which
+    requires NumPy too. If `data_dir` is given, the state is recovered from the mutation log in
+    it, and the log records the new mutations.
+    """
+
+    if columnar:
+        # Imported here because NumPy is optional.
+        from bc.server.columnar import ColumnarSlotStore
+        server_state = ServerState(ColumnarSlotStore)
+    else:
+        server_state = ServerState()
+
+    if os.path.exists(BINARY_PROVIDER_FILE):
+        # Imported here because NumPy is optional.
+        from bc.server.bulk_load import load_slot_store
+        server_state.slot_store = load_slot_store(BINARY_PROVIDER_FILE,
+                                                  type(server_state.slot_store))
+    else:
+        server_state.load_service_providers("service_providers.txt")
+    server_state.load_users("users.txt")
+
+    if data_dir is not None:
+        mutation_log = MutationLog(data_dir)
+        mutation_log.recover(server_state)
+        server_state.mutation_log = mutation_log
+
+    return server_state
+
+class ServerBase:
+    """
+    The state and the routing table shared by the server engines.
+    """
+
+    # Seconds between the snapshots of the mutation log, if the state has one.
+    snapshot_interval = 60.0
+
+    # Seconds between releasing the expired basket holds, and the number of holds released at
+    # once, so requests are served in between.
+    hold_release_interval = 1.0
+    hold_release_batch = 1000
+
+    # Every this many requests, one is logged at the INFO level.
+    request_log_interval = 1000
+
+    def __init__(self,
+                 server_state: Optional[ServerState] = None,
+                 password_workers: Optional[int] = None) -> None:
+        """
+        Args:
+            server_state: The state, loaded from the working directory if None.
+            password_workers: The number of threads verifying passwords, by default one per
+                CPU.
+        """
+
+        if server_state is None:
+            server_state = load_server_state()
+
+        self.server_state = server_state
+
+        # Serializes the requests that change the state. Engines that handle requests on several
+        # threads replace it with a lock.
+        self.lock: ContextManager[Any] = contextlib.nullcontext()
+
+        # The encoded replies of the listings of available appointments, keyed by the query and
+        # the version of the listed time slots.
+        self.listing_cache = ReplyCache()
+
+        self.metrics = RequestMetrics()
+        self.request_sequence = itertools.count(1)
+
+        self.subscriptions = SubscriptionHub()
+        server_state.listeners.append(self._publish_changes)
+
+        # The admission control of the requests, see `RequestHandler.begin`.
+        self.rate_limiter = RateLimiter()
+        self.pending = PendingRequests()
+
+        # The replies to the recent `REPLAYED_REQUESTS`, see `RequestHandler.handle_once`.
+        self.replays: ReplayCache[Any] = ReplayCache()
+
+        self.password_verifier = ThreadPoolExecutor(max_workers=password_workers or os.cpu_count(),
+                                                    thread_name_prefix="password-verifier")
+
+        # Hashed at start-up, so the hashing does not stall the first login of an unknown user
+        # (on the event loop of the asyncio engine).
+        self.dummy_password_hash = dummy_password_hash()
         self.router: Dict[RequestType, Callable[[RequestHandler, Message], Message]] = {
             RequestType.LIST_BASKET: RequestHandler.handle_list_basket,
             RequestType.LIST_BOOKED_APPOINTMENTS: RequestHandler.handle_list_booked_appointments,
@@ -226,10 +680,264 @@ class Server(socketserver.TCPServer):
             RequestType.REMOVE_APPOINTMENT_FROM_BASKET: RequestHandler.handle_remove_appointment_from_basket,
             RequestType.CONFIRM_BOOKING: RequestHandler.handle_confirm_booking,
             RequestType.CANCEL_APPOINTMENT: RequestHandler.handle_cancel_appointment,
+            RequestType.ADD_APPOINTMENTS_TO_BASKET:
+                RequestHandler.handle_add_appointments_to_basket,
+            RequestType.REMOVE_APPOINTMENTS_FROM_BASKET:
+                RequestHandler.handle_remove_appointments_from_basket,
+            RequestType.CANCEL_APPOINTMENTS: RequestHandler.handle_cancel_appointments,
+            RequestType.STATS: RequestHandler.handle_stats,
             }
 
+    def prometheus_text(self) -> str:
+        """
+        Returns the metrics of the server in the Prometheus text exposition format. It must be
+        called where requests are serialized.
+        """
+
+        return self.metrics.prometheus_text() + prometheus_metrics([
+            ("bc_sessions", "gauge", "The live sessions.", len(self.server_state.sessions)),
+            ("bc_pending_requests", "gauge", "The requests being handled.", len(self.pending)),
+            ("bc_listing_cache_hits_total", "counter", "The listings served from the cache.",
+             self.listing_cache.hits),
+            ("bc_listing_cache_misses_total", "counter", "The listings missing from the cache.",
+             self.listing_cache.misses),
+            ("bc_replayed_requests_total", "counter",
+             "The retried requests answered with the cached reply.", self.replays.hits),
+            ])
+
+    def deliver_changes(self, changes: SlotChanges) -> None:
+        """
+        Pushes published changes to the subscribers. Engines whose subscribers may only be used
+        from a certain thread override it.
+        """
+
+        self.subscriptions.publish(changes)
+
+    def _publish_changes(self, changes: SlotChanges) -> None:
+        if not self.subscriptions:
+            return
+
+        # Like the replies, the events never reflect a mutation that a crash could lose.
+        durable = self.durable_future()
+        if durable is None:
+            self.deliver_changes(changes)
+        else:
+            durable.add_done_callback(lambda _: self.deliver_changes(changes))
+
+    def durable_future(self) -> Optional[Future]:
+        """
+        Returns a future that is done when the mutations applied so far are durable, or None if
+        the state has no mutation log. The engines call it after handling a request, and reply
+        when the future is done, so a reply never reflects a mutation that a crash could lose.
+        """
+
+        mutation_log = self.server_state.mutation_log
+        if mutation_log is None:
+            return None
+
+        return mutation_log.durable(mutation_log.last_lsn())
+
+class ConnectionHandler(socketserver.BaseRequestHandler):
+    """
+    Serves a single connection of a `Server`. The connection is persistent: requests are served
+    in order until the client closes it. The framing of the connection, delimited or length
+    prefixed, is detected from its first byte.
+    """
+
+    def setup(self) -> None:
+        if not isinstance(self.server, Server):
+            raise TypeError("Unsupported server type.")
+
+    def handle(self) -> None:
+        _LOGGER.debug("Connection from %s.", self.client_address[0])
 
-def server_main():
+        socket = self.request
+        first_byte = socket.recv(1, MSG_PEEK)
+        if not first_byte:
+            return
+
+        transceiver: Union[Transceiver, LengthPrefixedTransceiver]
+        if is_length_prefixed(first_byte):
+            transceiver = LengthPrefixedTransceiver(socket, MAX_REQUEST_SIZE)
+        else:
+            transceiver = Transceiver(socket)
+
+        request_handler = RequestHandler(self.server)
+        ip_address = socket.getpeername()[0]
+        codec: Optional[Codec] = None
+
+        # The events pushed to the connection are sent by another thread.
+        send_lock = threading.Lock()
+        subscriber: Optional[_ThreadedSubscriber] = None
+
+        try:
+            while True:
+                try:
+                    msg_bytes = transceiver.receive()
+                except (EOFError, ConnectionError, ValueError):
+                    return
+
+                if codec is None:
+                    # The first request selects the codec of the connection.
+                    codec = detect_codec(msg_bytes)
+                    subscriber = _ThreadedSubscriber(codec, transceiver, send_lock, socket,
+                                                     self.server.subscriptions)
+
+                reply = request_handler.begin(msg_bytes, ip_address, codec, subscriber)
+                if isinstance(reply, DeferredReply):
+                    # Other requests are served while the deferred work runs.
+                    wait([reply.future])
+                    reply = request_handler.finish(reply)
+
+                # Other requests join the same group commit while this one waits.
+                durable = self.server.durable_future()
+                if durable is not None:
+                    durable.result()
+
+                if not isinstance(reply, StreamMessage):
+                    with send_lock:
+                        transceiver.send(reply.to_bytes(codec))
+                    continue
+
+                # The records come from the published snapshots, so they are produced without
+                # the lock.
+                for chunk in reply.chunks():
+                    with send_lock:
+                        transceiver.send(chunk.to_bytes(codec))
+        finally:
+            if subscriber is not None:
+                subscriber.close()
+
+class _ThreadedSubscriber(Subscriber):
+    """
+    The subscriber of a connection of a `Server`. The pushed messages are queued and sent by a
+    thread of their own, started by the first push, so a slow client does not hold up the
+    transitions. If more than `MAX_PENDING_EVENTS` messages are waiting, the subscriber is dropped
+    and its connection shut down; the client has to reconnect and list the time slots again.
+    """
+
+    def __init__(self,
+                 codec: Codec,
+                 transceiver: Union[Transceiver, LengthPrefixedTransceiver],
+                 send_lock: threading.Lock,
+                 sock: socket.socket,
+                 hub: SubscriptionHub) -> None:
+        Subscriber.__init__(self, codec)
+        self._transceiver = transceiver
+        self._send_lock = send_lock
+        self._socket = sock
+        self._hub = hub
+
+        self._cond = threading.Condition()
+        self._queue: Deque[bytes] = deque()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def push(self, message: bytes) -> None:
+        with self._cond:
+            if self._closed:
+                return
+
+            if len(self._queue) >= MAX_PENDING_EVENTS:
+                _LOGGER.info("Dropping a subscriber that does not keep up.")
+                self._closed = True
+                self._cond.notify()
+                self._hub.unsubscribe(self)
+                try:
+                    self._socket.shutdown(SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+
+            self._queue.append(message)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._send_loop, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def close(self) -> None:
+        """
+        Ends the subscriptions and stops the sending thread.
+        """
+
+        self._hub.unsubscribe(self)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
+
+    def _send_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                message = self._queue.popleft()
+
+            try:
+                with self._send_lock:
+                    self._transceiver.send(message)
+            except OSError:
+                return
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer, ServerBase):
+    """
+    A server that serves every connection on its own thread. The requests that change the state
+    are serialized by a lock, so each of them is applied to the `ServerState` atomically; the
+    listings read the published snapshots of the state without it. Background threads release
+    the expired basket holds every `hold_release_interval` seconds and, if the state has a
+    mutation log, snapshot it every `snapshot_interval` seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, *args, server_state: Optional[ServerState] = None, **kwargs):
+        socketserver.TCPServer.__init__(self, *args, **kwargs)
+        ServerBase.__init__(self, server_state)
+        self.lock = threading.Lock()
+
+        self._stopped = threading.Event()
+        self._background_threads = [threading.Thread(target=self._hold_release_loop, daemon=True)]
+        if self.server_state.mutation_log is not None:
+            self._background_threads.append(threading.Thread(target=self._snapshot_loop,
+                                                             daemon=True))
+        for thread in self._background_threads:
+            thread.start()
+
+    def server_close(self) -> None:
+        socketserver.TCPServer.server_close(self)
+        self.password_verifier.shutdown(wait=False)
+
+        self._stopped.set()
+        for thread in self._background_threads:
+            thread.join()
+
+    def _hold_release_loop(self) -> None:
+        while not self._stopped.wait(self.hold_release_interval):
+            released = self.hold_release_batch
+            while released == self.hold_release_batch:
+                with self.lock:
+                    released = self.server_state.release_expired_holds(self.hold_release_batch)
+
+    def _snapshot_loop(self) -> None:
+        mutation_log = self.server_state.mutation_log
+        assert mutation_log is not None
+
+        while not self._stopped.wait(self.snapshot_interval):
+            if not mutation_log.mutations_since_snapshot():
+                continue
+
+            # Only capturing the snapshot blocks the requests, writing it does not.
+            with self.lock:
+                snapshot = mutation_log.capture_snapshot(self.server_state)
+            mutation_log.write_snapshot(snapshot)
+
+
+def server_main(columnar: bool = False, durable: bool = False):
     """
     Server main loop.
     """
@@ -238,7 +946,12 @@ def server_main():
     HOST = "0.0.0.0"
     PORT = 9998
 
-    with Server((HOST, PORT), RequestHandler) as server:
-            # Activate the server; this will keep running until you
-            # interrupt the program with Ctrl-C
-            server.serve_forever()
+    server_state = load_server_state(columnar, DATA_DIR if durable else None)
+    try:
+        with Server((HOST, PORT), ConnectionHandler, server_state=server_state) as server:
+                # Activate the server; this will keep running until you
+                # interrupt the program with Ctrl-C
+                server.serve_forever()
+    finally:
+        if server_state.mutation_log is not None:
+            server_state.mutation_log.close()
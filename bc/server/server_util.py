@@ -2,10 +2,23 @@
 This module contains utilities for the server.
 """
 
+import bisect
+import contextlib
+import itertools
+import threading
+import time
+
 from enum import auto, Enum, unique
-from typing import Any, Dict, List
+from typing import (Any, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple,
+                    Type, TYPE_CHECKING)
+
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.credentials import hash_passwords, is_password_hash
+from bc.server.expiry import ExpiryQueue
+from bc.server.sessions import SessionTable
 
-from bc.common.entities import ServiceProvider, TimeSlot
+if TYPE_CHECKING:
+    from bc.server.persistence import MutationLog
 
 @unique
 class TimeSlotState(Enum):
@@ -16,6 +29,16 @@ class TimeSlotState(Enum):
     IN_BASKET = auto()
     RESERVED = auto()
 
+# Identifies a time slot of a service provider.
+SlotKey = Tuple[ServiceProvider, TimeSlot]
+
+# The new states of the time slots changed by a publication of a `ServerState`, per provider.
+SlotChanges = Dict[ServiceProvider, Dict[TimeSlot, "TimeSlotState"]]
+
+# The greatest user id. The owners of the time slots are 64-bit in the mutation log and in the
+# columnar slot store; 0 means no owner.
+MAX_USER_ID = (1 << 63) - 1
+
 class TimeSlotInfo:
     """
     A class that stores information about the availability of a TimeSlot.
@@ -43,37 +66,899 @@ class User:
     """
     A struct representing user information.
     """
-    def __init__(self, user_id: int, username: str, password: str) -> None:
+    def __init__(self, user_id: int, username: str, password_hash: str) -> None:
         """
-        Do not use plain test passwords in real programs.
+        The password is stored as a salted hash, see `bc.server.credentials`.
         """
         self.user_id = user_id
         self.username = username
-        self.password = password
+        self.password_hash = password_hash
 
     def __eq__(self, other: Any) -> bool:
         return (self.user_id == other.user_id
                 and self.username == other.username
-                and self.password == other.password)
+                and self.password_hash == other.password_hash)
 
     def __repr__(self) -> str:
-        return "User({}, {}, {})".format(self.user_id, self.username, self.password)
+        return "User({}, {})".format(self.user_id, self.username)
+
+class SlotSnapshot:
+    """
+    An immutable, versioned list of time slots of a service provider in a state, in chronological
+    order. It is never modified: changes make a new version with `updated`, so readers may iterate
+    a snapshot while the state changes, without locking.
+    """
+
+    def __init__(self, version: int) -> None:
+        """
+        Args:
+            version: Identifies the snapshot; a new version gets a greater number.
+        """
+
+        self.version = version
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def time_slots(self,
+                   time_from: Optional[TimeSlot] = None,
+                   time_to: Optional[TimeSlot] = None,
+                   after: Optional[TimeSlot] = None) -> Iterator[TimeSlot]:
+        """
+        Returns an iterator over the time slots from `time_from` (inclusive) to `time_to`
+        (exclusive) that are later than `after`, where None means no bound.
+        """
+
+        raise NotImplementedError()
+
+    def updated(self,
+                added: Collection[TimeSlot],
+                removed: Collection[TimeSlot],
+                version: int) -> "SlotSnapshot":
+        """
+        Returns a new version with the `added` time slots that are not in this one and without the
+        `removed` ones that are. It is called on every transition, under the lock of the server,
+        so it should not take time proportional to the size of the snapshot.
+        """
+
+        raise NotImplementedError()
+
+class ChunkedSlotSnapshot(SlotSnapshot):
+    """
+    A `SlotSnapshot` that keeps the time slots in sorted chunks of at most `chunk_size` slots,
+    tuples by default. A new version only copies the chunks it changes and the list of the
+    chunks, and shares the other chunks with this one, so `updated` takes time independent of
+    the size of the snapshot, up to the list of the chunks, which is `chunk_size` times shorter.
+
+    Subclasses may keep the chunks in another form by overriding the chunk methods.
+    """
+
+    chunk_size = 512
+
+    def __init__(self, version: int, time_slots: Sequence[Any]) -> None:
+        """
+        Args:
+            time_slots: The sorted time slots, in the form of a chunk.
+        """
+
+        SlotSnapshot.__init__(self, version)
+
+        size = self.chunk_size
+        self._chunks = tuple(time_slots[i:i + size] for i in range(0, len(time_slots), size))
+        # The last time slot of every chunk.
+        self._maxes = [self._last(chunk) for chunk in self._chunks]
+        self._size = len(time_slots)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def time_slots(self,
+                   time_from: Optional[TimeSlot] = None,
+                   time_to: Optional[TimeSlot] = None,
+                   after: Optional[TimeSlot] = None) -> Iterator[TimeSlot]:
+        start = (0, 0)
+        end = (len(self._chunks), 0)
+        if time_from is not None:
+            start = self._position(self._pack_bound(time_from))
+        if time_to is not None:
+            end = self._position(self._pack_bound(time_to))
+        if after is not None:
+            start = max(start, self._position(self._pack_bound(after), right=True))
+
+        return self._iterate(start, end)
+
+    def updated(self,
+                added: Collection[TimeSlot],
+                removed: Collection[TimeSlot],
+                version: int) -> "ChunkedSlotSnapshot":
+        chunks = list(self._chunks)
+        maxes = list(self._maxes)
+        size = self._size
+
+        for time_slot in removed:
+            key = self._pack(time_slot)
+            i = bisect.bisect_left(maxes, key)
+            if i == len(chunks):
+                continue
+            chunk = chunks[i]
+            j = self._find(chunk, key)
+            if chunk[j] != key:
+                continue
+
+            size -= 1
+            if len(chunk) == 1:
+                del chunks[i]
+                del maxes[i]
+            else:
+                chunks[i] = self._delete(chunk, j)
+                maxes[i] = self._last(chunks[i])
+
+        for time_slot in added:
+            key = self._pack(time_slot)
+            if not chunks:
+                chunks.append(self._make_chunk([key]))
+                maxes.append(key)
+                size += 1
+                continue
+
+            # A time slot after every chunk goes to the last one.
+            i = min(bisect.bisect_left(maxes, key), len(chunks) - 1)
+            chunk = chunks[i]
+            j = self._find(chunk, key)
+            if j < len(chunk) and chunk[j] == key:
+                continue
+
+            size += 1
+            chunk = self._insert(chunk, j, key)
+            if len(chunk) > self.chunk_size:
+                half = len(chunk) // 2
+                chunks[i:i + 1] = [chunk[:half], chunk[half:]]
+                maxes[i:i + 1] = [self._last(chunks[i]), self._last(chunks[i + 1])]
+            else:
+                chunks[i] = chunk
+                maxes[i] = self._last(chunk)
+
+        # The chunks are already made, so the constructor is skipped.
+        snapshot = object.__new__(type(self))
+        SlotSnapshot.__init__(snapshot, version)
+        snapshot._chunks = tuple(chunks)
+        snapshot._maxes = maxes
+        snapshot._size = size
+        return snapshot
+
+    def chunks(self) -> Tuple[Sequence[Any], ...]:
+        """
+        Returns the chunks of the time slots. The chunks a change does not touch are shared
+        between the versions.
+        """
+
+        return self._chunks
+
+    def _position(self, key: Any, right: bool = False) -> Tuple[int, int]:
+        # The chunk and the index in it of the first time slot not before the key, or after it
+        # if `right` is True.
+        i = (bisect.bisect_right if right else bisect.bisect_left)(self._maxes, key)
+        if i == len(self._chunks):
+            return (i, 0)
+
+        return (i, self._find(self._chunks[i], key, right))
+
+    def _iterate(self, start: Tuple[int, int], end: Tuple[int, int]) -> Iterator[TimeSlot]:
+        chunks = self._chunks
+        for i in range(start[0], min(end[0] + 1, len(chunks))):
+            chunk = chunks[i]
+            yield from self._unpack(chunk,
+                                    start[1] if i == start[0] else 0,
+                                    end[1] if i == end[0] else len(chunk))
+
+    # The chunk methods. The chunks hold the time slots packed with `_pack`.
+
+    @staticmethod
+    def _pack(time_slot: TimeSlot) -> Any:
+        return time_slot
+
+    @staticmethod
+    def _pack_bound(time_slot: TimeSlot) -> Any:
+        # Packs a bound of a query, which need not be a valid time slot of the snapshot.
+        return time_slot
+
+    @staticmethod
+    def _make_chunk(keys: List[Any]) -> Sequence[Any]:
+        return tuple(keys)
+
+    @staticmethod
+    def _last(chunk: Sequence[Any]) -> Any:
+        return chunk[-1]
+
+    @staticmethod
+    def _find(chunk: Sequence[Any], key: Any, right: bool = False) -> int:
+        return (bisect.bisect_right if right else bisect.bisect_left)(chunk, key)
+
+    @staticmethod
+    def _insert(chunk: Sequence[Any], i: int, key: Any) -> Sequence[Any]:
+        return chunk[:i] + (key,) + chunk[i:]
+
+    @staticmethod
+    def _delete(chunk: Sequence[Any], i: int) -> Sequence[Any]:
+        return chunk[:i] + chunk[i + 1:]
+
+    @staticmethod
+    def _unpack(chunk: Sequence[Any], start: int, end: int) -> Iterator[TimeSlot]:
+        return itertools.islice(chunk, start, end)
+
+class SlotStore:
+    """
+    Stores the time slots of the service providers together with the indexes needed by the
+    queries of the server. `ServerState` delegates to an implementation of this class.
+    """
+
+    def __init__(self, service_provider_db: Dict[ServiceProvider, List[TimeSlotInfo]]) -> None:
+        """
+        Builds the store from the time slots of each service provider.
+        """
+
+    def service_provider_db(self) -> Dict[ServiceProvider, List[TimeSlotInfo]]:
+        """
+        Returns the time slots of each service provider.
+        """
+
+        raise NotImplementedError()
+
+    def providers(self) -> List[ServiceProvider]:
+        """
+        Returns the service providers in the order of the store.
+        """
+
+        raise NotImplementedError()
+
+    def has_service_provider(self, provider: ServiceProvider) -> bool:
+        """
+        Returns whether the given service provider is in the store.
+        """
+
+        raise NotImplementedError()
+
+    def find_time_slot_info(self,
+                            provider: ServiceProvider,
+                            time_slot: TimeSlot) -> Optional[TimeSlotInfo]:
+        """
+        Returns the `TimeSlotInfo` of the given time slot of the given provider, or None if there
+        is no such provider or time slot.
+        """
+
+        raise NotImplementedError()
+
+    def set_time_slot_state(self,
+                            provider: ServiceProvider,
+                            ts_info: TimeSlotInfo,
+                            state: TimeSlotState,
+                            owner: int) -> None:
+        """
+        Changes the state and the owner of a time slot found by `find_time_slot_info`.
+        """
+
+        raise NotImplementedError()
+
+    def appointments_of_owner(self, owner: int, state: TimeSlotState) -> List[Appointment]:
+        """
+        Returns the appointments held by the given client in the given state.
+        """
+
+        raise NotImplementedError()
+
+    def appointments_in_state(self,
+                              state: TimeSlotState,
+                              provider: Optional[ServiceProvider] = None,
+                              time_from: Optional[TimeSlot] = None,
+                              time_to: Optional[TimeSlot] = None,
+                              after: Optional[Appointment] = None,
+                              limit: Optional[int] = None) -> Iterator[Appointment]:
+        """
+        Returns an iterator over the appointments in the given state, of the given provider or of
+        all providers if `provider` is None. The appointments are ordered by provider, in the
+        order of the store, and then chronologically.
+
+        The iterator is lazy and may be consumed while other requests change the state: every
+        time slot is checked when the iterator reaches it.
+
+        Args:
+            time_from: If not None, only time slots from this one (inclusive) are returned.
+            time_to: If not None, only time slots before this one (exclusive) are returned.
+            after: If not None, only the appointments after this one in the above order are
+                returned. Used to continue a listing where a previous page ended.
+            limit: If not None, at most this many appointments are returned.
+        """
+
+        raise NotImplementedError()
+
+    def snapshot(self,
+                 provider: ServiceProvider,
+                 state: TimeSlotState,
+                 version: int) -> SlotSnapshot:
+        """
+        Returns a snapshot of the time slots of the provider in the given state.
+        """
+
+        appointments = self.appointments_in_state(state, provider)
+        return ChunkedSlotSnapshot(version,
+                                   tuple(appointment.time_slot() for appointment in appointments))
+
+class ObjectSlotStore(SlotStore):
+    """
+    The default slot store. It keeps a `TimeSlotInfo` object per time slot with hash indexes by
+    time slot, by state and by owner, so lookups and per-owner queries do not scan the slots. The
+    time slots of each provider are also kept in a sorted list, so time ranges are found by
+    bisection.
+    """
+
+    def __init__(self, service_provider_db: Dict[ServiceProvider, List[TimeSlotInfo]]) -> None:
+        SlotStore.__init__(self, service_provider_db)
+
+        self._service_provider_db = service_provider_db
+
+        # The time slots of each provider, keyed by the `TimeSlot`.
+        self._time_slot_index: Dict[ServiceProvider, Dict[TimeSlot, TimeSlotInfo]] = dict()
+
+        # The time slots of each provider in each state.
+        self._state_index: Dict[TimeSlotState, Dict[ServiceProvider, Dict[TimeSlot, TimeSlotInfo]]]
+        self._state_index = {state: dict() for state in TimeSlotState}
+
+        # The time slots held by each client in each state other than AVAILABLE.
+        self._owner_index: Dict[Tuple[int, TimeSlotState], Dict[SlotKey, TimeSlotInfo]] = dict()
+
+        # The time slots of each provider in chronological order.
+        self._sorted_time_slots: Dict[ServiceProvider, List[TimeSlot]] = dict()
+
+        self._providers = list(service_provider_db.keys())
+        self._provider_positions = {provider: i for i, provider in enumerate(self._providers)}
+
+        for provider, ts_infos in service_provider_db.items():
+            index: Dict[TimeSlot, TimeSlotInfo] = dict()
+            for ts_info in ts_infos:
+                index.setdefault(ts_info.time_slot, ts_info)
+            self._time_slot_index[provider] = index
+            self._sorted_time_slots[provider] = sorted(index.keys())
+
+            for state_index in self._state_index.values():
+                state_index[provider] = dict()
+
+            for ts_info in index.values():
+                self._add_to_indexes(provider, ts_info)
+
+    def service_provider_db(self) -> Dict[ServiceProvider, List[TimeSlotInfo]]:
+        return self._service_provider_db
+
+    def providers(self) -> List[ServiceProvider]:
+        return self._providers
+
+    def has_service_provider(self, provider: ServiceProvider) -> bool:
+        return provider in self._time_slot_index
+
+    def find_time_slot_info(self,
+                            provider: ServiceProvider,
+                            time_slot: TimeSlot) -> Optional[TimeSlotInfo]:
+        # Constant time.
+        index = self._time_slot_index.get(provider)
+        if index is None:
+            return None
+
+        return index.get(time_slot)
+
+    def set_time_slot_state(self,
+                            provider: ServiceProvider,
+                            ts_info: TimeSlotInfo,
+                            state: TimeSlotState,
+                            owner: int) -> None:
+        self._remove_from_indexes(provider, ts_info)
+        ts_info.state = state
+        ts_info.owner = owner
+        self._add_to_indexes(provider, ts_info)
+
+    def appointments_of_owner(self, owner: int, state: TimeSlotState) -> List[Appointment]:
+        # In the order the slots got into the state; the cost is proportional to the number of
+        # these slots.
+        slots = self._owner_index.get((owner, state), dict())
+        return [Appointment(provider, time_slot) for provider, time_slot in slots]
+
+    def appointments_in_state(self,
+                              state: TimeSlotState,
+                              provider: Optional[ServiceProvider] = None,
+                              time_from: Optional[TimeSlot] = None,
+                              time_to: Optional[TimeSlot] = None,
+                              after: Optional[Appointment] = None,
+                              limit: Optional[int] = None) -> Iterator[Appointment]:
+        count = 0
+
+        for current in self._providers_from(provider, after):
+            time_slots = self._sorted_time_slots[current]
+            index = self._time_slot_index[current]
+            in_state = self._state_index[state][current]
+
+            start = 0 if time_from is None else bisect.bisect_left(time_slots, time_from)
+            end = len(time_slots) if time_to is None else bisect.bisect_left(time_slots, time_to)
+            if after is not None and after.service_provider() == current:
+                start = max(start, bisect.bisect_right(time_slots, after.time_slot()))
+
+            if len(in_state) < end - start:
+                # Fewer slots are in the state than in the time range: sort those instead of
+                # scanning the range. The lists are never modified, so they can be iterated
+                # lazily, but the dict has to be copied at once.
+                candidates = sorted(in_state.keys())
+                first = bisect.bisect_left(candidates, time_slots[start])
+                last = (bisect.bisect_left(candidates, time_slots[end])
+                        if end < len(time_slots) else len(candidates))
+                matching = (time_slot for time_slot in itertools.islice(candidates, first, last)
+                            if index[time_slot].state == state)
+            else:
+                matching = (time_slot for time_slot in itertools.islice(time_slots, start, end)
+                            if index[time_slot].state == state)
+
+            for time_slot in matching:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield Appointment(current, time_slot)
+
+    def snapshot(self,
+                 provider: ServiceProvider,
+                 state: TimeSlotState,
+                 version: int) -> SlotSnapshot:
+        index = self._time_slot_index[provider]
+        return ChunkedSlotSnapshot(version, tuple(time_slot for time_slot
+                                                  in self._sorted_time_slots[provider]
+                                                  if index[time_slot].state == state))
+
+    def _providers_from(self,
+                        provider: Optional[ServiceProvider],
+                        after: Optional[Appointment]) -> List[ServiceProvider]:
+        """
+        Returns the providers to list: the given one, or all of them from the provider of `after`
+        on if `provider` is None.
+        """
+
+        if provider is not None:
+            return [provider] if provider in self._time_slot_index else []
+
+        if after is None or after.service_provider() not in self._provider_positions:
+            return self._providers
+
+        return self._providers[self._provider_positions[after.service_provider()]:]
+
+    def _add_to_indexes(self, provider: ServiceProvider, ts_info: TimeSlotInfo) -> None:
+        self._state_index[ts_info.state][provider][ts_info.time_slot] = ts_info
+
+        if ts_info.state != TimeSlotState.AVAILABLE:
+            key = (ts_info.owner, ts_info.state)
+            self._owner_index.setdefault(key, dict())[(provider, ts_info.time_slot)] = ts_info
+
+    def _remove_from_indexes(self, provider: ServiceProvider, ts_info: TimeSlotInfo) -> None:
+        del self._state_index[ts_info.state][provider][ts_info.time_slot]
+
+        if ts_info.state != TimeSlotState.AVAILABLE:
+            key = (ts_info.owner, ts_info.state)
+            owned = self._owner_index[key]
+            del owned[(provider, ts_info.time_slot)]
+            if not owned:
+                del self._owner_index[key]
+
+# Seconds a time slot may stay in a basket before it is released.
+DEFAULT_BASKET_TTL = 15 * 60.0
 
 class ServerState:
     """
     A class that keeps the state of the server.
+
+    Time slots put in a basket are held for `basket_ttl` seconds. The deadlines of the holds are
+    kept in an `ExpiryQueue`, and `release_expired_holds`, which the server engines call
+    regularly, makes the expired ones available again in O(log n) time per hold.
+
+    The state transitions must be serialized, but the listings need not be: the state publishes
+    an immutable `SlotSnapshot` of the available time slots of every provider and a tuple of the
+    appointments of every owner in every state, which `available_appointments` and
+    `owned_appointments` read. A transition makes new versions of the snapshots it changes,
+    copy on write, and publishes them; the transitions made in a `batch` are published together
+    when it ends.
+
+    The `listeners` are called with the `SlotChanges` of every publication, e.g. to push them to
+    subscribed clients.
     """
 
-    def __init__(self) -> None:
-        self.service_provider_db: Dict[ServiceProvider, List[TimeSlotInfo]] = dict()
-        self.users: List[User] = []
+    def __init__(self,
+                 slot_store_type: Type[SlotStore] = ObjectSlotStore,
+                 basket_ttl: Optional[float] = DEFAULT_BASKET_TTL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Args:
+            slot_store_type: The `SlotStore` implementation that keeps the time slots.
+            basket_ttl: Seconds a time slot may stay in a basket, or None to hold it until it is
+                removed or booked.
+            clock: The clock of the basket holds.
+        """
+
+        self.basket_ttl = basket_ttl
+        self._clock = clock
+
+        # The deadlines of the time slots in baskets.
+        self._holds: ExpiryQueue[SlotKey] = ExpiryQueue()
+
+        self._slot_store_type = slot_store_type
+        self._slot_store: SlotStore = slot_store_type(dict())
+
+        self._users: List[User] = []
+
+        # The users keyed by the username.
+        self._users_by_name: Dict[str, User] = dict()
+
+        # The sessions of the logged in clients.
+        self.sessions = SessionTable()
+
+        # If set, every state transition is appended to it.
+        self.mutation_log: Optional["MutationLog"] = None
+
+        # The published snapshots. Readers take them under the lock, which is only held while
+        # they are taken or replaced.
+        self._publish_lock = threading.Lock()
+        self._versions = itertools.count(1)
+        self._available: Dict[ServiceProvider, SlotSnapshot] = dict()
+        self._available_version = 0
+        self._owned: Dict[Tuple[int, TimeSlotState], Tuple[Appointment, ...]] = dict()
+        self._provider_positions: Dict[ServiceProvider, int] = dict()
+
+        # The changes not published yet: whether each changed time slot became available, and
+        # the new appointments of each changed owner and state.
+        self._batch_depth = 0
+        self._changed_slots: Dict[ServiceProvider, Dict[TimeSlot, bool]] = dict()
+        self._changed_owned: Dict[Tuple[int, TimeSlotState], List[Appointment]] = dict()
+        self._changed_states: SlotChanges = dict()
+
+        # Called with the changes of every publication, where the transitions are serialized.
+        self.listeners: List[Callable[[SlotChanges], None]] = []
+
+    @property
+    def service_provider_db(self) -> Dict[ServiceProvider, List[TimeSlotInfo]]:
+        """
+        The time slots of each service provider. Assigning it rebuilds the slot store. With the
+        default store the `TimeSlotInfo` objects are the stored ones, but they must only be
+        modified through `set_time_slot_state`; other stores return a copy.
+        """
+
+        return self._slot_store.service_provider_db()
+
+    @service_provider_db.setter
+    def service_provider_db(self, value: Dict[ServiceProvider, List[TimeSlotInfo]]) -> None:
+        self._slot_store = self._slot_store_type(value)
+        self._hold_baskets()
+        self._publish_all()
+
+    @property
+    def slot_store(self) -> SlotStore:
+        """
+        The store of the time slots.
+        """
+
+        return self._slot_store
+
+    @slot_store.setter
+    def slot_store(self, value: SlotStore) -> None:
+        self._slot_store_type = type(value)
+        self._slot_store = value
+        self._hold_baskets()
+        self._publish_all()
+
+    @property
+    def users(self) -> List[User]:
+        """
+        The users. Assigning it rebuilds the username index; if several users have the same
+        username, the first one is found. Raises `ValueError` if a user id is not between 1 and
+        `MAX_USER_ID`, so the ids fit the owners of the time slots.
+        """
+
+        return self._users
+
+    @users.setter
+    def users(self, value: List[User]) -> None:
+        users_by_name: Dict[str, User] = dict()
+        for user in value:
+            if not 1 <= user.user_id <= MAX_USER_ID:
+                raise ValueError("Invalid user id: {}.".format(user.user_id))
+            users_by_name.setdefault(user.username, user)
+
+        self._users = value
+        self._users_by_name = users_by_name
+
+    def find_user(self, username: str) -> Optional[User]:
+        """
+        Returns the user with the given username, or None if there is none.
+        """
+
+        return self._users_by_name.get(username)
+
+    def has_service_provider(self, provider: ServiceProvider) -> bool:
+        """
+        Returns whether the given service provider is in the database.
+        """
+
+        return self._slot_store.has_service_provider(provider)
+
+    def find_time_slot_info(self,
+                            provider: ServiceProvider,
+                            time_slot: TimeSlot) -> Optional[TimeSlotInfo]:
+        """
+        Returns the `TimeSlotInfo` of the given time slot of the given provider, or None if there
+        is no such provider or time slot.
+        """
+
+        return self._slot_store.find_time_slot_info(provider, time_slot)
+
+    def set_time_slot_state(self,
+                            provider: ServiceProvider,
+                            ts_info: TimeSlotInfo,
+                            state: TimeSlotState,
+                            owner: int) -> None:
+        """
+        Changes the state and the owner of a time slot of the given provider, keeping the indexes
+        and the basket holds up to date and appending the transition to the mutation log if there
+        is one. All state transitions must go through this method. The transition is appended to
+        the log first, so if that fails the state is not changed.
+        """
+
+        old_state = ts_info.state
+        old_owner = ts_info.owner
 
-        # Keys are user ids, values are ip addresses.
-        self.connected_users: Dict[int, str] = dict()
+        if self.mutation_log is not None:
+            self.mutation_log.append(provider, ts_info.time_slot, state, owner)
+        self._slot_store.set_time_slot_state(provider, ts_info, state, owner)
+
+        key = (provider, ts_info.time_slot)
+        if state == TimeSlotState.IN_BASKET and self.basket_ttl is not None:
+            self._holds.schedule(key, self._clock() + self.basket_ttl)
+        else:
+            self._holds.cancel(key)
+
+        available = TimeSlotState.AVAILABLE
+        if (old_state == available) != (state == available):
+            self._changed_slots.setdefault(provider, dict())[ts_info.time_slot] = (
+                state == available)
+
+        if old_state != state and self.listeners:
+            self._changed_states.setdefault(provider, dict())[ts_info.time_slot] = state
+
+        if (old_state, old_owner) != (state, owner):
+            if old_state != available:
+                owned = self._changed_owned_list(old_owner, old_state)
+                owned[:] = [appointment for appointment in owned
+                            if (appointment.service_provider(), appointment.time_slot()) != key]
+            if state != available:
+                self._changed_owned_list(owner, state).append(Appointment(provider,
+                                                                          ts_info.time_slot))
+
+        if self._batch_depth == 0:
+            self._publish()
+
+    def check_transition(self, time_slot: TimeSlot) -> None:
+        """
+        Raises if a transition of the time slot could not be appended to the mutation log, see
+        `MutationLog.check`. Batches check every slot first, so they are applied all or nothing.
+        """
+
+        if self.mutation_log is not None:
+            self.mutation_log.check(time_slot)
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Returns a context manager that publishes the transitions made in it together when it
+        exits, so the listings show either all of them or none. It also makes a new version of a
+        snapshot only once for all the changes of the batch.
+        """
+
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._publish()
+
+    def provider_snapshot(self, provider: ServiceProvider) -> Optional[SlotSnapshot]:
+        """
+        Returns the published snapshot of the available time slots of the provider, or None if
+        there is no such provider.
+        """
+
+        with self._publish_lock:
+            return self._available.get(provider)
+
+    def available_version(self, provider: Optional[ServiceProvider] = None) -> Optional[int]:
+        """
+        Returns the version of the published available time slots of the provider, or of all
+        providers if `provider` is None, or None if there is no such provider. Every published
+        change of the available time slots makes a new version, and versions only grow, so a
+        listing made after this call is at least as new as the returned version.
+        """
+
+        with self._publish_lock:
+            if provider is None:
+                return self._available_version
+
+            snapshot = self._available.get(provider)
+            return None if snapshot is None else snapshot.version
+
+    def available_appointments(self,
+                               provider: Optional[ServiceProvider] = None,
+                               time_from: Optional[TimeSlot] = None,
+                               time_to: Optional[TimeSlot] = None,
+                               after: Optional[Appointment] = None,
+                               limit: Optional[int] = None) -> Iterator[Appointment]:
+        """
+        Returns an iterator over the available appointments like `appointments_in_state`, but it
+        reads the published snapshots, which are all taken when this method is called. Thus it
+        lists the state as it was then, and neither the call nor the iteration has to be
+        serialized with the transitions.
+        """
+
+        with self._publish_lock:
+            if provider is not None:
+                snapshot = self._available.get(provider)
+                snapshots = [] if snapshot is None else [(provider, snapshot)]
+            else:
+                snapshots = list(self._available.items())
+                if after is not None:
+                    snapshots = snapshots[self._provider_positions.get(after.service_provider(),
+                                                                       0):]
+
+        return self._list_snapshots(snapshots, time_from, time_to, after, limit)
+
+    def owned_appointments(self, owner: int, state: TimeSlotState) -> Tuple[Appointment, ...]:
+        """
+        Returns the published appointments held by the given client in the given state, in the
+        order they got into the state. Unlike `appointments_of_owner`, it need not be serialized
+        with the transitions.
+        """
+
+        with self._publish_lock:
+            return self._owned.get((owner, state), ())
+
+    def next_hold_deadline(self) -> Optional[float]:
+        """
+        Returns the time, on the clock of the state, when the next basket hold expires, or None
+        if no time slot is held.
+        """
+
+        return self._holds.next_deadline()
+
+    def release_expired_holds(self, limit: Optional[int] = None) -> int:
+        """
+        Makes the time slots held in baskets for longer than `basket_ttl` available, at most
+        `limit` of them if it is given. Returns the number of slots released.
+        """
+
+        released = 0
+        with self.batch():
+            for provider, time_slot in self._holds.pop_expired(self._clock(), limit):
+                ts_info = self._slot_store.find_time_slot_info(provider, time_slot)
+                if ts_info is not None and ts_info.state == TimeSlotState.IN_BASKET:
+                    self.set_time_slot_state(provider, ts_info, TimeSlotState.AVAILABLE, 0)
+                    released += 1
+
+        return released
+
+    def _hold_baskets(self) -> None:
+        # Holds the time slots of a new slot store that are already in baskets.
+        self._holds = ExpiryQueue()
+        if self.basket_ttl is None:
+            return
+
+        deadline = self._clock() + self.basket_ttl
+        for appointment in list(self.appointments_in_state(TimeSlotState.IN_BASKET)):
+            self._holds.schedule((appointment.service_provider(), appointment.time_slot()),
+                                 deadline)
+
+    def _changed_owned_list(self, owner: int, state: TimeSlotState) -> List[Appointment]:
+        key = (owner, state)
+        owned = self._changed_owned.get(key)
+        if owned is None:
+            owned = self._changed_owned[key] = list(self._owned.get(key, ()))
+
+        return owned
+
+    def _publish(self) -> None:
+        # The new versions are made before taking the lock, so readers only wait for the swap.
+        available = dict()
+        for provider, changes in self._changed_slots.items():
+            added = [time_slot for time_slot, is_available in changes.items() if is_available]
+            removed = [time_slot for time_slot, is_available in changes.items()
+                       if not is_available]
+            available[provider] = self._available[provider].updated(added, removed,
+                                                                     next(self._versions))
+
+        with self._publish_lock:
+            self._available.update(available)
+            if available:
+                self._available_version = max(snapshot.version for snapshot in available.values())
+            for key, owned in self._changed_owned.items():
+                if owned:
+                    self._owned[key] = tuple(owned)
+                else:
+                    self._owned.pop(key, None)
+
+        self._changed_slots.clear()
+        self._changed_owned.clear()
+
+        if self._changed_states:
+            changes = self._changed_states
+            self._changed_states = dict()
+            for listener in self.listeners:
+                listener(changes)
+
+    def _publish_all(self) -> None:
+        # Publishes the snapshots of a new slot store.
+        providers = self._slot_store.providers()
+        available = {provider: self._slot_store.snapshot(provider, TimeSlotState.AVAILABLE,
+                                                         next(self._versions))
+                     for provider in providers}
+
+        owned: Dict[Tuple[int, TimeSlotState], List[Appointment]] = dict()
+        for state in (TimeSlotState.IN_BASKET, TimeSlotState.RESERVED):
+            for appointment in self._slot_store.appointments_in_state(state):
+                ts_info = self._slot_store.find_time_slot_info(appointment.service_provider(),
+                                                               appointment.time_slot())
+                assert ts_info is not None
+                owned.setdefault((ts_info.owner, state), []).append(appointment)
+
+        with self._publish_lock:
+            self._available = available
+            self._available_version = next(self._versions)
+            self._owned = {key: tuple(appointments) for key, appointments in owned.items()}
+            self._provider_positions = {provider: i for i, provider in enumerate(providers)}
+
+        self._changed_slots.clear()
+        self._changed_owned.clear()
+        self._changed_states.clear()
+
+    @staticmethod
+    def _list_snapshots(snapshots: List[Tuple[ServiceProvider, SlotSnapshot]],
+                        time_from: Optional[TimeSlot],
+                        time_to: Optional[TimeSlot],
+                        after: Optional[Appointment],
+                        limit: Optional[int]) -> Iterator[Appointment]:
+        count = 0
+        for provider, snapshot in snapshots:
+            after_time_slot = (after.time_slot()
+                               if after is not None and after.service_provider() == provider
+                               else None)
+            for time_slot in snapshot.time_slots(time_from, time_to, after_time_slot):
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield Appointment(provider, time_slot)
+
+    def appointments_of_owner(self, owner: int, state: TimeSlotState) -> List[Appointment]:
+        """
+        Returns the appointments held by the given client in the given state.
+        """
+
+        return self._slot_store.appointments_of_owner(owner, state)
+
+    def appointments_in_state(self,
+                              state: TimeSlotState,
+                              provider: Optional[ServiceProvider] = None,
+                              time_from: Optional[TimeSlot] = None,
+                              time_to: Optional[TimeSlot] = None,
+                              after: Optional[Appointment] = None,
+                              limit: Optional[int] = None) -> Iterator[Appointment]:
+        """
+        Returns an iterator over the appointments in the given state, see
+        `SlotStore.appointments_in_state`.
+        """
+
+        return self._slot_store.appointments_in_state(state, provider, time_from, time_to, after,
+                                                      limit)
 
     def load_users(self, filename: str) -> None:
         """
-        Loads the users from the given file.
+        Loads the users from the given file. Passwords that are not hashed yet are hashed, which
+        is slow; `bc.server.credentials` can hash the passwords of the file in advance.
         """
 
         result = []
@@ -91,6 +976,12 @@ class ServerState:
                 username = record[1]
                 password = record[2]
                 result.append(User(user_id, username, password))
+
+        plain = [user for user in result if not is_password_hash(user.password_hash)]
+        for user, password_hash in zip(plain,
+                                       hash_passwords([user.password_hash for user in plain])):
+            user.password_hash = password_hash
+
         self.users = result
 
     def load_service_providers(self, filename: str) -> None:
@@ -0,0 +1,133 @@
+"""
+This module contains the sessions of the logged in clients.
+"""
+
+import secrets
+import time
+
+from typing import Callable, Dict, Optional
+
+from bc.server.expiry import ExpiryQueue
+
+# Seconds a session may stay unused before it expires.
+DEFAULT_SESSION_TTL = 30 * 60.0
+
+DEFAULT_MAX_SESSIONS = 1 << 20
+
+class Session:
+    """
+    A struct representing a session of a client.
+    """
+
+    def __init__(self, token: str, client_id: int, last_used: float) -> None:
+        self.token = token
+        self.client_id = client_id
+        self.last_used = last_used
+
+class SessionTable:
+    """
+    The sessions of the logged in clients, keyed by a random token that the server issues at
+    login and the client sends with every request. A session is not tied to an address, so it
+    works behind NAT and load balancers.
+
+    Sessions expire after `ttl` seconds without use. Their deadlines are kept in an
+    `ExpiryQueue`, and expired sessions are evicted as the table is used, each in O(log n) time,
+    so the table does not grow with the number of logins over time. Using a session only updates
+    its `last_used` time; when its stale deadline comes up, it is rescheduled instead of being
+    evicted. If the table is full, a login evicts the session that has been unused the longest.
+    """
+
+    def __init__(self,
+                 ttl: float = DEFAULT_SESSION_TTL,
+                 max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if max_sessions <= 0:
+            raise ValueError("The table must hold at least one session.")
+
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+
+        self._sessions: Dict[str, Session] = dict()
+        self._expiry: ExpiryQueue[str] = ExpiryQueue()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, client_id: int) -> str:
+        """
+        Creates a session for the client and returns its token.
+        """
+
+        now = self._clock()
+        self.expire(now)
+
+        while len(self._sessions) >= self.max_sessions:
+            self._evict_least_recently_used()
+
+        token = secrets.token_urlsafe(16)
+        self._sessions[token] = Session(token, client_id, now)
+        self._expiry.schedule(token, now + self.ttl)
+
+        return token
+
+    def lookup(self, token: str) -> Optional[int]:
+        """
+        Returns the client id of the session of `token` and marks the session as used, or returns
+        None if there is no such session or it has expired.
+        """
+
+        now = self._clock()
+        self.expire(now)
+
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+
+        session.last_used = now
+        return session.client_id
+
+    def remove(self, token: str) -> bool:
+        """
+        Ends the session of `token`. Returns whether there was such a session.
+        """
+
+        if self._sessions.pop(token, None) is None:
+            return False
+
+        self._expiry.cancel(token)
+        return True
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """
+        Evicts the sessions unused for `ttl` seconds and returns their number.
+        """
+
+        if now is None:
+            now = self._clock()
+
+        evicted = 0
+        for token in self._expiry.pop_expired(now):
+            session = self._sessions[token]
+            deadline = session.last_used + self.ttl
+            if deadline > now:
+                # Used since it was scheduled.
+                self._expiry.schedule(token, deadline)
+            else:
+                del self._sessions[token]
+                evicted += 1
+
+        return evicted
+
+    def _evict_least_recently_used(self) -> None:
+        # Rescheduling the stale deadlines leaves the least recently used session first.
+        while True:
+            token = self._expiry.pop()
+            session = self._sessions[token]
+            deadline = session.last_used + self.ttl
+            next_deadline = self._expiry.next_deadline()
+            if next_deadline is None or deadline <= next_deadline:
+                del self._sessions[token]
+                return
+
+            self._expiry.schedule(token, deadline)
@@ -0,0 +1,728 @@
+"""
+This module contains a sharded server engine, which spreads the service providers over several
+processes, so the requests are not limited to one core by the GIL.
+
+The service providers are partitioned by a hash of their name (see `shard_of`). Every shard is a
+`ShardServer`, an `AsyncServer` in its own process that keeps the time slots of its providers,
+their basket holds and, if the server is durable, its own mutation log. A `ShardRouter` in the
+main process accepts the connections of the clients, handles the logins and the sessions, and
+forwards the other requests to the shards over persistent, pipelined connections:
+
+- A request about one provider goes to the shard of the provider. Requests in the binary codec
+  are forwarded, and their replies relayed, without encoding them again. The shards send whether
+  a reply is OK in the header of its frame, so the router counts the outcomes in its metrics
+  without decoding the replies.
+- Listings of all providers, of the basket and of the booked appointments are sent to every
+  shard, and the router merges the replies.
+- Confirming a booking is sent to every shard, and every shard books its part of the basket on
+  its own, so it is not atomic across the shards: if the holds of a part of the basket expire,
+  the other parts are still booked.
+- A batch whose appointments belong to several shards is checked on all of them with a dry run
+  first, and only applied if it passes everywhere. If a slot changes between the check and the
+  apply, e.g. another client takes it or its basket hold expires, an add batch is undone by
+  removing the slots on the shards that applied it, and a remove batch by adding them back. A
+  cancel batch cannot be undone, as the cancelled slots cannot be booked again without the
+  basket, so it is not atomic across the shards; only the client itself can change its booked
+  slots between the check and the apply, though.
+
+The router does not touch the time slots, so the work of the requests is spread over the shards,
+but the router itself is a single process that decodes every request to route it. The changes of
+the time slots happen on the shards, so the sharded server does not support subscriptions.
+"""
+
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import struct
+import time
+import zlib
+
+from collections import deque
+from typing import (Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple, Type,
+                    TypeVar, Union)
+
+from bc.common.comm_util import (Appointment, BINARY_CODEC, Codec, LengthPrefixedTransceiver,
+                                 Message, RequestType, StreamMessage)
+from bc.common.entities import ServiceProvider
+from bc.server.admission import RateLimiter
+from bc.server.async_server import AsyncServer
+from bc.server.metrics import Outcome
+from bc.server.persistence import MutationLog
+from bc.server.replay_cache import ReplayCache
+from bc.server.server import DATA_DIR, load_server_state, MAX_BATCH_SIZE, RequestHandler
+from bc.server.server_util import ServerState, SlotStore, TimeSlotInfo
+from bc.server.subscriptions import Subscriber
+
+# The connections of the router to every shard. A shard serves the requests of a connection one
+# at a time, so with more connections the requests of a durable shard share its group commits.
+CONNECTIONS_PER_SHARD = 8
+
+# Records the number of shards in the data directory, because the mutation log of a shard only
+# has the mutations of its own providers.
+SHARD_COUNT_FILE = "shards"
+
+# The header of the frames of the shards' replies: the length of the reply and whether it is OK.
+# The requests to the shards are framed like those of the clients, see `LengthPrefixedTransceiver`.
+SHARD_REPLY_HEADER = struct.Struct("!I?")
+
+T = TypeVar("T")
+
+# The requests that undo the batches applied on some of the shards, see `ShardRouter._route_batch`.
+_UNDO_BATCH = {
+    RequestType.ADD_APPOINTMENTS_TO_BASKET: RequestType.REMOVE_APPOINTMENTS_FROM_BASKET,
+    RequestType.REMOVE_APPOINTMENTS_FROM_BASKET: RequestType.ADD_APPOINTMENTS_TO_BASKET,
+    }
+
+def shard_of(provider_name: str, shards: int) -> int:
+    """
+    Returns the index of the shard of the provider. Unlike `hash`, it is the same in every
+    process.
+    """
+
+    return zlib.crc32(provider_name.encode("utf-8")) % shards
+
+def partition_service_providers(service_provider_db: Dict[ServiceProvider, List[TimeSlotInfo]],
+                                shards: int) -> List[Dict[ServiceProvider, List[TimeSlotInfo]]]:
+    """
+    Splits a service provider database into one for every shard. Every partition has all the
+    providers in the order of `service_provider_db`, but only the providers of its shard have
+    time slots. Thus a listing cursor means the same on every shard, and a provider that is
+    unknown to one shard is unknown to all of them.
+    """
+
+    partitions: List[Dict[ServiceProvider, List[TimeSlotInfo]]] = [dict() for _ in range(shards)]
+    for provider, ts_infos in service_provider_db.items():
+        owner = shard_of(provider.name(), shards)
+        for shard, partition in enumerate(partitions):
+            partition[provider] = ts_infos if shard == owner else []
+
+    return partitions
+
+class ShardRequestHandler(RequestHandler):
+    """
+    The request handler of the shards. The router checks the sessions, so the shards trust the
+    client ids of the requests.
+    """
+
+    def check_session(self, request: Message) -> bool:
+        return isinstance(request.data()["client_id"], int)
+
+class ShardServer(AsyncServer):
+    """
+    A shard of a sharded server. It listens on the loopback interface and only serves the router.
+    """
+
+    def __init__(self, port: int, server_state: ServerState) -> None:
+        AsyncServer.__init__(self, "127.0.0.1", port, server_state)
+        self._request_handler = ShardRequestHandler(self)
+
+        # The router limits the rates of the clients and replays the retried requests; the
+        # router sends a batch to a shard as a dry run first, with the same request id.
+        self.rate_limiter = RateLimiter(dict())
+        self.replays = ReplayCache(max_entries=0)
+
+    def _send_reply(self,
+                    framing: Any,
+                    writer: asyncio.StreamWriter,
+                    reply: Union[Message, bytes],
+                    codec: Codec) -> None:
+        # Only the router connects; it reads the replies with the `SHARD_REPLY_HEADER`. The
+        # chunks of streamed replies have no "OK" field.
+        msg_bytes = reply if isinstance(reply, bytes) else reply.to_bytes(codec)
+        ok = isinstance(reply, bytes) or bool(reply.data().get("OK", True))
+        writer.writelines((SHARD_REPLY_HEADER.pack(len(msg_bytes), ok), msg_bytes))
+
+class ShardReply(NamedTuple):
+    """
+    An encoded reply of a shard and whether it is OK.
+    """
+
+    msg_bytes: bytes
+    ok: bool
+
+class _ShardConnection:
+    """
+    A pipelined, length prefixed connection of the router to a shard. The shard replies to the
+    requests of a connection in order, so the replies are matched to the requests in a queue.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+
+        # The futures of the requests waiting for replies, whether the replies are streamed, and
+        # the records received so far of the streamed ones.
+        self._pending: Deque[Tuple[asyncio.Future, bool, List[Any]]] = deque()
+        self._reader_task = asyncio.ensure_future(self._read_replies())
+
+    async def request(self, msg_bytes: bytes, streamed: bool = False) -> Any:
+        """
+        Sends a request in the binary codec and returns the `ShardReply` or, if `streamed` is
+        True, the records of the streamed reply and the data of its last message. Raises
+        `ConnectionError` if the connection is lost.
+        """
+
+        if self._reader_task.done():
+            raise ConnectionError("The connection to the shard is closed.")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, streamed, []))
+        self._writer.writelines((LengthPrefixedTransceiver.HEADER.pack(len(msg_bytes)),
+                                 msg_bytes))
+        await self._writer.drain()
+
+        return await future
+
+    def close(self) -> None:
+        self._reader_task.cancel()
+        self._writer.close()
+
+    async def _read_replies(self) -> None:
+        try:
+            while True:
+                header = await self._reader.readexactly(SHARD_REPLY_HEADER.size)
+                length, ok = SHARD_REPLY_HEADER.unpack(header)
+                msg_bytes = await self._reader.readexactly(length)
+
+                future, streamed, records = self._pending[0]
+                result: Any = ShardReply(msg_bytes, ok)
+                if streamed:
+                    # Failed requests get a single, unstreamed reply.
+                    message = BINARY_CODEC.decode(msg_bytes)
+                    if "chunk" in message:
+                        records.extend(message["chunk"])
+                        continue
+                    result = (records, message)
+
+                self._pending.popleft()
+                if not future.done():
+                    future.set_result(result)
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError, ValueError):
+            pass
+        finally:
+            for future, _, _ in self._pending:
+                if not future.done():
+                    future.set_exception(ConnectionError("The connection to the shard is lost."))
+            self._pending.clear()
+
+Route = Callable[[Dict[str, Any], Optional[bytes]], Awaitable[Union[Message, ShardReply]]]
+
+class ShardRouter(AsyncServer):
+    """
+    The front end of a sharded server, see the module documentation. Its `ServerState` has the
+    users and the sessions; the time slots are kept by the shards.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 server_state: ServerState,
+                 providers: List[ServiceProvider],
+                 shard_addresses: List[Tuple[str, int]],
+                 connections_per_shard: int = CONNECTIONS_PER_SHARD) -> None:
+        """
+        Args:
+            providers: All service providers, in the order of the listings.
+            shard_addresses: The addresses of the shards, in the order of their indices.
+        """
+
+        AsyncServer.__init__(self, host, port, server_state)
+
+        self._positions = {provider: i for i, provider in enumerate(providers)}
+        self._shard_addresses = list(shard_addresses)
+        self._connections_per_shard = connections_per_shard
+        self._shards: List[List[_ShardConnection]] = []
+        self._connection_counter = itertools.count()
+
+        self._routes: Dict[RequestType, Route] = {
+            RequestType.LIST_BASKET: self._route_owner_listing,
+            RequestType.LIST_BOOKED_APPOINTMENTS: self._route_owner_listing,
+            RequestType.LIST_AVAILABLE_APPOINTMENTS: self._route_available_listing,
+            RequestType.ADD_APPOINTMENT_TO_BASKET: self._route_appointment,
+            RequestType.REMOVE_APPOINTMENT_FROM_BASKET: self._route_appointment,
+            RequestType.CONFIRM_BOOKING: self._route_confirm_booking,
+            RequestType.CANCEL_APPOINTMENT: self._route_appointment,
+            RequestType.ADD_APPOINTMENTS_TO_BASKET: self._route_batch,
+            RequestType.REMOVE_APPOINTMENTS_FROM_BASKET: self._route_batch,
+            RequestType.CANCEL_APPOINTMENTS: self._route_batch,
+            }
+
+    async def start(self) -> None:
+        """
+        Connects to the shards and starts listening for connections.
+        """
+
+        for address in self._shard_addresses:
+            connections = []
+            for _ in range(self._connections_per_shard):
+                reader, writer = await asyncio.open_connection(*address)
+                connections.append(_ShardConnection(reader, writer))
+            self._shards.append(connections)
+
+        await AsyncServer.start(self)
+
+    async def close(self) -> None:
+        """
+        Stops listening for connections and disconnects from the shards.
+        """
+
+        await AsyncServer.close(self)
+
+        for connections in self._shards:
+            for connection in connections:
+                connection.close()
+        self._shards = []
+
+    async def _reply(self,
+                     msg_bytes: bytes,
+                     ip_address: str,
+                     codec: Codec,
+                     subscriber: Optional[Subscriber] = None) -> Union[Message, bytes]:
+        started = time.perf_counter()
+        request_id = None
+        request_type = None
+        outcome: Optional[Outcome] = None
+        try:
+            request = Message.from_bytes(msg_bytes, codec)
+            request_data = request.data()
+            request_id = request_data.get("request_id")
+
+            request_type = request_data["type"]
+            if request_type in (RequestType.LOGIN, RequestType.STATS):
+                # The request handler records these.
+                return await AsyncServer._reply(self, msg_bytes, ip_address, codec)
+
+            if not self.pending.enter():
+                reply = self._request_handler.get_rejection_message("Server busy.",
+                                                                    self.pending.retry_after)
+                reply.data()["request_id"] = request_id
+                outcome = Outcome.REJECTED
+            else:
+                try:
+                    reply, outcome = await self._route_request(request, codec, msg_bytes)
+                finally:
+                    self.pending.leave()
+        except ConnectionError:
+            reply = self._reply_message(request_id, False, "Shard unavailable.")
+            outcome = Outcome.FAILED
+        except Exception:
+            reply = self._reply_message(request_id, False, "Invalid request.")
+            outcome = Outcome.INVALID
+
+        if outcome is None:
+            ok = reply.ok if isinstance(reply, ShardReply) else reply.data()["OK"]
+            outcome = Outcome.OK if ok else Outcome.FAILED
+        self._request_handler.record(request_type, outcome, started, ip_address)
+
+        if isinstance(reply, ShardReply):
+            if codec is not BINARY_CODEC:
+                return Message.from_bytes(reply.msg_bytes, BINARY_CODEC)
+            return reply.msg_bytes
+
+        return reply
+
+    async def _route_request(self,
+                             request: Message,
+                             codec: Codec,
+                             msg_bytes: bytes) -> Tuple[Union[Message, ShardReply],
+                                                        Optional[Outcome]]:
+        # Returns the reply to an admitted request, and its outcome if the reply is not from a
+        # shard.
+        request_data = request.data()
+        request_id = request_data.get("request_id")
+        if not self._request_handler.check_session(request):
+            return self._reply_message(request_id, False, "Access denied."), Outcome.DENIED
+
+        rejection = self._request_handler.throttle(request_data["client_id"], request_data["type"])
+        if rejection is not None:
+            rejection.data()["request_id"] = request_id
+            return rejection, Outcome.REJECTED
+
+        if request_data["type"] == RequestType.SUBSCRIBE:
+            return self._reply_message(
+                request_id, False, "Subscriptions are not supported by the sharded server."), None
+
+        route = self._routes[request_data["type"]]
+        key = self._request_handler.replay_key(request)
+        if key is None:
+            return await route(request_data, msg_bytes if codec is BINARY_CODEC else None), None
+
+        cached = self.replays.get(key, request_data["type"])
+        if isinstance(cached, asyncio.Future):
+            # The request is still being routed; the retry gets its reply. The shield keeps a
+            # cancelled retry from cancelling the future of the others.
+            return await asyncio.shield(cached), None
+        if cached is not None:
+            return cached, None
+
+        # Until the reply comes, the replays have the future of the reply of the request.
+        in_flight = asyncio.get_running_loop().create_future()
+        self.replays.put(key, request_data["type"], in_flight)
+        try:
+            reply = await route(request_data, msg_bytes if codec is BINARY_CODEC else None)
+        except BaseException as error:
+            self.replays.discard(key)
+            # The waiting retries fail like the request or, if it was cancelled, as if the shard
+            # was unavailable. The exception is marked retrieved, in case no retry waits.
+            in_flight.set_exception(error if isinstance(error, Exception)
+                                    else ConnectionError("The request was cancelled."))
+            in_flight.exception()
+            raise
+
+        self.replays.put(key, request_data["type"], reply)
+        in_flight.set_result(reply)
+        return reply, None
+
+    async def _route_appointment(self,
+                                 request_data: Dict[str, Any],
+                                 msg_bytes: Optional[bytes]) -> ShardReply:
+        shard = self._shard_of_appointment(request_data["appointment"])
+        return await self._forward(shard, request_data, msg_bytes)
+
+    async def _route_available_listing(self,
+                                       request_data: Dict[str, Any],
+                                       msg_bytes: Optional[bytes]) -> Union[Message, ShardReply]:
+        provider = request_data["service_provider"]
+        if provider:
+            # Invalid providers are sent to the first shard, which rejects them.
+            shard = shard_of(provider, len(self._shards)) if isinstance(provider, str) else 0
+            return await self._forward(shard, request_data, msg_bytes)
+
+        # Every shard lists its first `limit` appointments after the cursor, and the first
+        # `limit` of all of them are the page.
+        listings = await self._list_on_shards(request_data)
+        if isinstance(listings, Message):
+            return listings
+
+        limit = request_data.get("limit")
+        appointments = list(itertools.islice(heapq.merge(*listings, key=self._listing_order),
+                                             limit))
+        return self._listing_reply(request_data, appointments, limit)
+
+    async def _route_owner_listing(self,
+                                   request_data: Dict[str, Any],
+                                   msg_bytes: Optional[bytes]) -> Message:
+        listings = await self._list_on_shards(request_data)
+        if isinstance(listings, Message):
+            return listings
+
+        appointments = sorted(itertools.chain.from_iterable(listings), key=self._listing_order)
+        return self._listing_reply(request_data, appointments)
+
+    async def _route_confirm_booking(self,
+                                     request_data: Dict[str, Any],
+                                     msg_bytes: Optional[bytes]) -> ShardReply:
+        if msg_bytes is None:
+            msg_bytes = BINARY_CODEC.encode(request_data)
+
+        replies = await self._on_all_shards(lambda shard: self._shard_request(shard, msg_bytes))
+
+        # The shards without a part of the basket reply that there is nothing to book.
+        for reply in replies:
+            if reply.ok:
+                return reply
+
+        return replies[0]
+
+    async def _route_batch(self,
+                           request_data: Dict[str, Any],
+                           msg_bytes: Optional[bytes]) -> Union[Message, ShardReply]:
+        """
+        Routes a batch, which is all or nothing across the shards, except for cancel batches (see
+        the module documentation).
+        """
+
+        appointments = request_data["appointments"]
+        if not isinstance(appointments, list) or not 0 < len(appointments) <= MAX_BATCH_SIZE:
+            # The shard rejects the batch.
+            return await self._forward(0, request_data, msg_bytes)
+
+        batches: Dict[int, List[Any]] = dict()
+        for appointment in appointments:
+            batches.setdefault(self._shard_of_appointment(appointment), []).append(appointment)
+
+        if len(batches) == 1:
+            return await self._forward(next(iter(batches)), request_data, msg_bytes)
+
+        replies = await self._send_batches(request_data, batches, dry_run=True)
+        failure = self._first_failure(appointments, replies)
+        if failure is not None or request_data.get("dry_run") is True:
+            return Message(failure or replies[0])
+
+        replies = await self._send_batches(request_data, batches)
+        failure = self._first_failure(appointments, replies)
+        if failure is None:
+            return Message(replies[0])
+
+        undo_type = _UNDO_BATCH.get(request_data["type"])
+        if undo_type is not None:
+            # A slot changed since the dry run: undo the batches applied on the other shards.
+            applied = {shard: batch for (shard, batch), reply in zip(batches.items(), replies)
+                       if reply["OK"]}
+            await self._send_batches(dict(request_data, type=undo_type), applied)
+
+        return Message(failure)
+
+    async def _send_batches(self,
+                            request_data: Dict[str, Any],
+                            batches: Dict[int, List[Any]],
+                            dry_run: bool = False) -> List[Dict[str, Any]]:
+        """
+        Sends the request with the batch of every shard to the shard, and returns the replies in
+        the order of `batches`.
+        """
+
+        requests = []
+        for shard, batch in batches.items():
+            sub_request = dict(request_data, appointments=batch, dry_run=dry_run)
+            requests.append(self._shard_request(shard, BINARY_CODEC.encode(sub_request)))
+
+        return [BINARY_CODEC.decode(reply.msg_bytes) for reply in await asyncio.gather(*requests)]
+
+    @staticmethod
+    def _first_failure(appointments: List[Any],
+                       replies: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the failed reply whose appointment comes first in the batch, or None if every
+        shard succeeded.
+        """
+
+        failures = [reply for reply in replies if not reply["OK"]]
+        if not failures:
+            return None
+
+        positions: Dict[Any, int] = dict()
+        for i, appointment in enumerate(appointments):
+            if isinstance(appointment, Appointment):
+                positions.setdefault((appointment.service_provider(),
+                                      appointment.time_slot()), i)
+
+        def position(reply: Dict[str, Any]) -> int:
+            # Invalid requests have no appointment.
+            appointment = reply.get("appointment")
+            if not isinstance(appointment, Appointment):
+                return -1
+            return positions.get((appointment.service_provider(), appointment.time_slot()), -1)
+
+        return min(failures, key=position)
+
+    async def _list_on_shards(self,
+                              request_data: Dict[str, Any]) -> Union[Message, List[List[Any]]]:
+        """
+        Sends the listing request to every shard and returns their listings or, if any of them
+        failed, its reply.
+        """
+
+        msg_bytes = BINARY_CODEC.encode(dict(request_data, stream=True))
+        replies = await self._on_all_shards(
+            lambda shard: self._shard_request(shard, msg_bytes, streamed=True))
+
+        for _, end in replies:
+            if not end["OK"]:
+                return Message(end)
+
+        return [records for records, _ in replies]
+
+    def _listing_reply(self,
+                       request_data: Dict[str, Any],
+                       appointments: List[Appointment],
+                       limit: Optional[int] = None) -> Message:
+        """
+        Returns the reply listing the appointments like `RequestHandler._list_appointments`.
+        """
+
+        reply = {"OK": True, "text": "", "request_id": request_data.get("request_id")}
+        if limit is not None and len(appointments) == limit:
+            reply["cursor"] = appointments[-1]
+
+        if request_data.get("stream"):
+            return StreamMessage(reply, iter(appointments))
+
+        reply["text"] = "\n".join(map(str, appointments))
+        return Message(reply)
+
+    def _listing_order(self, appointment: Appointment) -> Tuple[int, Any]:
+        return (self._positions.get(appointment.service_provider(), len(self._positions)),
+                appointment.time_slot())
+
+    def _shard_of_appointment(self, appointment: Any) -> int:
+        # Invalid appointments are sent to the first shard, which rejects them.
+        if not isinstance(appointment, Appointment):
+            return 0
+
+        return shard_of(appointment.service_provider().name(), len(self._shards))
+
+    async def _forward(self,
+                       shard: int,
+                       request_data: Dict[str, Any],
+                       msg_bytes: Optional[bytes]) -> ShardReply:
+        """
+        Forwards the request to the shard and returns its reply. `msg_bytes` is the
+        request in the binary codec, or None if the client uses another codec.
+        """
+
+        if msg_bytes is None:
+            msg_bytes = BINARY_CODEC.encode(request_data)
+
+        return await self._shard_request(shard, msg_bytes)
+
+    async def _on_all_shards(self, request: Callable[[int], Awaitable[T]]) -> List[T]:
+        return await asyncio.gather(*(request(shard) for shard in range(len(self._shards))))
+
+    async def _shard_request(self, shard: int, msg_bytes: bytes, streamed: bool = False) -> Any:
+        connections = self._shards[shard]
+        connection = connections[next(self._connection_counter) % len(connections)]
+        return await connection.request(msg_bytes, streamed)
+
+    @staticmethod
+    def _reply_message(request_id: Any, ok: bool, text: str) -> Message:
+        return Message({"OK": ok, "text": text, "request_id": request_id})
+
+def _serve_shard(index: int,
+                 service_provider_db: Dict[ServiceProvider, List[TimeSlotInfo]],
+                 slot_store_type: Type[SlotStore],
+                 data_dir: Optional[str],
+                 address_queue: Any,
+                 router_alive: Any,
+                 router_alive_sender: Any) -> None:
+    """
+    Runs a shard in the current process, putting its index and address into `address_queue`. It
+    stops when the router process exits and the `router_alive` pipe is closed.
+    """
+
+    # Only the router may keep the pipe open.
+    router_alive_sender.close()
+
+    server_state = ServerState(slot_store_type)
+    server_state.service_provider_db = service_provider_db
+    if data_dir is not None:
+        mutation_log = MutationLog(os.path.join(data_dir, "shard-{}".format(index)))
+        mutation_log.recover(server_state)
+        server_state.mutation_log = mutation_log
+
+    async def serve() -> None:
+        server = ShardServer(0, server_state)
+        await server.start()
+        address_queue.put((index, server.address()))
+
+        serve_task = asyncio.ensure_future(server.serve_forever())
+        asyncio.get_running_loop().add_reader(router_alive.fileno(), serve_task.cancel)
+        try:
+            await serve_task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server_state.mutation_log is not None:
+            server_state.mutation_log.close()
+
+def _check_shard_count(data_dir: str, shards: int) -> None:
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, SHARD_COUNT_FILE)
+    if not os.path.exists(path):
+        with open(path, "w") as shard_count_file:
+            shard_count_file.write("{}\n".format(shards))
+        return
+
+    with open(path) as shard_count_file:
+        logged_shards = int(shard_count_file.read())
+    if logged_shards != shards:
+        raise ValueError("The data directory {} was written by {} shards, not {}."
+                         .format(data_dir, logged_shards, shards))
+
+def serve_sharded(server_state: ServerState,
+                  host: str,
+                  port: int,
+                  shards: int,
+                  data_dir: Optional[str] = None,
+                  address_queue: Any = None) -> None:
+    """
+    Serves the state with a router listening on `host` and `port` and `shards` shard processes,
+    until interrupted. The time slots of the state are moved to the shards.
+
+    Args:
+        data_dir: If given, every shard recovers its time slots from its mutation log in a
+            subdirectory of it, and logs its mutations there.
+        address_queue: If given, the address of the router is put into it when it listens.
+    """
+
+    if shards <= 0:
+        raise ValueError("There must be at least one shard.")
+    if data_dir is not None:
+        _check_shard_count(data_dir, shards)
+
+    providers = list(server_state.service_provider_db.keys())
+    partitions = partition_service_providers(server_state.service_provider_db, shards)
+    slot_store_type = type(server_state.slot_store)
+    server_state.service_provider_db = dict()
+
+    shard_address_queue = multiprocessing.Queue()
+    router_alive, router_alive_sender = multiprocessing.Pipe(duplex=False)
+    processes = [multiprocessing.Process(target=_serve_shard,
+                                         args=(index, partition, slot_store_type, data_dir,
+                                               shard_address_queue, router_alive,
+                                               router_alive_sender),
+                                         daemon=True)
+                 for index, partition in enumerate(partitions)]
+    del partitions
+
+    try:
+        for process in processes:
+            process.start()
+
+        shard_addresses: Dict[int, Tuple[str, int]] = dict()
+        while len(shard_addresses) < shards:
+            try:
+                index, address = shard_address_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in processes):
+                    raise RuntimeError("A shard failed to start.")
+                continue
+            shard_addresses[index] = tuple(address)
+
+        router = ShardRouter(host, port, server_state, providers,
+                             [shard_addresses[index] for index in range(shards)])
+
+        async def serve() -> None:
+            await router.start()
+            if address_queue is not None:
+                address_queue.put(router.address())
+            try:
+                await router.serve_forever()
+            finally:
+                await router.close()
+
+        asyncio.run(serve())
+    finally:
+        # The shards stop when the pipe is closed.
+        router_alive_sender.close()
+        for process in processes:
+            if process.pid is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+def server_main(columnar: bool = False, durable: bool = False, shards: Optional[int] = None):
+    """
+    Server main loop. By default there is a shard per CPU.
+    """
+
+    print("Entering sharded server!")
+    HOST = "0.0.0.0"
+    PORT = 9998
+
+    server_state = load_server_state(columnar)
+    try:
+        serve_sharded(server_state, HOST, PORT, shards or os.cpu_count() or 1,
+                      DATA_DIR if durable else None)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,115 @@
+"""
+This module contains the subscriptions of connections to the changes of the time slots of service
+providers.
+"""
+
+import threading
+
+from typing import Any, Dict, FrozenSet, Iterable, Set
+
+from bc.common.comm_util import Codec
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.server_util import SlotChanges, TimeSlotState
+
+# The most service providers a connection may subscribe to.
+MAX_SUBSCRIPTIONS = 1000
+
+class Subscriber:
+    """
+    A connection subscribed to changes. The engines implement `push`, which sends an encoded
+    event message on the connection. It must not block, as it is called while the transitions
+    are serialized; a subscriber that cannot keep up should be dropped instead.
+    """
+
+    def __init__(self, codec: Codec) -> None:
+        self.codec = codec
+
+    def push(self, message: bytes) -> None:
+        """
+        Sends an event message encoded with `codec`.
+        """
+
+        raise NotImplementedError()
+
+class SubscriptionHub:
+    """
+    The subscribers of the service providers. `publish` makes the event message of a provider
+    once, encodes it once per codec, and pushes the same bytes to every subscriber of the
+    provider, so the fan-out only costs a `push` per subscriber. The hub is thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: Dict[ServiceProvider, Set[Subscriber]] = dict()
+        self._providers: Dict[Subscriber, FrozenSet[ServiceProvider]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+    def subscribe(self, subscriber: Subscriber, providers: Iterable[ServiceProvider]) -> None:
+        """
+        Subscribes the subscriber to the changes of the given providers, replacing its earlier
+        subscriptions.
+        """
+
+        new = frozenset(providers)
+        with self._lock:
+            old = self._providers.pop(subscriber, frozenset())
+            for provider in old - new:
+                subscribers = self._subscribers[provider]
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[provider]
+
+            for provider in new - old:
+                self._subscribers.setdefault(provider, set()).add(subscriber)
+
+            if new:
+                self._providers[subscriber] = new
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """
+        Ends the subscriptions of the subscriber.
+        """
+
+        self.subscribe(subscriber, ())
+
+    def subscriber_count(self, provider: ServiceProvider) -> int:
+        """
+        Returns the number of the subscribers of the provider.
+        """
+
+        with self._lock:
+            return len(self._subscribers.get(provider, ()))
+
+    def publish(self, changes: SlotChanges) -> None:
+        """
+        Pushes the changes to the subscribers of the changed providers.
+        """
+
+        for provider, states in changes.items():
+            with self._lock:
+                subscribers = list(self._subscribers.get(provider, ()))
+            if not subscribers:
+                continue
+
+            message = event_message(provider, states)
+            encoded: Dict[Codec, bytes] = dict()
+            for subscriber in subscribers:
+                data = encoded.get(subscriber.codec)
+                if data is None:
+                    data = encoded[subscriber.codec] = subscriber.codec.encode(message)
+                subscriber.push(data)
+
+def event_message(provider: ServiceProvider,
+                  states: Dict[TimeSlot, TimeSlotState]) -> Dict[str, Any]:
+    """
+    Returns the event message of the changes of a provider, see
+    `RequestGenerator.msg_subscribe`.
+    """
+
+    events: Dict[str, Any] = dict()
+    for time_slot, state in sorted(states.items(), key=lambda item: item[0]):
+        events.setdefault(state.name.lower(), []).append(time_slot)
+
+    return {"service_provider": provider, "events": events}
@@ -0,0 +1,174 @@
+# pylint: disable=missing-docstring
+
+import asyncio
+import queue
+import threading
+import unittest
+
+from bc.client.async_client import AsyncClient, BlockingClient, ConnectionPool, RequestError
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.async_server import AsyncServer
+from bc.server.server import ConnectionHandler, Server
+from bc.test.test_server.test_async_server import make_state
+
+HAAKON = ServiceProvider("Haakon Doctorsen")
+
+def appointment(hour: int) -> Appointment:
+    return Appointment(HAAKON, TimeSlot(2019, 2, 20, hour))
+
+class TestAsyncClient(unittest.TestCase):
+    def run_with_server(self, test):
+        async def run():
+            server = AsyncServer("127.0.0.1", 0, make_state())
+            await server.start()
+            try:
+                async with ConnectionPool(*server.address(), size=4) as pool:
+                    return await asyncio.wait_for(test(pool), 10)
+            finally:
+                await server.close()
+
+        return asyncio.run(run())
+
+    def test_concurrent_clients_share_the_pool(self):
+        async def test(pool):
+            clients = [AsyncClient(pool) for _ in range(50)]
+            ids = await asyncio.gather(*(client.login("User{}".format(i), "pwd{}".format(i))
+                                         for i, client in enumerate(clients, 1)))
+            self.assertEqual(list(range(1, 51)), ids)
+            self.assertEqual(4, len(pool))
+
+            # Every client tries to take the same slot; exactly one gets it.
+            results = await asyncio.gather(
+                *(client.add_appointment_to_basket(appointment(15)) for client in clients),
+                return_exceptions=True)
+            winners = [client for client, result in zip(clients, results) if result is None]
+            self.assertEqual(1, len(winners))
+            self.assertTrue(all(isinstance(result, RequestError) for result in results
+                                if result is not None))
+
+            await winners[0].confirm_booking()
+            booked = await winners[0].list_booked_appointments()
+            self.assertEqual([str(appointment(15))], list(map(str, booked)))
+
+            available = await clients[0].list_available_appointments("Haakon Doctorsen", limit=1)
+            self.assertEqual([str(appointment(17))], list(map(str, available)))
+            self.assertEqual([], await clients[0].list_available_appointments(
+                "Haakon Doctorsen", limit=1, cursor=available[-1]))
+
+        self.run_with_server(test)
+
+    def test_errors(self):
+        async def test(pool):
+            client = AsyncClient(pool)
+            with self.assertRaises(RuntimeError):
+                await client.list_basket()
+            with self.assertRaises(RequestError) as context:
+                await client.login("User1", "wrong")
+            self.assertEqual("Invalid username or password.", str(context.exception))
+
+            await client.login("User1", "pwd1")
+            with self.assertRaises(RequestError) as context:
+                await client.add_appointments_to_basket([appointment(15), appointment(16)])
+            self.assertEqual(str(appointment(16)),
+                             str(context.exception.reply["appointment"]))
+            self.assertEqual([], await client.list_basket())
+
+            self.assertEqual({"ok": 1}, (await client.stats())["requests"]["LIST_BASKET"])
+
+        self.run_with_server(test)
+
+    def test_lost_connections_are_replaced(self):
+        async def test(pool):
+            client = AsyncClient(pool)
+            await client.login("User1", "pwd1")
+            for connection in pool._connections:
+                connection._writer.transport.abort()
+            await asyncio.sleep(0.1)
+
+            self.assertEqual([], await client.list_basket())
+            self.assertEqual(1, len(pool))
+
+        self.run_with_server(test)
+
+    def test_subscriptions(self):
+        async def test(pool):
+            subscriber, other = AsyncClient(pool), AsyncClient(pool)
+            await subscriber.login("User1", "pwd1")
+            await other.login("User2", "pwd2")
+
+            events: asyncio.Queue = asyncio.Queue()
+            await subscriber.subscribe(["Haakon Doctorsen"],
+                                       lambda provider, event: events.put_nowait(event))
+            with self.assertRaises(RequestError):
+                await subscriber.subscribe(["Nobody"], lambda provider, event: None)
+
+            # A streamed listing on the connection of the subscriptions is not disturbed.
+            await other.add_appointment_to_basket(appointment(15))
+            self.assertEqual([str(appointment(15))], list(map(str, await other.list_basket())))
+            await other.remove_appointment_from_basket(appointment(15))
+
+            self.assertEqual(["2019-2-20-15"], list(map(str, (await events.get())["in_basket"])))
+            self.assertEqual(["2019-2-20-15"], list(map(str, (await events.get())["available"])))
+
+            await subscriber.unsubscribe()
+            await other.add_appointment_to_basket(appointment(17))
+            await asyncio.sleep(0.1)
+            self.assertTrue(events.empty())
+
+        self.run_with_server(test)
+
+    def test_connection_errors(self):
+        async def test():
+            async with ConnectionPool("127.0.0.1", 1) as pool:
+                with self.assertRaises(ConnectionError):
+                    await AsyncClient(pool).login("User1", "pwd1")
+
+        asyncio.run(test())
+
+class TestBlockingClient(unittest.TestCase):
+    def test_blocking_client(self):
+        server = Server(("127.0.0.1", 0), ConnectionHandler, server_state=make_state())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with BlockingClient(*server.server_address) as client:
+                self.assertEqual(1, client.login("User1", "pwd1"))
+                client.add_appointments_to_basket([appointment(15), appointment(17)])
+                self.assertEqual([str(appointment(15)), str(appointment(17))],
+                                 list(map(str, client.list_basket())))
+                client.remove_appointment_from_basket(appointment(15))
+                client.confirm_booking()
+                client.cancel_appointment(appointment(17))
+                self.assertEqual([], client.list_booked_appointments())
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_blocking_subscriptions(self):
+        server = Server(("127.0.0.1", 0), ConnectionHandler, server_state=make_state())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with BlockingClient(*server.server_address) as subscriber, \
+                    BlockingClient(*server.server_address) as other:
+                subscriber.login("User1", "pwd1")
+                other.login("User2", "pwd2")
+
+                events: queue.Queue = queue.Queue()
+                subscriber.subscribe(["Haakon Doctorsen"],
+                                     lambda provider, event: events.put((provider, event)))
+                other.add_appointments_to_basket([appointment(15), appointment(17)])
+                other.confirm_booking()
+
+                provider, event = events.get(timeout=10)
+                self.assertEqual("Haakon Doctorsen", provider.name())
+                self.assertEqual(["2019-2-20-15", "2019-2-20-17"],
+                                 list(map(str, event["in_basket"])))
+                _, event = events.get(timeout=10)
+                self.assertEqual(["2019-2-20-15", "2019-2-20-17"],
+                                 list(map(str, event["reserved"])))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
@@ -0,0 +1,24 @@
+# pylint: disable=missing-docstring
+
+import contextlib
+import io
+import unittest
+
+from unittest import mock
+
+from bc.client.client import Client
+from bc.common.entities import TimeSlot
+
+class TestClient(unittest.TestCase):
+    def test_invalid_time_slots_are_prompted_again(self):
+        answers = ["2024-02-30-10", "2024-13-01-00", "2024-02", "2024-02-20-10"]
+        output = io.StringIO()
+        with mock.patch("builtins.input", side_effect=answers), \
+             contextlib.redirect_stdout(output):
+            time_slot = Client.time_slot_prompt_or_empty("from")
+
+        self.assertEqual(TimeSlot(2024, 2, 20, 10), time_slot)
+        self.assertEqual(3, output.getvalue().count("Invalid time slot."))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# pylint: disable=missing-docstring
+
+import threading
+import unittest
+
+from bc.client.session import Session
+from bc.common.comm_util import PICKLE_CODEC, RequestGenerator
+from bc.server.server import ConnectionHandler, Server
+from bc.test.test_server.test_async_server import make_state
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), ConnectionHandler, server_state=make_state())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_pipelined_requests_are_matched_by_request_id(self):
+        with Session(*self.server.server_address) as session:
+            reply = session.request(RequestGenerator.msg_login("User1", "pwd1"), timeout=5)
+            req_gen = RequestGenerator.from_login_reply(reply)
+
+            requests = [req_gen.msg_list_basket(),
+                        req_gen.msg_list_available_appointments("Haakon Doctorsen"),
+                        req_gen.msg_list_available_appointments("Nobody")]
+            futures = [session.send(request) for request in requests]
+            replies = [future.result(5).data() for future in futures]
+
+        for request, reply in zip(requests, replies):
+            self.assertEqual(request.data()["request_id"], reply["request_id"])
+        self.assertEqual("", replies[0]["text"])
+        self.assertEqual(2, len(replies[1]["text"].split("\n")))
+        self.assertEqual("", replies[2]["text"])
+
+    def test_streamed_listing(self):
+        with Session(*self.server.server_address) as session:
+            reply = session.request(RequestGenerator.msg_login("User1", "pwd1"), timeout=5)
+            req_gen = RequestGenerator.from_login_reply(reply, stream_listings=True)
+
+            chunks = []
+            reply = session.request(req_gen.msg_list_available_appointments(None), timeout=5,
+                                    on_chunk=chunks.append)
+
+        self.assertTrue(reply.data()["end_of_stream"])
+        records = [str(record) for chunk in chunks for record in chunk.data()["chunk"]]
+        self.assertEqual(["Haakon Doctorsen:\t2019-2-20-15", "Haakon Doctorsen:\t2019-2-20-17"],
+                         records)
+
+    def test_delimited_pickle_session(self):
+        with Session(*self.server.server_address, codec=PICKLE_CODEC,
+                     length_prefixed=False) as session:
+            reply = session.request(RequestGenerator.msg_login("User1", "pwd1"), timeout=5)
+            self.assertTrue(reply.data()["OK"])
+
+    def test_sessions_are_served_concurrently(self):
+        with Session(*self.server.server_address) as idle_session:
+            with Session(*self.server.server_address) as session:
+                reply = session.request(RequestGenerator.msg_login("User2", "pwd2"), timeout=5)
+                self.assertTrue(reply.data()["OK"])
+
+            reply = idle_session.request(RequestGenerator.msg_login("User1", "pwd1"), timeout=5)
+            self.assertTrue(reply.data()["OK"])
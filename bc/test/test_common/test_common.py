@@ -1,9 +1,13 @@
 # pylint: disable=missing-docstring
 
+import pickle
 import unittest
 import socket
 
 import bc.common.comm_util
+from bc.common.comm_util import (BINARY_CODEC, detect_codec, LengthPrefixedTransceiver, Message,
+                                 PICKLE_CODEC, PreencodedMessage, RequestGenerator)
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
 
 class TestCommunication(unittest.TestCase):
     def test_receive_with_delimiter(self):
@@ -26,3 +30,100 @@ class TestCommunication(unittest.TestCase):
         finally:
             socket1.close()
             socket2.close()
+
+    def test_receive_raises_on_closed_connection(self):
+        socket1, socket2 = socket.socketpair()
+        try:
+            socket1.send(b'Incomplete')
+            socket1.close()
+
+            receiver = bc.common.comm_util.Transceiver(socket2)
+            with self.assertRaises(EOFError):
+                receiver.receive()
+        finally:
+            socket2.close()
+
+class TestCodecs(unittest.TestCase):
+    def setUp(self):
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        req_gen = RequestGenerator(1234)
+        self.messages = [
+            RequestGenerator.msg_login("User1", "pwd1"),
+            req_gen.msg_list_available_appointments(None),
+            req_gen.msg_list_available_appointments("Knud Tennistrenersen"),
+            req_gen.msg_add_appointment_to_basket(appointment),
+            req_gen.msg_confirm_booking(),
+            req_gen.msg_add_appointments_to_basket([appointment, appointment]),
+            Message({"OK": False, "text": "Ünicode\n", "request_id": -1, "other": [1, None]}),
+            ]
+
+    def test_round_trip(self):
+        for codec in (PICKLE_CODEC, BINARY_CODEC):
+            for message in self.messages:
+                data = message.to_bytes(codec)
+                self.assertNotIn(b'\xff', data)
+                self.assertIs(codec, detect_codec(data))
+
+                decoded = Message.from_bytes(data).data()
+                self.assertEqual(repr(message.data()), repr(decoded))
+
+    def test_binary_codec_is_more_compact(self):
+        for message in self.messages:
+            self.assertLess(len(message.to_bytes(BINARY_CODEC)),
+                            len(message.to_bytes(PICKLE_CODEC)))
+
+    def test_pickle_codec_rejects_other_globals(self):
+        data = pickle.dumps(Exception("Not a message"), protocol=0)
+        with self.assertRaises(ValueError):
+            PICKLE_CODEC.decode(data)
+
+    def test_binary_codec_rejects_malformed_input(self):
+        data = self.messages[3].to_bytes(BINARY_CODEC)
+        for malformed in (data[:-1], data + b'\x00', data[:2] + b'\x42', data[:2] + b'\x05\xfe'):
+            with self.assertRaises(ValueError):
+                BINARY_CODEC.decode(malformed)
+
+    def test_preencoded_message_copies(self):
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        message = PreencodedMessage({"OK": True, "text": "Ünicode", "cursor": appointment})
+
+        for request_id in (7, -1, 1 << 40):
+            copy = message.copy()
+            copy.data()["request_id"] = request_id
+            for codec in (PICKLE_CODEC, BINARY_CODEC):
+                # The items may come in another order.
+                decoded = Message.from_bytes(copy.to_bytes(codec)).data()
+                self.assertEqual(repr(sorted(copy.data().items())), repr(sorted(decoded.items())))
+
+        self.assertNotIn("request_id", message.data())
+
+class TestLengthPrefixedTransceiver(unittest.TestCase):
+    def test_receive_split_and_large_frames(self):
+        socket1, socket2 = socket.socketpair()
+        try:
+            sender = LengthPrefixedTransceiver(socket1)
+            receiver = LengthPrefixedTransceiver(socket2, buffer_size=16)
+
+            small = b'\xff\x00 may contain the delimiter'
+            large = bytes(range(256)) * 100
+            sender.send(small)
+            sender.send(large)
+            sender.send(b'')
+
+            self.assertEqual(small, receiver.receive())
+            self.assertEqual(large, receiver.receive())
+            self.assertEqual(b'', receiver.receive())
+        finally:
+            socket1.close()
+            socket2.close()
+
+    def test_max_frame_size(self):
+        socket1, socket2 = socket.socketpair()
+        try:
+            LengthPrefixedTransceiver(socket1).send(b'x' * 101)
+            receiver = LengthPrefixedTransceiver(socket2, max_frame_size=100)
+            with self.assertRaises(ValueError):
+                receiver.receive()
+        finally:
+            socket1.close()
+            socket2.close()
@@ -0,0 +1,64 @@
+# pylint: disable=missing-docstring
+
+import copy
+import pickle
+import unittest
+
+from bc.common.comm_util import BINARY_CODEC, PICKLE_CODEC
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+
+# An appointment pickled by the earlier `__dict__` based entities.
+LEGACY_PICKLE = (
+    b'ccopy_reg\n_reconstructor\np0\n(cbc.common.entities\nAppointment\np1\nc__builtin__\n'
+    b'object\np2\nNtp3\nRp4\n(dp5\nV_service_provider\np6\ng0\n(cbc.common.entities\n'
+    b'ServiceProvider\np7\ng2\nNtp8\nRp9\n(dp10\nV_name\np11\nVHaakon\np12\nsbsV_time_slot\n'
+    b'p13\ng0\n(cbc.common.entities\nTimeSlot\np14\ng2\nNtp15\nRp16\n(dp17\nV_year\np18\nI2019\n'
+    b'sV_month\np19\nI2\nsV_day\np20\nI20\nsV_hour\np21\nI15\nsbsb.')
+
+class TestEntities(unittest.TestCase):
+    def test_time_slots_compare_by_ordinal(self):
+        time_slots = [TimeSlot(2019, 12, 31, 24), TimeSlot(2019, 2, 20, 15),
+                      TimeSlot(2020, 1, 0, 0), TimeSlot(2019, 2, 20, 17)]
+        self.assertEqual(sorted(time_slots, key=lambda ts: (ts.year(), ts.month(), ts.day(),
+                                                            ts.hour())),
+                         sorted(time_slots))
+        self.assertEqual(["2019-12-31-24", "2020-1-0-0"], list(map(str, sorted(time_slots)[2:])))
+
+        for time_slot in time_slots:
+            self.assertEqual(time_slot, TimeSlot.from_ordinal(time_slot.ordinal()))
+            self.assertEqual(time_slot, TimeSlot(time_slot.year(), time_slot.month(),
+                                                 time_slot.day(), time_slot.hour()))
+
+        self.assertNotEqual(TimeSlot(2019, 2, 20, 15), "2019-2-20-15")
+        with self.assertRaises(ValueError):
+            TimeSlot(2019, 13, 1, 0)
+
+    def test_entities_are_hashable_and_immutable(self):
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        same = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        other = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 17))
+        self.assertEqual(appointment, same)
+        self.assertEqual({appointment, other}, {same, other})
+
+        for entity in (appointment, appointment.service_provider(), appointment.time_slot()):
+            with self.assertRaises(AttributeError):
+                entity.attribute = 1
+            with self.assertRaises(AttributeError):
+                del entity.__slots__
+
+    def test_names_are_interned(self):
+        name = "".join(["Haakon ", "Doctorsen"])
+        provider = ServiceProvider("Haakon Doctorsen")
+        self.assertIs(provider.name(), ServiceProvider(name).name())
+
+        decoded = BINARY_CODEC.decode(BINARY_CODEC.encode({"provider": ServiceProvider(name)}))
+        self.assertIs(provider.name(), decoded["provider"].name())
+
+    def test_pickles_are_compatible(self):
+        appointment = Appointment(ServiceProvider("Haakon"), TimeSlot(2019, 2, 20, 15))
+        self.assertEqual(LEGACY_PICKLE, pickle.dumps(appointment, protocol=0))
+        self.assertEqual(appointment, PICKLE_CODEC.decode(LEGACY_PICKLE))
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(appointment, pickle.loads(pickle.dumps(appointment, protocol)))
+        self.assertEqual(appointment, copy.deepcopy(appointment))
@@ -0,0 +1,57 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.common.comm_util import RequestType
+from bc.server.admission import PendingRequests, RateLimit, RateLimiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter({None: RateLimit(10.0, 3.0),
+                                    RequestType.ADD_APPOINTMENT_TO_BASKET: RateLimit(1.0, 2.0)},
+                                   clock=self.clock)
+
+    def test_bursts_are_limited(self):
+        add = RequestType.ADD_APPOINTMENT_TO_BASKET
+        self.assertEqual([0.0, 0.0], [self.limiter.check(1, add) for _ in range(2)])
+        self.assertAlmostEqual(1.0, self.limiter.check(1, add))
+
+        # The rejected request took no token of all requests.
+        self.assertEqual(0.0, self.limiter.check(1, RequestType.LIST_BASKET))
+        self.assertAlmostEqual(0.1, self.limiter.check(1, RequestType.LIST_BASKET))
+
+        # Other clients have buckets of their own.
+        self.assertEqual(0.0, self.limiter.check(2, add))
+
+        self.clock.now = 0.5
+        self.assertAlmostEqual(0.5, self.limiter.check(1, add))
+        self.assertEqual(0.0, self.limiter.check(1, RequestType.LIST_BASKET))
+        self.clock.now = 1.0
+        self.assertEqual(0.0, self.limiter.check(1, add))
+
+    def test_buckets_are_bounded(self):
+        self.limiter.max_buckets = 4
+        for client in range(10):
+            self.limiter.check(client, RequestType.ADD_APPOINTMENT_TO_BASKET)
+        self.assertEqual(4, len(self.limiter))
+
+    def test_no_limits(self):
+        limiter = RateLimiter(dict())
+        self.assertEqual(0.0, max(limiter.check(1, RequestType.LIST_BASKET) for _ in range(100)))
+        self.assertEqual(0, len(limiter))
+
+class TestPendingRequests(unittest.TestCase):
+    def test_pending_requests_are_bounded(self):
+        pending = PendingRequests(2)
+        self.assertEqual([True, True, False], [pending.enter() for _ in range(3)])
+        pending.leave()
+        self.assertEqual(1, len(pending))
+        self.assertTrue(pending.enter())
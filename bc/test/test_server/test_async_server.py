@@ -0,0 +1,81 @@
+# pylint: disable=missing-docstring
+
+import asyncio
+import unittest
+
+from bc.common.comm_util import Message, RequestGenerator
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.async_server import AsyncServer
+from bc.server.credentials import hash_password
+from bc.server.server_util import ServerState, TimeSlotInfo, TimeSlotState, User
+
+DELIMITER = b'\xff'
+
+def make_state() -> ServerState:
+    state = ServerState()
+    state.service_provider_db = {
+        ServiceProvider("Haakon Doctorsen"): [
+            TimeSlotInfo(TimeSlot(2019, 2, 20, 15), TimeSlotState.AVAILABLE, 0),
+            TimeSlotInfo(TimeSlot(2019, 2, 20, 17), TimeSlotState.AVAILABLE, 0)]
+        }
+    state.users = [User(i, "User{}".format(i), hash_password("pwd{}".format(i), log2_n=4))
+                   for i in range(1, 51)]
+    return state
+
+async def send_request(address, request: Message) -> Message:
+    reader, writer = await asyncio.open_connection(*address)
+    try:
+        writer.write(request.to_bytes() + DELIMITER)
+        reply = await reader.readuntil(DELIMITER)
+        return Message.from_bytes(reply[:-len(DELIMITER)])
+    finally:
+        writer.close()
+
+async def login(address, user_index: int) -> RequestGenerator:
+    request = RequestGenerator.msg_login("User{}".format(user_index), "pwd{}".format(user_index))
+    reply = await send_request(address, request)
+    return RequestGenerator.from_login_reply(reply)
+
+class TestAsyncServer(unittest.TestCase):
+    def test_stalled_client_does_not_block_others(self):
+        async def run():
+            server = AsyncServer("127.0.0.1", 0, make_state())
+            await server.start()
+            address = server.address()
+            try:
+                # This connection never sends a complete request.
+                _, stalled_writer = await asyncio.open_connection(*address)
+                stalled_writer.write(b'(dp0')
+
+                req_gen = await asyncio.wait_for(login(address, 1), 5)
+                reply = await asyncio.wait_for(
+                    send_request(address, req_gen.msg_list_available_appointments(None)), 5)
+                stalled_writer.close()
+                return reply.data()
+            finally:
+                await server.close()
+
+        reply = asyncio.run(run())
+        self.assertTrue(reply["OK"])
+        self.assertEqual(2, len(reply["text"].split("\n")))
+
+    def test_concurrent_clients_get_consistent_state(self):
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+
+        async def add_to_basket(address, user_index):
+            req_gen = await login(address, user_index)
+            request = req_gen.msg_add_appointment_to_basket(appointment)
+            reply = await send_request(address, request)
+            return reply.data()["OK"]
+
+        async def run():
+            server = AsyncServer("127.0.0.1", 0, make_state())
+            await server.start()
+            try:
+                return await asyncio.gather(*(add_to_basket(server.address(), i)
+                                              for i in range(1, 51)))
+            finally:
+                await server.close()
+
+        results = asyncio.run(run())
+        self.assertEqual(1, results.count(True))
@@ -0,0 +1,103 @@
+# pylint: disable=missing-docstring
+
+import os
+import tempfile
+import unittest
+
+try:
+    import numpy
+    from bc.server.bulk_load import (build_slot_store, convert, load_slot_store,
+                                     parse_service_providers, read_provider_file)
+    from bc.server.columnar import ColumnarSlotStore, pack_time_slot
+except ImportError:
+    numpy = None
+
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.server_util import ObjectSlotStore, ServerState, TimeSlotState
+
+TEXT = """Haakon Doctorsen;2019-02-20-17;2019-02-20-15;2019-02-20-17
+Knud Tennistrenersen;2019-02-25-15;2019-02-25-17;2019-02-25-19
+
+Nobody
+"""
+
+@unittest.skipUnless(numpy, "NumPy is not installed.")
+class TestBulkLoad(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.text_file = os.path.join(directory.name, "service_providers.txt")
+        self.binary_file = os.path.join(directory.name, "service_providers.bin")
+
+        with open(self.text_file, "w") as text_file:
+            text_file.write(TEXT)
+
+    def write_text(self, text: str) -> None:
+        with open(self.text_file, "w") as text_file:
+            text_file.write(text)
+
+    def test_parse_sorts_and_drops_duplicates(self):
+        columns = parse_service_providers(self.text_file)
+        self.assertEqual(["Haakon Doctorsen", "Knud Tennistrenersen", "Nobody"],
+                         [provider.name() for provider in columns.providers])
+        self.assertEqual([2, 3, 0], list(columns.counts))
+        self.assertEqual(pack_time_slot(TimeSlot(2019, 2, 20, 15)), columns.times[0])
+        self.assertEqual(pack_time_slot(TimeSlot(2019, 2, 20, 17)), columns.times[1])
+
+    def test_invalid_time_slot_is_rejected(self):
+        self.write_text("Haakon Doctorsen;2019-02-20-15;2019-02-30-15\n")
+        with self.assertRaisesRegex(ValueError, "2019-2-30-15 of Haakon Doctorsen"):
+            parse_service_providers(self.text_file)
+
+        self.write_text("Haakon Doctorsen;2019-02-20\n")
+        with self.assertRaises(ValueError):
+            parse_service_providers(self.text_file)
+
+        # The fields of the slots add up to a multiple of four, but the slots are misaligned.
+        self.write_text("Haakon Doctorsen;2019-02-20;15-2019-02-20-17\n")
+        with self.assertRaisesRegex(ValueError, "2019-02-20 in the record of Haakon Doctorsen"):
+            parse_service_providers(self.text_file)
+
+    def test_binary_round_trip(self):
+        convert(self.text_file, self.binary_file)
+        columns = read_provider_file(self.binary_file)
+        expected = parse_service_providers(self.text_file)
+
+        self.assertEqual(expected.providers, columns.providers)
+        self.assertEqual(list(expected.counts), list(columns.counts))
+        self.assertEqual(list(expected.times), list(columns.times))
+
+    def test_corrupt_binary_file_is_rejected(self):
+        convert(self.text_file, self.binary_file)
+        with open(self.binary_file, "r+b") as binary_file:
+            binary_file.truncate(os.path.getsize(self.binary_file) - 4)
+
+        with self.assertRaises(ValueError):
+            read_provider_file(self.binary_file)
+
+    def test_stores_match_text_loader(self):
+        expected = ServerState()
+        expected.load_service_providers(self.text_file)
+        convert(self.text_file, self.binary_file)
+
+        for store_type in (ObjectSlotStore, ColumnarSlotStore):
+            for filename in (self.text_file, self.binary_file):
+                store = load_slot_store(filename, store_type)
+                self.assertEqual(
+                    list(map(str, expected.appointments_in_state(TimeSlotState.AVAILABLE))),
+                    list(map(str, store.appointments_in_state(TimeSlotState.AVAILABLE))))
+
+    def test_columnar_store_uses_mapped_times(self):
+        convert(self.text_file, self.binary_file)
+        columns = read_provider_file(self.binary_file)
+        store = build_slot_store(columns, ColumnarSlotStore)
+
+        provider = ServiceProvider("Knud Tennistrenersen")
+        ts_info = store.find_time_slot_info(provider, TimeSlot(2019, 2, 25, 17))
+        store.set_time_slot_state(provider, ts_info, TimeSlotState.RESERVED, 3)
+        self.assertEqual(TimeSlotState.RESERVED,
+                         store.find_time_slot_info(provider, ts_info.time_slot).state)
+        self.assertFalse(columns.times.flags.writeable)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from pathlib import Path
+
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.server_util import MAX_USER_ID, ServerState, TimeSlotState
+from bc.test.test_server.test_server_util import check_snapshot_updates
+
+try:
+    import numpy
+    from bc.server.columnar import (ColumnarSlotStore, pack_time_slot, PackedSlotSnapshot,
+                                    unpack_time_slot)
+except ImportError:
+    numpy = None
+
+@unittest.skipUnless(numpy, "NumPy is not installed.")
+class TestColumnarSlotStore(unittest.TestCase):
+    def setUp(self):
+        filename = Path(__file__).parent / "service_providers.txt"
+        self.state = ServerState(ColumnarSlotStore)
+        self.state.load_service_providers(filename)
+
+        self.expected = ServerState()
+        self.expected.load_service_providers(filename)
+
+    def assert_same_listings(self, owner):
+        for state in TimeSlotState:
+            self.assertEqual(list(map(str, self.expected.appointments_in_state(state))),
+                             list(map(str, self.state.appointments_in_state(state))))
+            self.assertEqual(sorted(map(str, self.expected.appointments_of_owner(owner, state))),
+                             sorted(map(str, self.state.appointments_of_owner(owner, state))))
+
+        self.assertEqual(list(map(str, self.expected.available_appointments())),
+                         list(map(str, self.state.available_appointments())))
+        for state in (TimeSlotState.IN_BASKET, TimeSlotState.RESERVED):
+            self.assertEqual(list(map(str, self.expected.owned_appointments(owner, state))),
+                             list(map(str, self.state.owned_appointments(owner, state))))
+
+    def test_pack_time_slot_keeps_order(self):
+        time_slots = [TimeSlot(2019, 2, 20, 15), TimeSlot(2019, 2, 20, 17),
+                      TimeSlot(2019, 3, 1, 0), TimeSlot(2020, 1, 1, 0)]
+        packed = [pack_time_slot(time_slot) for time_slot in time_slots]
+
+        self.assertEqual(sorted(packed), packed)
+        self.assertEqual(time_slots, [unpack_time_slot(value) for value in packed])
+
+    def test_snapshot_updates_match_sorted_lists(self):
+        class SmallChunks(PackedSlotSnapshot):
+            chunk_size = 4
+
+        check_snapshot_updates(self, lambda version, time_slots: SmallChunks(
+            version, numpy.array(list(map(pack_time_slot, time_slots)), dtype=numpy.int32)))
+
+    def test_load_service_providers(self):
+        self.assertEqual(self.expected.service_provider_db, self.state.service_provider_db)
+
+    def test_transitions_match_object_store(self):
+        provider = ServiceProvider("Knud Tennistrenersen")
+        time_slot = TimeSlot(2019, 2, 25, 17)
+        self.assertIsNone(self.state.find_time_slot_info(provider, TimeSlot(2019, 2, 25, 18)))
+
+        for state, owner in ((TimeSlotState.IN_BASKET, 1),
+                             (TimeSlotState.RESERVED, 1),
+                             (TimeSlotState.AVAILABLE, 0)):
+            for server_state in (self.expected, self.state):
+                ts_info = server_state.find_time_slot_info(provider, time_slot)
+                server_state.set_time_slot_state(provider, ts_info, state, owner)
+
+            self.assertEqual(self.expected.find_time_slot_info(provider, time_slot),
+                             self.state.find_time_slot_info(provider, time_slot))
+            self.assert_same_listings(1)
+
+    def test_large_client_ids(self):
+        provider = ServiceProvider("Knud Tennistrenersen")
+        for owner, hour in ((1 << 31, 15), (MAX_USER_ID, 17)):
+            for server_state in (self.expected, self.state):
+                ts_info = server_state.find_time_slot_info(provider, TimeSlot(2019, 2, 25, hour))
+                server_state.set_time_slot_state(provider, ts_info, TimeSlotState.RESERVED, owner)
+
+            self.assertEqual(owner, self.state.find_time_slot_info(
+                provider, TimeSlot(2019, 2, 25, hour)).owner)
+            self.assert_same_listings(owner)
+
+    def test_time_range_and_pages_match_object_store(self):
+        queries = [
+            dict(time_from=TimeSlot(2019, 2, 20, 16)),
+            dict(time_to=TimeSlot(2019, 2, 25, 17)),
+            dict(provider=ServiceProvider("Knud Tennistrenersen"), limit=2),
+            # Bounds out of the range of `pack_time_slot`.
+            dict(time_from=TimeSlot(-1, 1, 1, 0), time_to=TimeSlot(1 << 16, 1, 1, 0)),
+            dict(time_from=TimeSlot(1 << 16, 1, 1, 0)),
+            ]
+        for kwargs in queries:
+            expected = self.expected.appointments_in_state(TimeSlotState.AVAILABLE, **kwargs)
+            self.assertEqual(list(map(str, expected)),
+                             list(map(str, self.state.appointments_in_state(
+                                 TimeSlotState.AVAILABLE, **kwargs))))
+            self.assertEqual(list(map(str, self.expected.available_appointments(**kwargs))),
+                             list(map(str, self.state.available_appointments(**kwargs))))
+
+        pages = []
+        cursor = None
+        while True:
+            page = list(self.state.appointments_in_state(TimeSlotState.AVAILABLE, after=cursor,
+                                                         limit=2))
+            if not page:
+                break
+            pages.extend(page)
+            cursor = page[-1]
+
+        expected = self.expected.appointments_in_state(TimeSlotState.AVAILABLE)
+        self.assertEqual(list(map(str, expected)), list(map(str, pages)))
+
+        after = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(1 << 16, 1, 1, 0))
+        expected = self.expected.appointments_in_state(TimeSlotState.AVAILABLE, after=after)
+        self.assertEqual(list(map(str, expected)), list(map(str, self.state.appointments_in_state(
+            TimeSlotState.AVAILABLE, after=after))))
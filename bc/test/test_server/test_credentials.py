@@ -0,0 +1,38 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.server.credentials import (dummy_password_hash, hash_password, is_password_hash,
+                                   verify_password)
+from bc.server.server import ServerBase
+from bc.test.test_server.test_async_server import make_state
+
+class TestCredentials(unittest.TestCase):
+    def test_verify(self):
+        password_hash = hash_password("pwd1", log2_n=4)
+        self.assertTrue(is_password_hash(password_hash))
+        self.assertTrue(verify_password("pwd1", password_hash))
+        self.assertFalse(verify_password("pwd2", password_hash))
+
+    def test_hashes_are_salted(self):
+        self.assertNotEqual(hash_password("pwd1", log2_n=4), hash_password("pwd1", log2_n=4))
+
+    def test_malformed_hash_matches_nothing(self):
+        self.assertFalse(is_password_hash("pwd1"))
+        self.assertFalse(verify_password("pwd1", "pwd1"))
+        self.assertFalse(verify_password("pwd1", "scrypt$4$8$1$!!$!!"))
+
+        # Too expensive to be checked.
+        password_hash = hash_password("pwd1", log2_n=4).replace("scrypt$4$", "scrypt$30$")
+        self.assertFalse(verify_password("pwd1", password_hash))
+
+    def test_dummy_hash_is_computed_at_start_up(self):
+        dummy_password_hash.cache_clear()
+        server = ServerBase(make_state())
+        self.addCleanup(server.password_verifier.shutdown)
+
+        self.assertEqual(1, dummy_password_hash.cache_info().currsize)
+        self.assertIs(dummy_password_hash(), server.dummy_password_hash)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.server.expiry import ExpiryQueue
+
+class TestExpiryQueue(unittest.TestCase):
+    def test_pop_expired_in_deadline_order(self):
+        queue = ExpiryQueue()
+        queue.schedule("b", 2.0)
+        queue.schedule("a", 1.0)
+        queue.schedule("c", 3.0)
+
+        self.assertEqual(1.0, queue.next_deadline())
+        self.assertEqual(["a", "b"], queue.pop_expired(2.0))
+        self.assertEqual([], queue.pop_expired(2.5))
+        self.assertEqual(1, len(queue))
+        self.assertEqual("c", queue.pop())
+        self.assertIsNone(queue.next_deadline())
+
+    def test_reschedule_and_cancel(self):
+        queue = ExpiryQueue()
+        queue.schedule("a", 1.0)
+        queue.schedule("b", 2.0)
+        queue.schedule("a", 3.0)
+        self.assertTrue(queue.cancel("b"))
+        self.assertFalse(queue.cancel("b"))
+
+        self.assertEqual(3.0, queue.deadline("a"))
+        self.assertEqual([], queue.pop_expired(2.0))
+        self.assertEqual(["a"], queue.pop_expired(3.0))
+
+    def test_limit(self):
+        queue = ExpiryQueue()
+        for i in range(5):
+            queue.schedule(i, float(i))
+
+        self.assertEqual([0, 1], queue.pop_expired(10.0, limit=2))
+        self.assertEqual([2, 3, 4], queue.pop_expired(10.0))
+
+    def test_removed_entries_do_not_accumulate(self):
+        queue = ExpiryQueue()
+        for i in range(10000):
+            queue.schedule("a", float(i))
+
+        self.assertLess(len(queue._heap), 100)
+        self.assertEqual(["a"], queue.pop_expired(10000.0))
+
+if __name__ == '__main__':
+    unittest.main()
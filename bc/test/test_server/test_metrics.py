@@ -0,0 +1,38 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.common.comm_util import RequestType
+from bc.server.metrics import Histogram, Outcome, RequestMetrics
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets(self):
+        histogram = Histogram((10, 100))
+        for value in (5, 10, 11, 100, 1000):
+            histogram.observe(value)
+
+        self.assertEqual([2, 2, 1], histogram.counts)
+        self.assertEqual([2, 4, 5], histogram.cumulative_counts())
+        self.assertEqual((5, 1126), (histogram.count, histogram.total))
+
+    def test_request_metrics(self):
+        metrics = RequestMetrics(bounds=(1000,))
+        metrics.record(RequestType.LOGIN, Outcome.OK, 500)
+        metrics.record(RequestType.LOGIN, Outcome.FAILED, 1500)
+        metrics.record(None, Outcome.INVALID, 10)
+        metrics.record("garbage", Outcome.INVALID, 10)
+
+        stats = metrics.stats()
+        self.assertEqual({"LOGIN": {"ok": 1, "failed": 1}, "UNKNOWN": {"invalid": 2}},
+                         stats["requests"])
+        self.assertEqual({"buckets": [1, 2], "count": 2, "sum": 2000},
+                         stats["latency_us"]["LOGIN"])
+        self.assertEqual([1000], stats["bounds"])
+
+        text = metrics.prometheus_text()
+        self.assertIn('bc_requests_total{type="LOGIN",outcome="failed"} 1\n', text)
+        self.assertIn('bc_requests_total{type="UNKNOWN",outcome="invalid"} 2\n', text)
+        self.assertIn('bc_request_duration_seconds_bucket{type="LOGIN",le="0.001"} 1\n', text)
+        self.assertIn('bc_request_duration_seconds_bucket{type="LOGIN",le="+Inf"} 2\n', text)
+        self.assertIn('bc_request_duration_seconds_sum{type="LOGIN"} 0.002000\n', text)
+        self.assertIn('bc_request_duration_seconds_count{type="LOGIN"} 2\n', text)
@@ -0,0 +1,184 @@
+# pylint: disable=missing-docstring
+
+import os
+import tempfile
+import threading
+import unittest
+
+from bc.common.comm_util import RequestGenerator
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.persistence import MutationLog
+from bc.server.server import RequestHandler, ServerBase
+from bc.server.server_util import TimeSlotState
+from bc.test.test_server.test_async_server import make_state
+
+PROVIDER = ServiceProvider("Haakon Doctorsen")
+FIRST = TimeSlot(2019, 2, 20, 15)
+SECOND = TimeSlot(2019, 2, 20, 17)
+
+class TestMutationLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def open_state(self):
+        state = make_state()
+        mutation_log = MutationLog(self.directory.name, sync=False)
+        replayed = mutation_log.recover(state)
+        state.mutation_log = mutation_log
+        self.addCleanup(mutation_log.close)
+        return state, replayed
+
+    def set_state(self, state, time_slot, slot_state, owner):
+        ts_info = state.find_time_slot_info(PROVIDER, time_slot)
+        state.set_time_slot_state(PROVIDER, ts_info, slot_state, owner)
+
+    def assert_slot(self, state, time_slot, slot_state, owner):
+        ts_info = state.find_time_slot_info(PROVIDER, time_slot)
+        self.assertEqual((slot_state, owner), (ts_info.state, ts_info.owner))
+
+    def test_recover_replays_log(self):
+        state, replayed = self.open_state()
+        self.assertEqual(0, replayed)
+        self.set_state(state, FIRST, TimeSlotState.IN_BASKET, 3)
+        self.set_state(state, FIRST, TimeSlotState.RESERVED, 3)
+        self.set_state(state, SECOND, TimeSlotState.IN_BASKET, 4)
+        state.mutation_log.close()
+
+        state, replayed = self.open_state()
+        self.assertEqual(3, replayed)
+        self.assert_slot(state, FIRST, TimeSlotState.RESERVED, 3)
+        self.assert_slot(state, SECOND, TimeSlotState.IN_BASKET, 4)
+        self.assertEqual(3, state.mutation_log.last_lsn())
+
+    def test_snapshot_limits_replay(self):
+        state, _ = self.open_state()
+        self.set_state(state, FIRST, TimeSlotState.IN_BASKET, 3)
+        self.set_state(state, FIRST, TimeSlotState.RESERVED, 3)
+        state.mutation_log.snapshot(state)
+        self.assertEqual(0, state.mutation_log.mutations_since_snapshot())
+        self.set_state(state, SECOND, TimeSlotState.IN_BASKET, 4)
+        state.mutation_log.close()
+
+        state, replayed = self.open_state()
+        self.assertEqual(1, replayed)
+        self.assert_slot(state, FIRST, TimeSlotState.RESERVED, 3)
+        self.assert_slot(state, SECOND, TimeSlotState.IN_BASKET, 4)
+        self.assertEqual(3, state.mutation_log.last_lsn())
+
+    def test_torn_tail_is_cut_off(self):
+        state, _ = self.open_state()
+        self.set_state(state, FIRST, TimeSlotState.IN_BASKET, 3)
+        self.set_state(state, SECOND, TimeSlotState.IN_BASKET, 4)
+        state.mutation_log.close()
+
+        segment = os.path.join(self.directory.name, sorted(os.listdir(self.directory.name))[-1])
+        with open(segment, "r+b") as segment_file:
+            segment_file.truncate(os.path.getsize(segment) - 3)
+
+        state, replayed = self.open_state()
+        self.assertEqual(1, replayed)
+        self.assert_slot(state, FIRST, TimeSlotState.IN_BASKET, 3)
+        self.assert_slot(state, SECOND, TimeSlotState.AVAILABLE, 0)
+
+        # New mutations continue the log after the torn one.
+        self.set_state(state, SECOND, TimeSlotState.IN_BASKET, 5)
+        state.mutation_log.close()
+        state, replayed = self.open_state()
+        self.assertEqual(2, replayed)
+        self.assert_slot(state, SECOND, TimeSlotState.IN_BASKET, 5)
+
+    def test_recovered_baskets_are_held(self):
+        state, _ = self.open_state()
+        self.set_state(state, FIRST, TimeSlotState.IN_BASKET, 3)
+        state.mutation_log.close()
+
+        state, _ = self.open_state()
+        self.assertIsNotNone(state.next_hold_deadline())
+
+    def test_concurrent_appends_share_syncs(self):
+        mutation_log = MutationLog(self.directory.name)
+        mutation_log.recover(make_state())
+        self.addCleanup(mutation_log.close)
+
+        def append():
+            for _ in range(20):
+                lsn = mutation_log.append(PROVIDER, FIRST, TimeSlotState.AVAILABLE, 0)
+                mutation_log.durable(lsn).result(timeout=10)
+
+        threads = [threading.Thread(target=append) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(160, mutation_log.last_lsn())
+        self.assertTrue(mutation_log.durable(160).done())
+        self.assertLessEqual(mutation_log.syncs, 160)
+
+    def test_write_errors_fail_later_waiters(self):
+        mutation_log = MutationLog(self.directory.name, sync=False)
+        mutation_log.recover(make_state())
+        self.addCleanup(mutation_log.close)
+
+        def fail(_items):
+            raise OSError("Disk full.")
+
+        mutation_log._write = fail
+        lsn = mutation_log.append(PROVIDER, FIRST, TimeSlotState.AVAILABLE, 0)
+        with self.assertRaises(OSError):
+            mutation_log.durable(lsn).result(timeout=10)
+
+        # Nothing becomes durable after the error, so the later waiters fail at once.
+        future = mutation_log.durable(lsn)
+        self.assertTrue(future.done())
+        self.assertIsInstance(future.exception(), OSError)
+        with self.assertRaises(RuntimeError):
+            mutation_log.append(PROVIDER, FIRST, TimeSlotState.AVAILABLE, 0)
+
+    def test_failed_appends_leave_the_state_unchanged(self):
+        state, _ = self.open_state()
+        handler = RequestHandler(ServerBase(state))
+        reply = handler.handle(RequestGenerator.msg_login("User1", "pwd1").to_bytes(), "127.0.0.1")
+        req_gen = RequestGenerator.from_login_reply(reply)
+        state.mutation_log.close()
+
+        with self.assertRaises(RuntimeError):
+            self.set_state(state, FIRST, TimeSlotState.IN_BASKET, 3)
+        self.assert_slot(state, FIRST, TimeSlotState.AVAILABLE, 0)
+
+        appointments = list(state.appointments_in_state(TimeSlotState.AVAILABLE))[:3]
+        reply = handler.handle(req_gen.msg_add_appointments_to_basket(appointments).to_bytes(),
+                               "127.0.0.1")
+        self.assertFalse(reply.data()["OK"])
+        self.assertEqual(len(list(state.appointments_in_state(TimeSlotState.AVAILABLE))),
+                         len(list(make_state().appointments_in_state(TimeSlotState.AVAILABLE))))
+
+    def test_unloggable_time_slots_are_rejected(self):
+        state, _ = self.open_state()
+        lsn = state.mutation_log.last_lsn()
+        with self.assertRaises(ValueError):
+            state.mutation_log.append(PROVIDER, TimeSlot(1 << 16, 1, 1, 0),
+                                      TimeSlotState.AVAILABLE, 0)
+        self.assertEqual(lsn, state.mutation_log.last_lsn())
+
+    def test_booking_survives_restart(self):
+        state, _ = self.open_state()
+        handler = RequestHandler(ServerBase(state))
+        reply = handler.handle(RequestGenerator.msg_login("User1", "pwd1").to_bytes(), "127.0.0.1")
+        client_id = reply.data()["client_id"]
+        req_gen = RequestGenerator.from_login_reply(reply)
+
+        appointments = list(state.appointments_in_state(TimeSlotState.AVAILABLE))
+        handler.handle(req_gen.msg_add_appointment_to_basket(appointments[0]).to_bytes(),
+                       "127.0.0.1")
+        handler.handle(req_gen.msg_confirm_booking().to_bytes(), "127.0.0.1")
+        handler.server.durable_future().result(timeout=10)
+        state.mutation_log.close()
+
+        state, _ = self.open_state()
+        booked = state.appointments_of_owner(client_id, TimeSlotState.RESERVED)
+        self.assertEqual([str(appointments[0])], list(map(str, booked)))
+
+if __name__ == '__main__':
+    unittest.main()
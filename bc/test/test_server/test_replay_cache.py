@@ -0,0 +1,41 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.server.replay_cache import ReplayCache
+from bc.test.test_server.test_admission import FakeClock
+
+class TestReplayCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ReplayCache(ttl=10.0, max_entries=3, clock=self.clock)
+
+    def test_replies_expire(self):
+        self.cache.put((1, 0), "ADD", "first")
+        self.clock.now = 5.0
+        self.cache.put((1, 1), "ADD", "second")
+        self.assertEqual("first", self.cache.get((1, 0), "ADD"))
+
+        self.clock.now = 10.0
+        self.assertIsNone(self.cache.get((1, 0), "ADD"))
+        self.assertEqual("second", self.cache.get((1, 1), "ADD"))
+        self.assertEqual(1, len(self.cache))
+        self.assertEqual(2, self.cache.hits)
+
+    def test_discard(self):
+        self.cache.put((1, 0), "ADD", "first")
+        self.cache.discard((1, 0))
+        self.cache.discard((1, 1))
+        self.assertIsNone(self.cache.get((1, 0), "ADD"))
+        self.assertEqual(0, len(self.cache))
+
+    def test_replies_are_bounded(self):
+        for request_id in range(5):
+            self.cache.put((1, request_id), "ADD", request_id)
+        self.assertEqual(3, len(self.cache))
+        self.assertIsNone(self.cache.get((1, 1), "ADD"))
+        self.assertEqual(4, self.cache.get((1, 4), "ADD"))
+
+    def test_replies_are_only_replayed_to_the_same_request_type(self):
+        self.cache.put((1, 0), "ADD", "added")
+        self.assertIsNone(self.cache.get((1, 0), "REMOVE"))
@@ -0,0 +1,37 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.common.comm_util import PreencodedMessage
+from bc.server.reply_cache import ReplyCache
+
+def reply(text: str) -> PreencodedMessage:
+    return PreencodedMessage({"OK": True, "text": text})
+
+class TestReplyCache(unittest.TestCase):
+    def test_least_recently_used_reply_is_evicted(self):
+        cache = ReplyCache(max_entries=2)
+        first, second, third = reply("1"), reply("2"), reply("3")
+        cache.put(1, first)
+        cache.put(2, second)
+        self.assertIs(first, cache.get(1))
+
+        cache.put(3, third)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(2))
+        self.assertIs(first, cache.get(1))
+        self.assertIs(third, cache.get(3))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_size_is_limited(self):
+        size = reply("x" * 100).encoded_size()
+        cache = ReplyCache(max_bytes=4 * size)
+        for key in range(5):
+            cache.put(key, reply("x" * 100))
+        self.assertEqual(4, len(cache))
+        self.assertIsNone(cache.get(0))
+
+        # Too large to be cached.
+        cache.put("large", reply("x" * 101))
+        self.assertIsNone(cache.get("large"))
+        self.assertEqual(4, len(cache))
@@ -0,0 +1,213 @@
+# pylint: disable=missing-docstring
+
+import time
+import unittest
+
+from bc.common.comm_util import Message, RequestGenerator, StreamMessage
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.admission import PendingRequests, RateLimit, RateLimiter
+from bc.server.server import MAX_BATCH_SIZE, DeferredReply, RequestHandler, ServerBase
+from bc.test.test_server.test_async_server import make_state
+
+class TestRequestHandler(unittest.TestCase):
+    def setUp(self):
+        self.handler = RequestHandler(ServerBase(make_state()))
+
+        reply = self.request(RequestGenerator.msg_login("User1", "pwd1"))
+        self.client_id = reply["client_id"]
+        self.token = reply["token"]
+        self.req_gen = RequestGenerator(self.client_id, token=self.token)
+
+    def request(self, message: Message):
+        return self.handler.handle(message.to_bytes(), "127.0.0.1").data()
+
+    def test_list_available_appointments_pages(self):
+        request = self.req_gen.msg_list_available_appointments("Haakon Doctorsen", limit=1)
+        reply = self.request(request)
+        self.assertEqual("Haakon Doctorsen:\t2019-2-20-15", reply["text"])
+
+        request = self.req_gen.msg_list_available_appointments("Haakon Doctorsen", limit=1,
+                                                               cursor=reply["cursor"])
+        reply = self.request(request)
+        self.assertEqual("Haakon Doctorsen:\t2019-2-20-17", reply["text"])
+
+        request = self.req_gen.msg_list_available_appointments("Haakon Doctorsen", limit=1,
+                                                               cursor=reply["cursor"])
+        reply = self.request(request)
+        self.assertEqual("", reply["text"])
+        self.assertNotIn("cursor", reply)
+
+    def test_list_available_appointments_time_range(self):
+        request = self.req_gen.msg_list_available_appointments(
+            None, time_from=TimeSlot(2019, 2, 20, 16), time_to=TimeSlot(2019, 2, 21, 0))
+        reply = self.request(request)
+        self.assertEqual("Haakon Doctorsen:\t2019-2-20-17", reply["text"])
+
+    def test_invalid_filter_is_rejected(self):
+        request = self.req_gen.msg_list_available_appointments(None, limit=0)
+        reply = self.request(request)
+        self.assertFalse(reply["OK"])
+
+    def test_streamed_listing(self):
+        req_gen = RequestGenerator(self.client_id, stream_listings=True, token=self.token)
+        request = req_gen.msg_list_available_appointments(None, limit=2)
+        reply = self.handler.handle(request.to_bytes(), "127.0.0.1")
+        self.assertIsInstance(reply, StreamMessage)
+
+        messages = [message.data() for message in reply.chunks(chunk_size=1)]
+        self.assertEqual(3, len(messages))
+        self.assertEqual(["Haakon Doctorsen:\t2019-2-20-15"], list(map(str, messages[0]["chunk"])))
+        self.assertEqual(["Haakon Doctorsen:\t2019-2-20-17"], list(map(str, messages[1]["chunk"])))
+        self.assertTrue(messages[2]["end_of_stream"])
+        self.assertEqual("Haakon Doctorsen:\t2019-2-20-17", str(messages[2]["cursor"]))
+        for message in messages:
+            self.assertEqual(request.data()["request_id"], message["request_id"])
+
+    def test_listings_are_cached_by_version(self):
+        request = self.req_gen.msg_list_available_appointments("Haakon Doctorsen")
+        first = self.handler.handle(request.to_bytes(), "127.0.0.1")
+        second = self.handler.handle(request.to_bytes(), "127.0.0.1")
+        self.assertEqual(1, self.handler.server.listing_cache.hits)
+        self.assertEqual(first.to_bytes(), second.to_bytes())
+
+        request = self.req_gen.msg_list_available_appointments("Haakon Doctorsen")
+        reply = Message.from_bytes(self.handler.handle(request.to_bytes(), "127.0.0.1").to_bytes())
+        self.assertEqual(request.data()["request_id"], reply.data()["request_id"])
+        self.assertEqual(first.data()["text"], reply.data()["text"])
+
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        self.assertTrue(self.request(self.req_gen.msg_add_appointment_to_basket(appointment))["OK"])
+        reply = self.request(self.req_gen.msg_list_available_appointments("Haakon Doctorsen"))
+        self.assertEqual("Haakon Doctorsen:\t2019-2-20-17", reply["text"])
+        self.assertEqual(2, self.handler.server.listing_cache.hits)
+
+    def test_stats(self):
+        self.request(self.req_gen.msg_list_basket())
+        self.request(RequestGenerator(self.client_id).msg_list_basket())
+        self.handler.handle(b"garbage", "127.0.0.1")
+
+        reply = self.request(RequestGenerator.msg_stats())
+        self.assertTrue(reply["OK"])
+        self.assertEqual({"LOGIN": {"ok": 1}, "LIST_BASKET": {"ok": 1, "denied": 1},
+                          "UNKNOWN": {"invalid": 1}},
+                         reply["stats"]["requests"])
+        self.assertIn('bc_requests_total{type="LIST_BASKET",outcome="denied"} 1\n', reply["text"])
+        self.assertIn("bc_sessions 1\n", reply["text"])
+
+        # Only clients on the same host get the metrics.
+        reply = self.handler.handle(RequestGenerator.msg_stats().to_bytes(), "10.0.0.1").data()
+        self.assertEqual("Access denied.", reply["text"])
+
+    def test_rate_limits(self):
+        self.handler.server.rate_limiter = RateLimiter({None: RateLimit(1.0, 2.0)})
+        self.assertTrue(self.request(self.req_gen.msg_list_basket())["OK"])
+        self.assertTrue(self.request(self.req_gen.msg_list_basket())["OK"])
+
+        reply = self.request(self.req_gen.msg_list_basket())
+        self.assertEqual("Too many requests.", reply["text"])
+        self.assertLessEqual(900, reply["retry_after_ms"])
+        self.assertTrue(self.request(RequestGenerator.msg_stats())["OK"])
+
+        # Requests without a session are denied without taking tokens of the client.
+        reply = self.request(RequestGenerator(self.client_id).msg_list_basket())
+        self.assertEqual("Access denied.", reply["text"])
+
+        stats = self.request(RequestGenerator.msg_stats())["stats"]
+        self.assertEqual({"ok": 2, "rejected": 1, "denied": 1}, stats["requests"]["LIST_BASKET"])
+
+    def test_load_is_shed(self):
+        self.handler.server.pending = PendingRequests(1, retry_after=0.25)
+        deferred = self.handler.begin(RequestGenerator.msg_login("User2", "pwd2").to_bytes(),
+                                      "127.0.0.1")
+
+        # The login is pending until its password is verified.
+        reply = self.request(self.req_gen.msg_list_basket())
+        self.assertEqual("Server busy.", reply["text"])
+        self.assertEqual(250, reply["retry_after_ms"])
+        self.assertTrue(self.request(RequestGenerator.msg_stats())["OK"])
+
+        self.assertTrue(self.handler.finish(deferred).data()["OK"])
+
+        # The future runs its callbacks after waking up its waiters.
+        deadline = time.monotonic() + 5
+        while len(self.handler.server.pending) > 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertTrue(self.request(self.req_gen.msg_list_basket())["OK"])
+
+    def test_retried_requests_are_not_applied_twice(self):
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        for request in (self.req_gen.msg_add_appointment_to_basket(appointment),
+                        self.req_gen.msg_confirm_booking()):
+            first = self.request(request)
+            self.assertTrue(first["OK"])
+            self.assertEqual(first, self.request(request))
+        self.assertEqual(2, self.handler.server.replays.hits)
+
+        # The request ids of another session of the client are not replayed.
+        reply = self.request(RequestGenerator.msg_login("User1", "pwd1"))
+        req_gen = RequestGenerator(self.client_id, token=reply["token"])
+        reply = self.request(req_gen.msg_add_appointment_to_basket(appointment))
+        self.assertEqual("Time slot not available.", reply["text"])
+
+    def test_login_checks_password(self):
+        reply = self.request(RequestGenerator.msg_login("User2", "pwd1"))
+        self.assertFalse(reply["OK"])
+        self.assertNotIn("client_id", reply)
+
+        reply = self.request(RequestGenerator.msg_login("Nobody", "pwd1"))
+        self.assertFalse(reply["OK"])
+
+        request = RequestGenerator.msg_login("User2", "pwd2")
+        reply = self.request(request)
+        self.assertTrue(reply["OK"])
+        self.assertEqual(2, reply["client_id"])
+        self.assertEqual(request.data()["request_id"], reply["request_id"])
+
+    def test_login_is_deferred(self):
+        reply = self.handler.begin(RequestGenerator.msg_login("User2", "pwd2").to_bytes(),
+                                   "127.0.0.1")
+        self.assertIsInstance(reply, DeferredReply)
+        self.assertTrue(self.handler.finish(reply).data()["OK"])
+
+    def test_requests_need_a_session_token(self):
+        self.assertTrue(self.request(self.req_gen.msg_list_basket())["OK"])
+
+        # The session is not tied to the address of the client.
+        reply = self.handler.handle(self.req_gen.msg_list_basket().to_bytes(), "10.0.0.2")
+        self.assertTrue(reply.data()["OK"])
+
+        for req_gen in (RequestGenerator(self.client_id),
+                        RequestGenerator(self.client_id, token="forged"),
+                        RequestGenerator(self.client_id + 1, token=self.token)):
+            reply = self.request(req_gen.msg_list_basket())
+            self.assertFalse(reply["OK"])
+            self.assertEqual("Access denied.", reply["text"])
+
+    def test_batch_is_all_or_nothing(self):
+        haakon = ServiceProvider("Haakon Doctorsen")
+        first = Appointment(haakon, TimeSlot(2019, 2, 20, 15))
+        second = Appointment(haakon, TimeSlot(2019, 2, 20, 17))
+        self.assertTrue(self.request(self.req_gen.msg_add_appointment_to_basket(second))["OK"])
+
+        reply = self.request(self.req_gen.msg_add_appointments_to_basket([first, second]))
+        self.assertFalse(reply["OK"])
+        self.assertEqual("Time slot not available.", reply["text"])
+        self.assertEqual(str(second), str(reply["appointment"]))
+        self.assertEqual(str(second), self.request(self.req_gen.msg_list_basket())["text"])
+
+        reply = self.request(self.req_gen.msg_add_appointments_to_basket([first, first]))
+        self.assertEqual("Duplicate appointment.", reply["text"])
+
+        self.assertTrue(self.request(self.req_gen.msg_add_appointment_to_basket(first))["OK"])
+        self.assertTrue(self.request(self.req_gen.msg_confirm_booking())["OK"])
+        self.assertEqual("", self.request(self.req_gen.msg_list_basket())["text"])
+
+        reply = self.request(self.req_gen.msg_cancel_appointments([first, second]))
+        self.assertTrue(reply["OK"])
+        self.assertEqual("", self.request(self.req_gen.msg_list_booked_appointments())["text"])
+
+    def test_batch_size_is_limited(self):
+        appointment = Appointment(ServiceProvider("Haakon Doctorsen"), TimeSlot(2019, 2, 20, 15))
+        reply = self.request(self.req_gen.msg_remove_appointments_from_basket(
+            [appointment] * (MAX_BATCH_SIZE + 1)))
+        self.assertFalse(reply["OK"])
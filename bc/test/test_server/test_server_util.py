@@ -1,11 +1,59 @@
 # pylint: disable=missing-docstring
 
+import random
 import unittest
 
 from pathlib import Path
 
-from bc.server.server_util import ServerState, TimeSlotInfo, TimeSlotState, User
-from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.credentials import verify_password
+from bc.server.server_util import (ChunkedSlotSnapshot, MAX_USER_ID, ServerState, TimeSlotInfo,
+                                   TimeSlotState, User)
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+
+def check_snapshot_updates(test, make_snapshot):
+    # Applies random changes to a snapshot made by `make_snapshot(version, time_slots)` and
+    # checks its listings against a set of the time slots.
+    rng = random.Random(0)
+    universe = [TimeSlot(2019, month, day, hour)
+                for month in (1, 2) for day in range(1, 5) for hour in range(0, 24, 3)]
+    expected = set(universe[::2])
+    snapshot = make_snapshot(1, sorted(expected))
+
+    for version in range(2, 300):
+        added = rng.sample(universe, rng.randrange(4))
+        removed = rng.sample(universe, rng.randrange(4))
+        snapshot = snapshot.updated(added, removed, version)
+        expected = (expected - set(removed)) | set(added)
+
+        test.assertEqual(sorted(expected), list(snapshot.time_slots()))
+        test.assertEqual(len(expected), len(snapshot))
+
+        time_from, time_to, after = sorted(rng.sample(universe, 3))
+        test.assertEqual([ts for ts in sorted(expected) if time_from <= ts < time_to],
+                         list(snapshot.time_slots(time_from, time_to)))
+        test.assertEqual([ts for ts in sorted(expected) if time_from <= ts and after < ts],
+                         list(snapshot.time_slots(time_from, after=after)))
+
+class _SmallChunkedSlotSnapshot(ChunkedSlotSnapshot):
+    chunk_size = 4
+
+class TestChunkedSlotSnapshot(unittest.TestCase):
+    def test_updates_match_sorted_lists(self):
+        check_snapshot_updates(
+            self, lambda version, time_slots: _SmallChunkedSlotSnapshot(version,
+                                                                        tuple(time_slots)))
+
+    def test_updates_copy_one_chunk_at_any_size(self):
+        for years in (10, 1000):
+            time_slots = tuple(TimeSlot(year, 1, 1, hour)
+                               for year in range(2000, 2000 + years) for hour in range(24))
+            snapshot = ChunkedSlotSnapshot(1, time_slots)
+            for added, removed in (([], [time_slots[len(time_slots) // 2]]),
+                                   ([TimeSlot(2000, 1, 2, 0)], [])):
+                updated = snapshot.updated(added, removed, 2)
+                # A change replaces one chunk, by two if it splits it; the others are shared.
+                shared = set(map(id, snapshot.chunks())) & set(map(id, updated.chunks()))
+                self.assertEqual(len(snapshot.chunks()) - 1, len(shared))
 
 class TestServerState(unittest.TestCase):
     def test_load_users(self):
@@ -13,8 +61,20 @@ class TestServerState(unittest.TestCase):
         state = ServerState()
         state.load_users(str(users_file))
 
-        expected = [User(1, "User1", "pwd1"), User(2, "User2", "pwd2")]
-        self.assertEqual(expected, state.users)
+        self.assertEqual([(1, "User1"), (2, "User2")],
+                         [(user.user_id, user.username) for user in state.users])
+        self.assertTrue(verify_password("pwd1", state.users[0].password_hash))
+        self.assertFalse(verify_password("pwd2", state.users[0].password_hash))
+        self.assertIs(state.users[1], state.find_user("User2"))
+        self.assertIsNone(state.find_user("User3"))
+
+    def test_user_ids_fit_the_owners(self):
+        state = ServerState()
+        state.users = [User(MAX_USER_ID, "User1", "")]
+        for user_id in (0, MAX_USER_ID + 1):
+            with self.assertRaises(ValueError):
+                state.users = [User(user_id, "User1", "")]
+        self.assertEqual(MAX_USER_ID, state.find_user("User1").user_id)
 
     def test_load_service_providers(self):
         filename = Path(__file__).parent / "service_providers.txt"
@@ -32,3 +92,134 @@ class TestServerState(unittest.TestCase):
             }
 
         self.assertEqual(expected, state.service_provider_db)
+
+    def test_find_time_slot_info(self):
+        filename = Path(__file__).parent / "service_providers.txt"
+        state = ServerState()
+        state.load_service_providers(filename)
+
+        provider = ServiceProvider("Knud Tennistrenersen")
+        ts_info = state.find_time_slot_info(provider, TimeSlot(2019, 2, 25, 17))
+        self.assertIs(state.service_provider_db[provider][1], ts_info)
+
+        self.assertIsNone(state.find_time_slot_info(provider, TimeSlot(2019, 2, 25, 18)))
+        self.assertIsNone(state.find_time_slot_info(ServiceProvider("Nobody"),
+                                                    TimeSlot(2019, 2, 25, 17)))
+
+    def test_owner_and_state_indexes_follow_transitions(self):
+        filename = Path(__file__).parent / "service_providers.txt"
+        state = ServerState()
+        state.load_service_providers(filename)
+
+        provider = ServiceProvider("Knud Tennistrenersen")
+        time_slot = TimeSlot(2019, 2, 25, 17)
+        ts_info = state.find_time_slot_info(provider, time_slot)
+
+        state.set_time_slot_state(provider, ts_info, TimeSlotState.IN_BASKET, 1)
+        self.assertEqual([str(Appointment(provider, time_slot))],
+                         list(map(str, state.appointments_of_owner(1, TimeSlotState.IN_BASKET))))
+        self.assertEqual([], state.appointments_of_owner(2, TimeSlotState.IN_BASKET))
+        self.assertEqual(4, len(list(state.appointments_in_state(TimeSlotState.AVAILABLE))))
+
+        state.set_time_slot_state(provider, ts_info, TimeSlotState.RESERVED, 1)
+        self.assertEqual([], state.appointments_of_owner(1, TimeSlotState.IN_BASKET))
+        self.assertEqual(1, len(state.appointments_of_owner(1, TimeSlotState.RESERVED)))
+
+        state.set_time_slot_state(provider, ts_info, TimeSlotState.AVAILABLE, 0)
+        self.assertEqual([], state.appointments_of_owner(1, TimeSlotState.RESERVED))
+        self.assertEqual(["2019-2-25-15", "2019-2-25-17", "2019-2-25-19"],
+                         [str(appointment.time_slot()) for appointment
+                          in state.appointments_in_state(TimeSlotState.AVAILABLE, provider)])
+
+    def test_appointments_in_state_time_range_and_pages(self):
+        filename = Path(__file__).parent / "service_providers.txt"
+        state = ServerState()
+        state.load_service_providers(filename)
+
+        def listing(**kwargs):
+            return [str(appointment) for appointment
+                    in state.appointments_in_state(TimeSlotState.AVAILABLE, **kwargs)]
+
+        knud = ServiceProvider("Knud Tennistrenersen")
+        self.assertEqual(["Knud Tennistrenersen:\t2019-2-25-17"],
+                         listing(provider=knud, time_from=TimeSlot(2019, 2, 25, 16),
+                                 time_to=TimeSlot(2019, 2, 25, 19)))
+
+        first_page = list(state.appointments_in_state(TimeSlotState.AVAILABLE, limit=3))
+        self.assertEqual(3, len(first_page))
+        self.assertEqual(["Knud Tennistrenersen:\t2019-2-25-17",
+                          "Knud Tennistrenersen:\t2019-2-25-19"],
+                         listing(after=first_page[-1], limit=3))
+
+        # Few slots are in the basket, so they are sorted instead of scanning the range.
+        ts_info = state.find_time_slot_info(knud, TimeSlot(2019, 2, 25, 19))
+        state.set_time_slot_state(knud, ts_info, TimeSlotState.IN_BASKET, 1)
+        self.assertEqual(["Knud Tennistrenersen:\t2019-2-25-19"],
+                         [str(appointment) for appointment in state.appointments_in_state(
+                             TimeSlotState.IN_BASKET, time_from=TimeSlot(2019, 2, 25, 16))])
+
+    def test_expired_basket_holds_are_released(self):
+        now = [0.0]
+        state = ServerState(basket_ttl=10.0, clock=lambda: now[0])
+        state.load_service_providers(Path(__file__).parent / "service_providers.txt")
+
+        knud = ServiceProvider("Knud Tennistrenersen")
+        infos = [state.find_time_slot_info(knud, TimeSlot(2019, 2, 25, hour))
+                 for hour in (15, 17, 19)]
+        for ts_info in infos:
+            state.set_time_slot_state(knud, ts_info, TimeSlotState.IN_BASKET, 1)
+        self.assertEqual(10.0, state.next_hold_deadline())
+
+        # Booked and removed slots are no longer held.
+        state.set_time_slot_state(knud, infos[0], TimeSlotState.RESERVED, 1)
+        state.set_time_slot_state(knud, infos[1], TimeSlotState.AVAILABLE, 0)
+
+        now[0] = 9.0
+        self.assertEqual(0, state.release_expired_holds())
+
+        now[0] = 10.0
+        self.assertEqual(1, state.release_expired_holds())
+        self.assertEqual((TimeSlotState.RESERVED, 1), (infos[0].state, infos[0].owner))
+        self.assertEqual((TimeSlotState.AVAILABLE, 0), (infos[2].state, infos[2].owner))
+        self.assertEqual([], state.appointments_of_owner(1, TimeSlotState.IN_BASKET))
+        self.assertIsNone(state.next_hold_deadline())
+
+    def test_basket_holds_can_be_disabled(self):
+        state = ServerState(basket_ttl=None, clock=lambda: 1e9)
+        state.load_service_providers(Path(__file__).parent / "service_providers.txt")
+
+        knud = ServiceProvider("Knud Tennistrenersen")
+        ts_info = state.find_time_slot_info(knud, TimeSlot(2019, 2, 25, 15))
+        state.set_time_slot_state(knud, ts_info, TimeSlotState.IN_BASKET, 1)
+        self.assertEqual(0, state.release_expired_holds())
+        self.assertEqual(TimeSlotState.IN_BASKET, ts_info.state)
+
+    def test_snapshots_are_immutable_and_published_by_batches(self):
+        state = ServerState()
+        state.load_service_providers(Path(__file__).parent / "service_providers.txt")
+
+        knud = ServiceProvider("Knud Tennistrenersen")
+        infos = [state.find_time_slot_info(knud, TimeSlot(2019, 2, 25, hour))
+                 for hour in (15, 17, 19)]
+        snapshot = state.provider_snapshot(knud)
+        listing = state.available_appointments(knud)
+
+        state.set_time_slot_state(knud, infos[0], TimeSlotState.IN_BASKET, 1)
+        self.assertEqual(3, len(snapshot))
+        self.assertEqual(3, len(list(listing)))
+        self.assertEqual(2, len(state.provider_snapshot(knud)))
+        self.assertGreater(state.provider_snapshot(knud).version, snapshot.version)
+        self.assertEqual([str(Appointment(knud, infos[0].time_slot))],
+                         list(map(str, state.owned_appointments(1, TimeSlotState.IN_BASKET))))
+
+        snapshot = state.provider_snapshot(knud)
+        with state.batch():
+            for ts_info in infos[1:]:
+                state.set_time_slot_state(knud, ts_info, TimeSlotState.IN_BASKET, 1)
+            self.assertIs(snapshot, state.provider_snapshot(knud))
+            self.assertEqual(1, len(state.owned_appointments(1, TimeSlotState.IN_BASKET)))
+
+        self.assertEqual(0, len(state.provider_snapshot(knud)))
+        self.assertEqual(3, len(state.owned_appointments(1, TimeSlotState.IN_BASKET)))
+        self.assertEqual(["Haakon Doctorsen:\t2019-2-20-15", "Haakon Doctorsen:\t2019-2-20-17"],
+                         list(map(str, state.available_appointments())))
@@ -0,0 +1,65 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.server.sessions import SessionTable
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestSessionTable(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sessions = SessionTable(ttl=10.0, max_sessions=3, clock=self.clock)
+
+    def test_lookup(self):
+        token = self.sessions.create(7)
+        self.assertEqual(7, self.sessions.lookup(token))
+        self.assertIsNone(self.sessions.lookup("forged"))
+
+        self.assertTrue(self.sessions.remove(token))
+        self.assertIsNone(self.sessions.lookup(token))
+
+    def test_idle_sessions_expire(self):
+        idle = self.sessions.create(1)
+        used = self.sessions.create(2)
+
+        self.clock.now = 8.0
+        self.assertEqual(2, self.sessions.lookup(used))
+
+        self.clock.now = 15.0
+        self.assertIsNone(self.sessions.lookup(idle))
+        self.assertEqual(2, self.sessions.lookup(used))
+        self.assertEqual(1, len(self.sessions))
+
+        self.clock.now = 30.0
+        self.assertEqual(1, self.sessions.expire())
+        self.assertEqual(0, len(self.sessions))
+
+    def test_full_table_evicts_least_recently_used(self):
+        tokens = [self.sessions.create(i) for i in range(3)]
+
+        self.clock.now = 1.0
+        self.sessions.lookup(tokens[0])
+        self.sessions.lookup(tokens[2])
+
+        new = self.sessions.create(3)
+        self.assertEqual(3, len(self.sessions))
+        self.assertIsNone(self.sessions.lookup(tokens[1]))
+        self.assertEqual(0, self.sessions.lookup(tokens[0]))
+        self.assertEqual(3, self.sessions.lookup(new))
+
+    def test_memory_stays_flat(self):
+        for i in range(1000):
+            self.clock.now = float(i)
+            self.sessions.create(i)
+
+        self.assertEqual(3, len(self.sessions))
+        self.assertLess(len(self.sessions._expiry._heap), 100)
+
+if __name__ == '__main__':
+    unittest.main()
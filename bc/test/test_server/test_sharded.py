@@ -0,0 +1,289 @@
+# pylint: disable=missing-docstring
+
+import asyncio
+import multiprocessing
+import unittest
+
+from bc.common.comm_util import Message, PICKLE_CODEC, RequestGenerator
+from bc.common.entities import Appointment, ServiceProvider, TimeSlot
+from bc.server.sharded import (partition_service_providers, serve_sharded, shard_of, ShardRouter,
+                               ShardServer)
+from bc.server.server_util import ServerState, TimeSlotInfo, TimeSlotState
+from bc.test.test_server.test_async_server import DELIMITER, login, make_state, send_request
+
+HAAKON = ServiceProvider("Haakon Doctorsen")
+KNUD = ServiceProvider("Knud Tennistrenersen")
+KARI = ServiceProvider("Kari Tannlegesen")
+
+def make_sharded_state() -> ServerState:
+    state = make_state()
+    state.service_provider_db = {
+        provider: [TimeSlotInfo(TimeSlot(2019, 2, 20, hour), TimeSlotState.AVAILABLE, 0)
+                   for hour in (15, 17)]
+        for provider in (HAAKON, KNUD, KARI)
+        }
+    return state
+
+def appointment(provider: ServiceProvider, hour: int) -> Appointment:
+    return Appointment(provider, TimeSlot(2019, 2, 20, hour))
+
+def serve(address_queue) -> None:
+    serve_sharded(make_sharded_state(), "127.0.0.1", 0, 2, address_queue=address_queue)
+
+class TestShardedServer(unittest.TestCase):
+    def setUp(self):
+        # Knud is on the other shard than Haakon and Kari.
+        self.assertNotEqual(shard_of(HAAKON.name(), 2), shard_of(KNUD.name(), 2))
+        self.assertEqual(shard_of(HAAKON.name(), 2), shard_of(KARI.name(), 2))
+
+    def run_sharded(self, test):
+        async def run():
+            state = make_sharded_state()
+            shards = []
+            for partition in partition_service_providers(state.service_provider_db, 2):
+                shard_state = ServerState()
+                shard_state.service_provider_db = partition
+                shards.append(ShardServer(0, shard_state))
+                await shards[-1].start()
+
+            providers = list(state.service_provider_db.keys())
+            state.service_provider_db = dict()
+            router = ShardRouter("127.0.0.1", 0, state, providers,
+                                 [shard.address() for shard in shards], connections_per_shard=2)
+            await router.start()
+            self.shards = shards
+            self.router = router
+            try:
+                return await asyncio.wait_for(test(router.address()), 10)
+            finally:
+                await router.close()
+                for shard in shards:
+                    await shard.close()
+
+        return asyncio.run(run())
+
+    def test_partitions_have_every_provider(self):
+        state = make_sharded_state()
+        partitions = partition_service_providers(state.service_provider_db, 2)
+        for partition in partitions:
+            self.assertEqual([HAAKON, KNUD, KARI], list(partition.keys()))
+
+        self.assertEqual([2, 0, 2], [len(ts_infos) for ts_infos in partitions[0].values()])
+        self.assertEqual([0, 2, 0], [len(ts_infos) for ts_infos in partitions[1].values()])
+
+    def test_listings_are_merged_in_order(self):
+        async def test(address):
+            req_gen = await login(address, 1)
+            reply = await send_request(address, req_gen.msg_list_available_appointments(None))
+            everything = reply.data()["text"]
+
+            pages = []
+            cursor = None
+            while True:
+                request = req_gen.msg_list_available_appointments(None, limit=4, cursor=cursor)
+                reply = (await send_request(address, request)).data()
+                pages.append(reply["text"])
+                cursor = reply.get("cursor")
+                if cursor is None:
+                    return everything, pages
+
+        everything, pages = self.run_sharded(test)
+        self.assertEqual([str(appointment(provider, hour)) for provider in (HAAKON, KNUD, KARI)
+                          for hour in (15, 17)],
+                         everything.split("\n"))
+        self.assertEqual(everything, "\n".join(pages))
+        self.assertEqual(2, len(pages))
+
+    def test_batches_across_shards_are_all_or_nothing(self):
+        async def test(address):
+            first = await login(address, 1)
+            second = await login(address, 2)
+
+            taken = appointment(KNUD, 17)
+            reply = await send_request(address, second.msg_add_appointment_to_basket(taken))
+            self.assertTrue(reply.data()["OK"])
+
+            batch = [appointment(HAAKON, 15), appointment(KARI, 15), taken]
+            reply = (await send_request(address, first.msg_add_appointments_to_basket(batch)))
+            self.assertFalse(reply.data()["OK"])
+            self.assertEqual(str(taken), str(reply.data()["appointment"]))
+            reply = await send_request(address, first.msg_list_basket())
+            self.assertEqual("", reply.data()["text"])
+
+            batch[2] = appointment(KNUD, 15)
+            reply = await send_request(address, first.msg_add_appointments_to_basket(batch))
+            self.assertTrue(reply.data()["OK"])
+            reply = await send_request(address, first.msg_list_basket())
+            self.assertEqual([str(appointment(HAAKON, 15)), str(appointment(KNUD, 15)),
+                              str(appointment(KARI, 15))],
+                             reply.data()["text"].split("\n"))
+
+            reply = await send_request(address, first.msg_confirm_booking())
+            self.assertTrue(reply.data()["OK"])
+            reply = await send_request(address, first.msg_confirm_booking())
+            self.assertEqual("No appointments in basket.", reply.data()["text"])
+
+            reply = await send_request(address, first.msg_cancel_appointments(batch))
+            self.assertTrue(reply.data()["OK"])
+            reply = await send_request(address, first.msg_list_booked_appointments())
+            self.assertEqual("", reply.data()["text"])
+
+        self.run_sharded(test)
+
+    def expire_hold(self, provider, hour):
+        # Puts the slot back as if its basket hold expired.
+        for shard in self.shards:
+            ts_info = shard.server_state.find_time_slot_info(provider, TimeSlot(2019, 2, 20, hour))
+            if ts_info is not None:
+                shard.server_state.set_time_slot_state(provider, ts_info,
+                                                       TimeSlotState.AVAILABLE, 0)
+
+    def test_failed_remove_batches_are_undone(self):
+        async def test(address):
+            req_gen = await login(address, 1)
+            batch = [appointment(HAAKON, 15), appointment(KNUD, 15)]
+            reply = await send_request(address, req_gen.msg_add_appointments_to_basket(batch))
+            self.assertTrue(reply.data()["OK"])
+
+            send_batches = self.router._send_batches
+
+            async def expire_after_dry_run(request_data, batches, dry_run=False):
+                replies = await send_batches(request_data, batches, dry_run)
+                if dry_run:
+                    self.expire_hold(KNUD, 15)
+                return replies
+
+            self.router._send_batches = expire_after_dry_run
+            reply = await send_request(address, req_gen.msg_remove_appointments_from_basket(batch))
+            self.assertFalse(reply.data()["OK"])
+            self.assertEqual(str(batch[1]), str(reply.data()["appointment"]))
+
+            # Haakon's slot was removed and added back.
+            reply = await send_request(address, req_gen.msg_list_basket())
+            self.assertEqual(str(batch[0]), reply.data()["text"])
+
+        self.run_sharded(test)
+
+    def test_confirm_booking_is_not_atomic_across_shards(self):
+        async def test(address):
+            req_gen = await login(address, 1)
+            batch = [appointment(HAAKON, 15), appointment(KNUD, 15)]
+            reply = await send_request(address, req_gen.msg_add_appointments_to_basket(batch))
+            self.assertTrue(reply.data()["OK"])
+
+            self.expire_hold(KNUD, 15)
+            reply = await send_request(address, req_gen.msg_confirm_booking())
+            self.assertTrue(reply.data()["OK"])
+            reply = await send_request(address, req_gen.msg_list_booked_appointments())
+            self.assertEqual(str(batch[0]), reply.data()["text"])
+
+        self.run_sharded(test)
+
+    def test_outcomes_of_relayed_replies_are_counted(self):
+        async def test(address):
+            first = await login(address, 1)
+            second = await login(address, 2)
+            for req_gen in (first, second):
+                await send_request(address,
+                                   req_gen.msg_add_appointment_to_basket(appointment(KNUD, 15)))
+            await send_request(address, first.msg_confirm_booking())
+            await send_request(address, second.msg_confirm_booking())
+
+        self.run_sharded(test)
+        requests = self.router.metrics.stats()["requests"]
+        self.assertEqual({"ok": 1, "failed": 1}, requests["ADD_APPOINTMENT_TO_BASKET"])
+        self.assertEqual({"ok": 1, "failed": 1}, requests["CONFIRM_BOOKING"])
+
+    def test_retried_batches_are_replayed(self):
+        async def test(address):
+            req_gen = await login(address, 1)
+            request = req_gen.msg_add_appointments_to_basket([appointment(HAAKON, 15),
+                                                              appointment(KNUD, 15)])
+            first = (await send_request(address, request)).data()
+            retried = (await send_request(address, request)).data()
+            return first, retried
+
+        first, retried = self.run_sharded(test)
+        self.assertTrue(first["OK"])
+        self.assertEqual(first, retried)
+
+    def test_retries_wait_for_the_request_in_flight(self):
+        async def test(address):
+            req_gen = await login(address, 1)
+            request = req_gen.msg_add_appointment_to_basket(appointment(KNUD, 15))
+
+            released = asyncio.Event()
+            shard_request = self.router._shard_request
+            forwarded = []
+
+            async def held_back(shard, msg_bytes, streamed=False):
+                forwarded.append(msg_bytes)
+                await released.wait()
+                return await shard_request(shard, msg_bytes, streamed)
+
+            self.router._shard_request = held_back
+            first = asyncio.ensure_future(send_request(address, request))
+            while not forwarded:
+                await asyncio.sleep(0.01)
+            retried = asyncio.ensure_future(send_request(address, request))
+            await asyncio.sleep(0.05)
+            released.set()
+
+            return forwarded, (await first).data(), (await retried).data()
+
+        forwarded, first, retried = self.run_sharded(test)
+        self.assertEqual(1, len(forwarded))
+        self.assertTrue(first["OK"])
+        self.assertEqual(first, retried)
+
+    def test_subscriptions_are_not_supported(self):
+        async def test(address):
+            req_gen = await login(address, 1)
+            return await send_request(address, req_gen.msg_subscribe([HAAKON.name()]))
+
+        reply = self.run_sharded(test).data()
+        self.assertEqual("Subscriptions are not supported by the sharded server.", reply["text"])
+
+    def test_pickle_clients_and_sessions(self):
+        async def send_pickled(address, request):
+            reader, writer = await asyncio.open_connection(*address)
+            try:
+                writer.write(request.to_bytes(PICKLE_CODEC) + DELIMITER)
+                reply = await reader.readuntil(DELIMITER)
+                return Message.from_bytes(reply[:-len(DELIMITER)]).data()
+            finally:
+                writer.close()
+
+        async def test(address):
+            req_gen = await login(address, 1)
+            request = req_gen.msg_add_appointment_to_basket(appointment(KNUD, 15))
+            reply = await send_pickled(address, request)
+            self.assertTrue(reply["OK"])
+            self.assertEqual(request.data()["request_id"], reply["request_id"])
+
+            reply = await send_pickled(address, RequestGenerator(1).msg_list_basket())
+            self.assertEqual("Access denied.", reply["text"])
+
+        self.run_sharded(test)
+
+    def test_serve_sharded_in_processes(self):
+        address_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=serve, args=(address_queue,))
+        process.start()
+        try:
+            address = tuple(address_queue.get(timeout=30))
+
+            async def test():
+                req_gen = await login(address, 1)
+                reply = await send_request(address, req_gen.msg_add_appointments_to_basket(
+                    [appointment(HAAKON, 15), appointment(KNUD, 15)]))
+                self.assertTrue(reply.data()["OK"])
+                reply = await send_request(address, req_gen.msg_list_basket())
+                return reply.data()["text"]
+
+            text = asyncio.run(asyncio.wait_for(test(), 10))
+            self.assertEqual([str(appointment(HAAKON, 15)), str(appointment(KNUD, 15))],
+                             text.split("\n"))
+        finally:
+            process.terminate()
+            process.join()
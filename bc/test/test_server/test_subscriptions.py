@@ -0,0 +1,110 @@
+# pylint: disable=missing-docstring
+
+import unittest
+
+from bc.common.comm_util import BINARY_CODEC, Message, PICKLE_CODEC, RequestGenerator
+from bc.common.entities import ServiceProvider, TimeSlot
+from bc.server.server import RequestHandler, ServerBase
+from bc.server.server_util import TimeSlotState
+from bc.server.subscriptions import event_message, Subscriber, SubscriptionHub
+from bc.test.test_server.test_async_server import make_state
+
+HAAKON = ServiceProvider("Haakon Doctorsen")
+KNUD = ServiceProvider("Knud Tennistrenersen")
+
+class RecordingSubscriber(Subscriber):
+    def __init__(self, codec=BINARY_CODEC):
+        Subscriber.__init__(self, codec)
+        self.messages = []
+
+    def push(self, message: bytes) -> None:
+        self.messages.append(message)
+
+    def events(self):
+        result = []
+        for message in self.messages:
+            data = self.codec.decode(message)
+            result.append((str(data["service_provider"]),
+                           {state: list(map(str, time_slots))
+                            for state, time_slots in data["events"].items()}))
+        return result
+
+class TestSubscriptionHub(unittest.TestCase):
+    def test_messages_are_encoded_once_per_codec(self):
+        hub = SubscriptionHub()
+        subscribers = [RecordingSubscriber(), RecordingSubscriber(),
+                       RecordingSubscriber(PICKLE_CODEC)]
+        for subscriber in subscribers:
+            hub.subscribe(subscriber, [HAAKON])
+
+        hub.publish({HAAKON: {TimeSlot(2019, 2, 20, 15): TimeSlotState.IN_BASKET}})
+        self.assertIs(subscribers[0].messages[0], subscribers[1].messages[0])
+        for subscriber in subscribers:
+            self.assertEqual([("Haakon Doctorsen", {"in_basket": ["2019-2-20-15"]})],
+                             subscriber.events())
+
+    def test_subscriptions_are_replaced(self):
+        hub = SubscriptionHub()
+        subscriber = RecordingSubscriber()
+        hub.subscribe(subscriber, [HAAKON])
+        hub.subscribe(subscriber, [KNUD])
+        self.assertEqual((0, 1), (hub.subscriber_count(HAAKON), hub.subscriber_count(KNUD)))
+
+        hub.publish({HAAKON: {TimeSlot(2019, 2, 20, 15): TimeSlotState.IN_BASKET},
+                     KNUD: {TimeSlot(2019, 2, 20, 15): TimeSlotState.RESERVED}})
+        self.assertEqual([("Knud Tennistrenersen", {"reserved": ["2019-2-20-15"]})],
+                         subscriber.events())
+
+        hub.unsubscribe(subscriber)
+        self.assertEqual((0, 0), (len(hub), hub.subscriber_count(KNUD)))
+
+    def test_event_message_groups_time_slots_by_state(self):
+        message = event_message(HAAKON, {TimeSlot(2019, 2, 20, 17): TimeSlotState.AVAILABLE,
+                                         TimeSlot(2019, 2, 20, 16): TimeSlotState.RESERVED,
+                                         TimeSlot(2019, 2, 20, 15): TimeSlotState.AVAILABLE})
+        self.assertEqual(["2019-2-20-15", "2019-2-20-17"],
+                         list(map(str, message["events"]["available"])))
+        self.assertEqual(["2019-2-20-16"], list(map(str, message["events"]["reserved"])))
+
+class TestSubscribe(unittest.TestCase):
+    def setUp(self):
+        self.server = ServerBase(make_state())
+        self.handler = RequestHandler(self.server)
+        reply = self.handler.handle(RequestGenerator.msg_login("User1", "pwd1").to_bytes(),
+                                    "127.0.0.1").data()
+        self.req_gen = RequestGenerator(reply["client_id"], token=reply["token"])
+        self.subscriber = RecordingSubscriber()
+
+    def request(self, message: Message, subscriber=None):
+        reply = self.handler.begin(message.to_bytes(), "127.0.0.1", BINARY_CODEC, subscriber)
+        return reply.data()
+
+    def test_changes_are_pushed(self):
+        reply = self.request(self.req_gen.msg_subscribe(["Haakon Doctorsen"]), self.subscriber)
+        self.assertTrue(reply["OK"])
+
+        slots = list(self.server.server_state.available_appointments(HAAKON))
+        self.request(self.req_gen.msg_add_appointments_to_basket(slots))
+        self.request(self.req_gen.msg_confirm_booking())
+        self.assertEqual([("Haakon Doctorsen", {"in_basket": ["2019-2-20-15", "2019-2-20-17"]}),
+                          ("Haakon Doctorsen", {"reserved": ["2019-2-20-15", "2019-2-20-17"]})],
+                         self.subscriber.events())
+
+        reply = self.request(self.req_gen.msg_subscribe([]), self.subscriber)
+        self.assertTrue(reply["OK"])
+        self.request(self.req_gen.msg_cancel_appointments(slots))
+        self.assertEqual(2, len(self.subscriber.messages))
+
+    def test_invalid_subscriptions(self):
+        reply = self.request(self.req_gen.msg_subscribe(["Haakon Doctorsen"]))
+        self.assertEqual("Subscriptions need a persistent connection.", reply["text"])
+
+        reply = self.request(self.req_gen.msg_subscribe(["Haakon Doctorsen", "Nobody"]),
+                             self.subscriber)
+        self.assertEqual("Unknown service provider.", reply["text"])
+        self.assertEqual("Nobody", reply["service_provider"].name())
+        self.assertEqual(0, len(self.server.subscriptions))
+
+        reply = self.request(RequestGenerator(1).msg_subscribe(["Haakon Doctorsen"]),
+                             self.subscriber)
+        self.assertEqual("Access denied.", reply["text"])
@@ -1,12 +1,24 @@
+import logging
 import sys
 
+import bc.server.async_server
 import bc.server.server
+import bc.server.sharded
 import bc.client.client
 
 def main():
     if "server" in sys.argv:
         print("Starting main.")
-        bc.server.server.server_main()
+        logging.basicConfig(level=logging.DEBUG if "verbose" in sys.argv else logging.INFO,
+                            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        columnar = "columnar" in sys.argv
+        durable = "durable" in sys.argv
+        if "sharded" in sys.argv:
+            bc.server.sharded.server_main(columnar, durable)
+        elif "async" in sys.argv:
+            bc.server.async_server.server_main(columnar, durable)
+        else:
+            bc.server.server.server_main(columnar, durable)
     else:
         print("Starting client.")
         bc.client.client.client_main()